@@ -0,0 +1,113 @@
+"""Benchmark custom pixel selection methods against their masked-array versions."""
+
+import time
+
+import click
+import numpy
+from rio_tiler_mosaic.methods.base import MosaicMethodBase
+
+from landsat_mosaic_tiler.pixel_methods import CountValidMethod, LastBandHigh
+
+
+class LegacyLastBandHigh(MosaicMethodBase):
+    """LastBandHigh before the in-place rewrite."""
+
+    @property
+    def data(self):
+        """Return data and mask."""
+        if self.tile is not None:
+            return self.tile.data[:-1], ~self.tile.mask[0] * 255
+        else:
+            return None, None
+
+    def feed(self, tile: numpy.ma.array):
+        """Add data to tile."""
+        if self.tile is None:
+            self.tile = tile
+            return
+
+        pidex = (
+            numpy.bitwise_and(tile.data[-1] > self.tile.data[-1], ~tile.mask)
+            | self.tile.mask
+        )
+
+        mask = numpy.where(pidex, tile.mask, self.tile.mask)
+        self.tile = numpy.ma.where(pidex, tile, self.tile)
+        self.tile.mask = mask
+
+
+class LegacyCountValidMethod(MosaicMethodBase):
+    """CountValidMethod before the in-place rewrite."""
+
+    def feed(self, tile):
+        """Add data to tile."""
+        tile = numpy.ma.array(~tile.mask * 1, mask=tile.mask)
+        if self.tile is None:
+            self.tile = tile
+            return
+
+        mask = numpy.bitwise_or(~tile.mask, ~self.tile.mask)
+        self.tile = numpy.ma.array(self.tile.data + tile.data, fill_value=0)
+        self.tile.mask = ~mask
+
+
+def make_stack(scenes: int, bands: int, size: int, nodata: float, seed: int = 0):
+    """Random uint16 tiles masked the same way `mosaic_tiler` does."""
+    rng = numpy.random.RandomState(seed)
+    stack = []
+    for _ in range(scenes):
+        data = rng.randint(0, 10000, size=(bands, size, size)).astype(numpy.uint16)
+        mask = numpy.where(rng.rand(size, size) < nodata, 0, 255).astype(numpy.uint8)
+        stack.append((data, mask))
+    return stack
+
+
+def run(method, stack):
+    """Feed a whole stack to a fresh method instance, return (seconds, data)."""
+    tiles = []
+    for data, mask in stack:
+        tile = numpy.ma.array(data)
+        tile.mask = mask == 0
+        tiles.append(tile)
+
+    pixsel = method()
+    start = time.perf_counter()
+    for tile in tiles:
+        pixsel.feed(tile)
+    result = pixsel.data
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option("--scenes", type=int, multiple=True, default=[2, 5, 10, 15])
+@click.option("--bands", type=int, default=3)
+@click.option("--size", type=int, default=512)
+@click.option("--nodata", type=float, default=0.3, help="Fraction of masked pixels")
+@click.option("--repeat", type=int, default=5)
+def main(scenes, bands, size, nodata, repeat):
+    """Compare legacy and in-place pixel selection methods."""
+    pairs = [
+        ("lastband", LegacyLastBandHigh, LastBandHigh),
+        ("count", LegacyCountValidMethod, CountValidMethod),
+    ]
+    for n in scenes:
+        stack = make_stack(n, bands, size, nodata)
+        for name, legacy, method in pairs:
+            old = [run(legacy, stack) for _ in range(repeat)]
+            new = [run(method, stack) for _ in range(repeat)]
+
+            (_, (old_data, old_mask)), (_, (new_data, new_mask)) = old[0], new[0]
+            identical = numpy.array_equal(old_data, new_data) and numpy.array_equal(
+                old_mask, new_mask
+            )
+
+            old_t = min(t for t, _ in old) * 1000
+            new_t = min(t for t, _ in new) * 1000
+            click.echo(
+                f"{name:>8} scenes={n:<3} legacy={old_t:8.2f}ms new={new_t:8.2f}ms "
+                f"speedup={old_t / new_t:5.1f}x identical={identical}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark the fused post-processing against the band by band version."""
+
+import time
+
+import click
+import numpy
+from rio_color.operations import parse_operations
+from rio_color.utils import scale_dtype, to_math_type
+from rio_tiler.utils import linear_rescale
+
+from landsat_mosaic_tiler.utils import post_process_tile
+
+
+def legacy_post_process_tile(tile, mask, rescale=None, color_formula=None):
+    """post_process_tile before the lookup table rewrite."""
+    if rescale:
+        rescale_arr = (tuple(map(float, rescale.split(","))),) * tile.shape[0]
+        for bdx in range(tile.shape[0]):
+            tile[bdx] = numpy.where(
+                mask,
+                linear_rescale(
+                    tile[bdx], in_range=rescale_arr[bdx], out_range=[0, 255]
+                ),
+                0,
+            )
+        tile = tile.astype(numpy.uint8)
+
+    if color_formula:
+        if issubclass(tile.dtype.type, numpy.floating):
+            tile = tile.astype(numpy.int16)
+
+        tile[tile < 0] = 0
+        for ops in parse_operations(color_formula):
+            tile = scale_dtype(ops(to_math_type(tile)), numpy.uint8)
+
+    return tile
+
+
+def make_tile(dtype, bands, size, nodata, seed=0):
+    """Random tile and mask."""
+    rng = numpy.random.default_rng(seed)
+    if numpy.dtype(dtype).kind == "f":
+        tile = rng.uniform(-1.2, 1.2, (bands, size, size)).astype(dtype)
+    else:
+        tile = rng.integers(0, 20000, (bands, size, size)).astype(dtype)
+    mask = numpy.where(rng.random((size, size)) < nodata, 0, 255).astype(numpy.uint8)
+    return tile, mask
+
+
+def run(func, tile, mask, rescale, color_formula):
+    """Time one call (the tile is copied as both versions may write to it)."""
+    tile = tile.copy()
+    start = time.perf_counter()
+    result = func(tile, mask, rescale=rescale, color_formula=color_formula)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option("--bands", type=int, default=3)
+@click.option("--size", type=int, default=512)
+@click.option("--nodata", type=float, default=0.3, help="Fraction of masked pixels")
+@click.option("--repeat", type=int, default=5)
+def main(bands, size, nodata, repeat):
+    """Compare legacy and fused post-processing."""
+    cases = [
+        ("uint16", "0,16000", None),
+        ("uint16", "0,16000", "gamma RGB 3.5 sigmoidal RGB 15 0.35"),
+        ("uint16", "0,16000", "gamma G 1.05, gamma B 1.1, saturation 1.7"),
+        ("uint16", None, "gamma RGB 2"),
+        ("float32", "-1,1", None),
+        ("float64", "-1,1", "sigmoidal RGB 10 0.5"),
+    ]
+    for dtype, rescale, color_formula in cases:
+        tile, mask = make_tile(dtype, bands, size, nodata)
+        old = [
+            run(legacy_post_process_tile, tile, mask, rescale, color_formula)
+            for _ in range(repeat)
+        ]
+        new = [
+            run(post_process_tile, tile, mask, rescale, color_formula)
+            for _ in range(repeat)
+        ]
+        identical = numpy.array_equal(old[0][1], new[0][1])
+        old_t = min(t for t, _ in old) * 1000
+        new_t = min(t for t, _ in new) * 1000
+        click.echo(
+            f"{dtype:>8} rescale={str(rescale):<8} ops={str(color_formula):<42} "
+            f"legacy={old_t:8.2f}ms new={new_t:8.2f}ms "
+            f"speedup={old_t / new_t:5.1f}x identical={identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Benchmark tile requests end to end on a synthetic local mosaic.
+
+Generates (or reuses) the `fixture.py` COGs and MosaicJSON, then calls the
+`tiles` and `npy_tiles` handlers for every combination of zoom, scale, format
+and pixel selection method, on tiles sampled over the mosaic. Runs offline:
+the Landsat PDS reader is swapped for the fixture reader.
+
+For each case the JSON report holds latency percentiles, bytes read (`rchar`
+of /proc/self/io, so Linux only), peak RSS and the mean time spent per stage:
+
+    - lookup: assets lookup in the mosaic
+    - read: per asset reads (summed over the reader threads)
+    - mosaic: pixel selection
+    - post_process: rescale and color operations
+    - encode: image/array encoding
+    - other: everything else (e.g. `numpy.save` of `npy` tiles)
+
+    python benchmarks/bench_tiles.py --zoom 8 --zoom 12 --output bench.json
+"""
+
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import product
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+import mercantile
+import numpy
+import rasterio
+
+import fixture
+
+STAGES = ["lookup", "read", "mosaic", "post_process", "encode"]
+ARRAY_FORMATS = ["npy", "array", "frame"]
+
+
+class StageTimer(object):
+    """Accumulate time spent in wrapped functions, by stage."""
+
+    def __init__(self):
+        """Create empty timer."""
+        self.times: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """Time calls of `func` as `stage` (not counting nested calls twice)."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            active = getattr(self._local, "stages", None)
+            if active is None:
+                active = self._local.stages = set()
+            if stage in active:
+                return func(*args, **kwargs)
+
+            active.add(stage)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                active.discard(stage)
+                with self._lock:
+                    self.times[stage] += elapsed
+
+        return wrapper
+
+    def pop(self) -> Dict[str, float]:
+        """Return and reset stage times."""
+        with self._lock:
+            times = {stage: self.times.get(stage, 0.0) for stage in STAGES}
+            self.times.clear()
+        return times
+
+
+def instrument(timer: StageTimer):
+    """Route the tiler through the fixture reader and time each stage."""
+    from rio_tiler import utils as rio_tiler_utils
+
+    from landsat_mosaic_tiler import pixel_methods, tilers
+    from landsat_mosaic_tiler.handlers import tiles as handler
+    from landsat_mosaic_tiler.quadkey_index import QuadkeyIndex
+
+    QuadkeyIndex.tile = timer.wrap("lookup", QuadkeyIndex.tile)
+    tilers.landsatTiler = timer.wrap("read", fixture.read_tile)
+    # Some methods (e.g. median) only compute the result in `data`
+    pixel_methods.pixSel = {
+        name: type(
+            method.__name__,
+            (method,),
+            {
+                "feed": timer.wrap("mosaic", method.feed),
+                "data": property(timer.wrap("mosaic", method.data.fget)),
+            },
+        )
+        for name, method in pixel_methods.pixSel.items()
+    }
+    handler.post_process_tile = timer.wrap("post_process", handler.post_process_tile)
+    rio_tiler_utils.render = timer.wrap("encode", rio_tiler_utils.render)
+    for name in ["encode_tile", "uniform_tile", "encode_npy", "encode_frame"]:
+        setattr(handler, name, timer.wrap("encode", getattr(handler, name)))
+
+
+def _import_times(code: str) -> Tuple[List[Dict], str]:
+    """Modules imported running `code` in a fresh interpreter, with their
+    import times (`python -X importtime`), and the error if it failed.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    modules, errors = [], []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            errors.append(line)
+            continue
+        if "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append(
+            {
+                "module": name.strip(),
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+
+    error = None
+    if process.returncode != 0:
+        error = errors[-1] if errors else f"exit code {process.returncode}"
+    return modules, error
+
+
+def profile_imports(module: str, top: int = 15) -> Dict:
+    """Import time of `module`, with the slowest packages it imports
+    (modules imported by the interpreter startup are not counted).
+    """
+    startup = {m["module"] for m in _import_times("pass")[0]}
+    modules, error = _import_times(f"import {module}")
+    if error:
+        return {"error": error}
+
+    modules = [m for m in modules if m["module"] not in startup]
+    # Top level packages only, e.g. `rasterio` but not `rasterio.env`
+    packages = [m for m in modules if "." not in m["module"] and m["module"] != module]
+    packages.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return {
+        "total_ms": sum(m["self_ms"] for m in modules),
+        "modules": len(modules),
+        "slowest": packages[:top],
+    }
+
+
+def bytes_read() -> Optional[int]:
+    """Bytes read by the process so far (None if not available)."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 if platform.system() != "Darwin" else peak / 1024 / 1024
+
+
+def sample_tiles(mosaic, zoom: int, count: int, seed: int = 0):
+    """Up to `count` tiles with assets, spread over the mosaic."""
+    bounds = mosaic.mosaic_def["bounds"]
+    candidates = [
+        tile
+        for tile in mercantile.tiles(*bounds, zooms=zoom)
+        if mosaic.tile(tile.x, tile.y, tile.z)
+    ]
+    if len(candidates) <= count:
+        return candidates
+
+    rng = numpy.random.default_rng(seed)
+    picks = sorted(rng.choice(len(candidates), size=count, replace=False))
+    return [candidates[idx] for idx in picks]
+
+
+def summarize(latencies, nbytes, stages, statuses) -> Dict:
+    """Aggregate per request measures of one case."""
+    latencies = numpy.array(latencies) * 1000
+    p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+    summary = {
+        "requests": len(latencies),
+        "statuses": dict(Counter(statuses)),
+        "latency_ms": {
+            "mean": float(latencies.mean()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": float(latencies.max()),
+        },
+        "bytes_read": None,
+        "stages_ms": {
+            stage: float(numpy.mean([times[stage] for times in stages]) * 1000)
+            for stage in STAGES + ["other"]
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if None not in nbytes:
+        summary["bytes_read"] = {
+            "mean": float(numpy.mean(nbytes)),
+            "total": int(numpy.sum(nbytes)),
+        }
+    return summary
+
+
+@click.command()
+@click.option(
+    "--fixture-dir",
+    type=click.Path(file_okay=False),
+    default=os.path.join(tempfile.gettempdir(), "landsat-mosaic-bench"),
+    show_default=True,
+)
+@click.option("--grid", type=int, default=3, help="Scenes per side of the grid")
+@click.option("--overlap", type=float, default=0.3, help="Scene overlap fraction")
+@click.option("--band-count", type=int, default=7)
+@click.option("--size", type=int, default=1024, help="Scene width in pixels")
+@click.option("--nodata", type=float, default=0.2, help="Nodata fraction per scene")
+@click.option("--zoom", "zooms", type=int, multiple=True, default=[8, 10, 12])
+@click.option("--scale", "scales", type=int, multiple=True, default=[1, 2])
+@click.option(
+    "--format",
+    "formats",
+    type=click.Choice(["png", "jpg", "webp", "tif", "bin"] + ARRAY_FORMATS),
+    multiple=True,
+    default=["png", "jpg", "npy"],
+)
+@click.option(
+    "--pixel-selection",
+    "methods",
+    multiple=True,
+    default=["first", "highest", "median"],
+)
+@click.option("--bands", default="4,3,2")
+@click.option("--expr", default=None, help="Band math expression (instead of bands)")
+@click.option("--rescale", default="0,10000", help="Rescale of image formats")
+@click.option("--color-ops", default=None)
+@click.option("--tiles", type=int, default=10, help="Tiles per zoom")
+@click.option("--repeat", type=int, default=1, help="Requests per tile")
+@click.option(
+    "--warm/--cold",
+    default=False,
+    help="Keep decoded windows cached between requests (default: cold reads)",
+)
+@click.option(
+    "--import-profile/--no-import-profile",
+    default=True,
+    help="Profile the import of the handlers in a fresh interpreter",
+)
+@click.option("--output", type=click.File("w"), default="-")
+def main(
+    fixture_dir,
+    grid,
+    overlap,
+    band_count,
+    size,
+    nodata,
+    zooms,
+    scales,
+    formats,
+    methods,
+    bands,
+    expr,
+    rescale,
+    color_ops,
+    tiles,
+    repeat,
+    warm,
+    import_profile,
+    output,
+):
+    """Run tile benchmark cases and write a JSON report."""
+    # Caches read their settings at import: disable them to render every tile
+    for name in ["TILE_CACHE_DIR", "TILE_CACHE_URL", "PYRAMID_ROOT"]:
+        os.environ.pop(name, None)
+    os.environ["MOSAIC_INDEX_SIDECAR"] = "TRUE"
+
+    start = time.perf_counter()
+    url = fixture.create_fixture(
+        fixture_dir,
+        grid=grid,
+        overlap=overlap,
+        band_count=band_count,
+        size=size,
+        nodata=nodata,
+    )
+    fixture_seconds = time.perf_counter() - start
+    fixture.use_fixture(fixture_dir)
+
+    from landsat_mosaic_tiler.cache import mosaic_cache, window_cache
+    from landsat_mosaic_tiler.handlers.tiles import npy_tiles, tiles as tile_handler
+
+    timer = StageTimer()
+    instrument(timer)
+    mosaic = mosaic_cache.get(url)
+
+    results = []
+    for zoom, scale, fmt, method in product(zooms, scales, formats, methods):
+        latencies, nbytes, stages, statuses = [], [], [], []
+        for tile in sample_tiles(mosaic, zoom, tiles):
+            for _ in range(repeat):
+                if not warm:
+                    window_cache.clear()
+
+                options = dict(
+                    url=url,
+                    z=tile.z,
+                    x=tile.x,
+                    y=tile.y,
+                    scale=scale,
+                    bands=None if expr else bands,
+                    expr=expr,
+                    pixel_selection=method,
+                )
+                timer.pop()
+                read_before = bytes_read()
+                start = time.perf_counter()
+                try:
+                    if fmt in ARRAY_FORMATS:
+                        response = npy_tiles(format=fmt, **options)
+                    else:
+                        response = tile_handler(
+                            ext=fmt, rescale=rescale, color_ops=color_ops, **options
+                        )
+                except Exception as err:
+                    click.echo(f"{tile}: {err}", err=True)
+                    response = ("ERROR",)
+                elapsed = time.perf_counter() - start
+                read_after = bytes_read()
+
+                times = timer.pop()
+                times["other"] = max(elapsed - sum(times.values()), 0.0)
+                latencies.append(elapsed)
+                stages.append(times)
+                statuses.append(response[0])
+                nbytes.append(
+                    read_after - read_before if read_before is not None else None
+                )
+
+        if not latencies:
+            continue
+
+        case = dict(zoom=zoom, scale=scale, format=fmt, pixel_selection=method)
+        summary = summarize(latencies, nbytes, stages, statuses)
+        results.append({"case": case, **summary})
+        click.echo(
+            f"z={zoom:<2} @{scale}x {fmt:<5} {method:<8} "
+            f"p50 {summary['latency_ms']['p50']:8.2f} ms  "
+            f"p99 {summary['latency_ms']['p99']:8.2f} ms",
+            err=True,
+        )
+
+    report = {
+        "fixture": dict(
+            path=url,
+            grid=grid,
+            overlap=overlap,
+            band_count=band_count,
+            size=size,
+            nodata=nodata,
+            seconds=fixture_seconds,
+        ),
+        "options": dict(
+            bands=None if expr else bands,
+            expr=expr,
+            rescale=rescale,
+            color_ops=color_ops,
+            tiles=tiles,
+            repeat=repeat,
+            warm=warm,
+        ),
+        "environment": dict(
+            python=platform.python_version(),
+            numpy=numpy.__version__,
+            gdal=rasterio.__gdal_version__,
+            cpu_count=os.cpu_count(),
+        ),
+        "results": results,
+    }
+    if import_profile:
+        report["imports"] = {
+            module: profile_imports(module)
+            for module in [
+                "landsat_mosaic_tiler.handlers.tiles",
+                "landsat_mosaic_tiler.handlers.mosaic",
+            ]
+        }
+    json.dump(report, output, indent=2)
+    output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
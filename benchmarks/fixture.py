@@ -0,0 +1,184 @@
+"""Synthetic Landsat-like COGs and MosaicJSON on local disk, for offline benchmarks.
+
+Scenes are laid out on a `grid` x `grid` UTM grid overlapping by `overlap`
+(fraction of the scene width), each with `band_count` uint16 COG bands named
+like the Landsat PDS files (`{root}/{sceneid}/{sceneid}_B{band}.TIF`) and a
+nodata collar covering `nodata` of its pixels. The mosaic is built with the
+same `MosaicBuilder` as the `/mosaic/create` endpoint, with its index and
+footprints sidecars.
+
+`read_tile` reads a scene from the fixture with the signature of
+`rio_tiler.io.landsat8.tile`, so it can stand in for the PDS reader.
+"""
+
+import json
+import os
+from datetime import date, timedelta
+from typing import Dict, Sequence, Tuple
+
+import numpy
+import rasterio
+from affine import Affine
+from rasterio.warp import transform as transform_coords
+from rio_tiler import reader
+
+from landsat_mosaic_tiler.cache import get_version
+from landsat_mosaic_tiler.footprints import Footprints, footprints_url
+from landsat_mosaic_tiler.quadkey_index import QuadkeyIndex, index_url
+from landsat_mosaic_tiler.stac import MosaicBuilder, Scene
+
+CRS = "EPSG:32613"
+ORIGIN = (300000.0, 4500000.0)  # north-west corner of the grid, UTM 13N
+SCENE_EXTENT = 185000.0  # meters, as a Landsat scene
+
+_root = None
+
+
+def _scene_id(path: int, row: int, day: date) -> str:
+    return f"LC08_L1TP_{path:03d}{row:03d}_{day:%Y%m%d}_{day:%Y%m%d}_01_T1"
+
+
+def _band_data(rng: numpy.random.Generator, size: int, band: int) -> numpy.ndarray:
+    """Smooth reflectance-like values (not pure noise, so encoders behave)."""
+    yy, xx = numpy.mgrid[0:size, 0:size] / size
+    base = 3000 + 2500 * numpy.sin(6 * xx + band) * numpy.cos(4 * yy - band)
+    noise = rng.normal(0, 150, (size, size))
+    return numpy.clip(base + noise, 1, 10000).astype(numpy.uint16)
+
+
+def _collar(size: int, nodata: float) -> int:
+    """Collar width (pixels) so that `nodata` of the scene is masked."""
+    return int(round(size * (1 - numpy.sqrt(1 - nodata)) / 2))
+
+
+def create_fixture(
+    root: str,
+    grid: int = 3,
+    overlap: float = 0.3,
+    band_count: int = 7,
+    size: int = 1024,
+    nodata: float = 0.2,
+    quadkey_zoom: int = 8,
+    minzoom: int = 7,
+    maxzoom: int = 12,
+    seed: int = 0,
+) -> str:
+    """Write scenes and mosaic under `root`, return the mosaic path.
+
+    An existing fixture with the same parameters is reused.
+    """
+    params = dict(
+        grid=grid,
+        overlap=overlap,
+        band_count=band_count,
+        size=size,
+        nodata=nodata,
+        quadkey_zoom=quadkey_zoom,
+        minzoom=minzoom,
+        maxzoom=maxzoom,
+        seed=seed,
+    )
+    mosaic_path = os.path.join(root, "mosaic.json")
+    params_path = os.path.join(root, "fixture.json")
+    if os.path.exists(params_path) and os.path.exists(mosaic_path):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return mosaic_path
+
+    rng = numpy.random.default_rng(seed)
+    resolution = SCENE_EXTENT / size
+    step = SCENE_EXTENT * (1 - overlap)
+    collar = _collar(size, nodata)
+
+    builder = MosaicBuilder(quadkey_zoom=quadkey_zoom, minzoom=minzoom, maxzoom=maxzoom)
+    for row in range(grid):
+        for col in range(grid):
+            day = date(2020, 6, 1) + timedelta(days=int(rng.integers(0, 90)))
+            sceneid = _scene_id(30 + col, 30 + row, day)
+            west, north = ORIGIN[0] + col * step, ORIGIN[1] - row * step
+
+            mask = numpy.zeros((size, size), dtype=bool)
+            mask[collar : size - collar, collar : size - collar] = True
+            profile = dict(
+                driver="COG",
+                dtype="uint16",
+                count=1,
+                width=size,
+                height=size,
+                crs=CRS,
+                transform=Affine(resolution, 0, west, 0, -resolution, north),
+                nodata=0,
+                compress="deflate",
+                blocksize=256,
+            )
+            os.makedirs(os.path.join(root, sceneid), exist_ok=True)
+            for band in range(1, band_count + 1):
+                path = os.path.join(root, sceneid, f"{sceneid}_B{band}.TIF")
+                with rasterio.open(path, "w", **profile) as dst:
+                    dst.write(numpy.where(mask, _band_data(rng, size, band), 0), 1)
+
+            # Footprint of the valid data
+            inset = collar * resolution
+            xs = [west + inset, SCENE_EXTENT + west - inset]
+            ys = [north - SCENE_EXTENT + inset, north - inset]
+            lons, lats = transform_coords(
+                CRS,
+                "EPSG:4326",
+                [xs[0], xs[1], xs[1], xs[0], xs[0]],
+                [ys[0], ys[0], ys[1], ys[1], ys[0]],
+            )
+            builder.add(
+                Scene(
+                    id=sceneid,
+                    pathrow=sceneid[10:16],
+                    cloud=float(rng.uniform(0, 30)),
+                    date=day.isoformat(),
+                    footprint=tuple(zip(lons, lats)),
+                )
+            )
+
+    mosaic_def = builder.mosaic_def()
+    with open(mosaic_path, "w") as f:
+        json.dump(mosaic_def, f)
+    with open(index_url(mosaic_path), "wb") as f:
+        index = QuadkeyIndex.from_mosaic_def(mosaic_def)
+        f.write(index.to_bytes(get_version(mosaic_path)))
+    footprints = Footprints.from_scenes(
+        builder.used_scenes(), version=mosaic_def["version"]
+    )
+    with open(footprints_url(mosaic_path), "wb") as f:
+        f.write(footprints.to_bytes())
+    with open(params_path, "w") as f:
+        json.dump(params, f)
+
+    return mosaic_path
+
+
+def use_fixture(root: str):
+    """Read scenes from `root` in `read_tile`."""
+    global _root
+    _root = root
+
+
+def read_tile(
+    sceneid: str,
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    bands: Sequence[str] = ("4", "3", "2"),
+    tilesize: int = 256,
+    pan: bool = False,
+    **kwargs: Dict,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Read fixture bands for a mercator tile (`pan` is ignored)."""
+    data, masks = [], []
+    for band in bands:
+        path = os.path.join(_root, sceneid, f"{sceneid}_B{band}.TIF")
+        with rasterio.open(path) as src_dst:
+            arr, mask = reader.tile(
+                src_dst, tile_x, tile_y, tile_z, tilesize=tilesize, **kwargs
+            )
+        data.append(arr)
+        masks.append(mask)
+
+    return numpy.concatenate(data), numpy.minimum.reduce(masks)
@@ -0,0 +1,107 @@
+"""Load test the local servers: requests/s and latency percentiles per server mode.
+
+Every server mode is started with `landsat-mosaic --server <mode>`, then
+`--concurrency` clients, each on its own (keep-alive when supported)
+connection, request the given paths in a loop.
+
+    python benchmarks/load_test.py \
+        --path "/tiles/9/150/194.png?url=dynamodb://us-west-2/mosaic"
+"""
+
+import http.client
+import subprocess
+import threading
+import time
+
+import click
+import numpy
+
+
+def _wait(port: int, timeout: float = 30):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/tiles/favicon.ico")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise Exception(f"Server on port {port} did not start")
+
+
+def _client(port, paths, count, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    for idx in range(count):
+        start = time.perf_counter()
+        try:
+            conn.request("GET", paths[idx % len(paths)])
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as err:
+            errors.append(str(err))
+            conn.close()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def load(port, paths, requests, concurrency):
+    """Run the load and return (requests/s, latencies in ms, errors)."""
+    latencies: list = []
+    errors: list = []
+    per_client = max(requests // concurrency, 1)
+    clients = [
+        threading.Thread(
+            target=_client, args=(port, paths, per_client, latencies, errors)
+        )
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, numpy.array(latencies) * 1000, errors
+
+
+@click.command()
+@click.option("--path", "paths", multiple=True, default=["/tiles/favicon.ico"])
+@click.option("--requests", type=int, default=2000)
+@click.option("--concurrency", type=int, default=16)
+@click.option(
+    "--server",
+    "servers",
+    type=click.Choice(["threaded", "asyncio"]),
+    multiple=True,
+    default=["threaded", "asyncio"],
+)
+@click.option("--port", type=int, default=8765)
+@click.option("--warmup", type=int, default=50, help="Requests before measuring")
+def main(paths, requests, concurrency, servers, port, warmup):
+    """Compare server modes on the same requests."""
+    for server in servers:
+        process = subprocess.Popen(
+            ["landsat-mosaic", "--port", str(port), "--server", server],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait(port)
+            load(port, paths, warmup, min(concurrency, warmup))
+            rps, latencies, errors = load(port, paths, requests, concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+
+        p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+        click.echo(
+            f"{server:>9}: {rps:8.1f} req/s  p50 {p50:7.2f} ms  p90 {p90:7.2f} ms  "
+            f"p99 {p99:7.2f} ms  errors {len(errors)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
 """landsat_mosaic_tiler."""
 
-import pkg_resources
+try:
+    from importlib.metadata import version as _version
+except ImportError:  # python < 3.8, pkg_resources is much slower to import
+    import pkg_resources
 
-version = pkg_resources.get_distribution(__package__).version
+    def _version(name):
+        return pkg_resources.get_distribution(name).version
+
+
+version = _version(__package__)
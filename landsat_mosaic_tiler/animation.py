@@ -0,0 +1,127 @@
+"""landsat_mosaic_tiler.animation: stream mosaic stacks into animated images."""
+
+import io
+import os
+from typing import List, Sequence
+
+import numpy
+from PIL import Image
+from rio_tiler_mosaic.methods.base import MosaicMethodBase
+
+from landsat_mosaic_tiler.utils import post_process_tile
+
+MAX_FRAMES = int(os.getenv("MAX_ANIMATION_FRAMES", 30))
+
+# Palette index reserved for masked pixels
+TRANSPARENT_INDEX = 255
+
+
+def to_frame(
+    tile: numpy.ndarray, mask: numpy.ndarray, colormap: numpy.ndarray = None
+) -> Image.Image:
+    """Quantize a post-processed uint8 tile to a paletted frame.
+
+    Masked pixels are set to `TRANSPARENT_INDEX`.
+    """
+    if tile.shape[0] == 1 and colormap is not None:
+        rgb = numpy.asarray(colormap)[:, :3].astype(numpy.uint8)[tile[0]]
+    elif tile.shape[0] == 1:
+        rgb = numpy.repeat(tile[0][..., None], 3, axis=2)
+    else:
+        rgb = numpy.moveaxis(tile[:3], 0, -1)
+
+    img = Image.fromarray(numpy.ascontiguousarray(rgb), "RGB").quantize(
+        colors=TRANSPARENT_INDEX, method=2  # fast octree
+    )
+    index = numpy.array(img)
+    index[mask == 0] = TRANSPARENT_INDEX
+
+    frame = Image.fromarray(index, "P")
+    frame.putpalette(img.getpalette()[: TRANSPARENT_INDEX * 3] + [0, 0, 0])
+    return frame
+
+
+class FrameStack(MosaicMethodBase):
+    """Turn every fed tile into an animation frame as soon as it is read.
+
+    Only the paletted frames (one byte per pixel) are kept, and the method
+    reports it is done once `max_frames` frames are stored so remaining reads
+    are cancelled.
+    """
+
+    def __init__(
+        self,
+        rescale: str = None,
+        color_formula: str = None,
+        colormap: numpy.ndarray = None,
+        max_frames: int = MAX_FRAMES,
+    ):
+        """Overwrite base and init FrameStack method."""
+        super(FrameStack, self).__init__()
+        self.rescale = rescale
+        self.color_formula = color_formula
+        self.colormap = colormap
+        self.max_frames = max_frames
+        self.frames: List[Image.Image] = []
+
+    @property
+    def is_done(self):
+        """Check if the frame cap is reached."""
+        return len(self.frames) >= self.max_frames
+
+    @property
+    def data(self):
+        """Return frames."""
+        if self.frames:
+            return self.frames, None
+        else:
+            return None, None
+
+    def feed(self, tile: numpy.ma.array):
+        """Post-process and quantize tile into a frame."""
+        if self.is_done:
+            return
+
+        mask = numpy.logical_not(numpy.ma.getmaskarray(tile)[0]).view(numpy.uint8) * 255
+        img = post_process_tile(
+            tile.data.copy(),
+            mask,
+            rescale=self.rescale,
+            color_formula=self.color_formula,
+        )
+        self.frames.append(to_frame(img.astype(numpy.uint8), mask, self.colormap))
+
+
+def _to_rgba(frame: Image.Image) -> Image.Image:
+    frame.info["transparency"] = TRANSPARENT_INDEX
+    return frame.convert("RGBA")
+
+
+def encode_animation(
+    frames: Sequence[Image.Image], img_format: str = "gif", duration: int = 300
+) -> bytes:
+    """Encode paletted frames to an animated GIF, APNG (png) or WebP."""
+    if img_format == "gif":
+        params = dict(optimize=True, transparency=TRANSPARENT_INDEX, disposal=2)
+    elif img_format == "png":
+        params = dict(disposal=1)
+    elif img_format == "webp":
+        params = dict(lossless=True)
+    else:
+        raise Exception(f"Unsupported animation format: {img_format}")
+
+    if img_format != "gif":
+        # APNG/WebP encoders don't handle paletted transparency
+        frames = [_to_rgba(frame) for frame in frames]
+
+    sio = io.BytesIO()
+    frames[0].save(
+        sio,
+        img_format,
+        save_all=True,
+        append_images=list(frames[1:]),
+        duration=duration,
+        loop=0,
+        **params,
+    )
+    return sio.getvalue()
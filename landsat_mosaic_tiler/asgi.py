@@ -0,0 +1,376 @@
+"""landsat_mosaic_tiler.asgi: serve the handlers outside of Lambda.
+
+`app` is an ASGI application calling the `tiles`, `mosaic` and `batch` route
+functions directly (no API Gateway event, no base64 round trip), with the
+CPU-bound GDAL/NumPy work running on a bounded thread pool. It can be run by
+any ASGI server (e.g. `uvicorn landsat_mosaic_tiler.asgi:app`) or by `serve`,
+a small asyncio HTTP/1.1 server with keep-alive and pipelining.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import zlib
+from concurrent import futures
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote
+
+from landsat_mosaic_tiler.handlers.batch import app as app_batch
+from landsat_mosaic_tiler.handlers.mosaic import app as app_mosaic
+from landsat_mosaic_tiler.handlers.tiles import app as app_tiles
+from lambda_proxy.proxy import API, ApigwPath
+
+ASGI_WORKERS = int(os.getenv("ASGI_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", 8))
+
+STATUS_CODES = {
+    "OK": 200,
+    "EMPTY": 204,
+    "NOK": 400,
+    "FOUND": 302,
+    "NOT_FOUND": 404,
+    "CONFLICT": 409,
+    "ERROR": 500,
+}
+
+# Responses that never have a body (nor a Content-Length, RFC 7230 3.3.2)
+NO_BODY_STATUSES = (204, 304)
+
+Response = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+def _error(status: int, message: str) -> Response:
+    body = json.dumps({"errorMessage": message}).encode()
+    return status, [("Content-Type", "application/json")], body
+
+
+def _compress(body: bytes, method: str) -> bytes:
+    wbits = {"gzip": zlib.MAX_WBITS | 16, "zlib": zlib.MAX_WBITS}.get(
+        method, -zlib.MAX_WBITS
+    )
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+
+class ThreadLocalAPI(API):
+    """API whose current event (and `host`) is kept per thread.
+
+    Requests are handled concurrently by the worker pool, each on one thread,
+    while the route functions read the event through the shared API object.
+    """
+
+    @property
+    def _request(self) -> threading.local:
+        return self.__dict__.setdefault("_local", threading.local())
+
+    @property  # type: ignore
+    def event(self) -> Dict:
+        """Event of the request handled by the current thread."""
+        return getattr(self._request, "event", {})
+
+    @event.setter
+    def event(self, event: Dict):
+        self._request.event = event
+
+    @property  # type: ignore
+    def request_path(self) -> Any:
+        """Path of the request handled by the current thread."""
+        return getattr(self._request, "request_path", None)
+
+    @request_path.setter
+    def request_path(self, request_path: Any):
+        self._request.request_path = request_path
+
+
+def thread_local(application: API) -> ThreadLocalAPI:
+    """Keep the current event of an API per thread."""
+    if not isinstance(application, ThreadLocalAPI):
+        application.__dict__.pop("event", None)
+        application.__dict__.pop("request_path", None)
+        application.__class__ = ThreadLocalAPI
+    return application
+
+
+class ASGIApp(object):
+    """ASGI application dispatching to lambda-proxy route functions."""
+
+    def __init__(
+        self,
+        mounts: Dict[str, API] = None,
+        workers: int = ASGI_WORKERS,
+        https: bool = False,
+    ):
+        """Mount APIs by path prefix."""
+        self.mounts = mounts or {
+            "/tiles": app_tiles,
+            "/mosaic": app_mosaic,
+            "/batch": app_batch,
+        }
+        for application in self.mounts.values():
+            thread_local(application).https = https
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def handle(
+        self, method: str, path: str, query: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        """Route a request and call its endpoint (runs on the worker pool)."""
+        for prefix, application in self.mounts.items():
+            if path.startswith(f"{prefix}/"):
+                break
+        else:
+            return _error(404, f"No view function for: {method} - {path}")
+
+        subpath = path[len(prefix) :]
+        route = application._url_matching(subpath, method)
+        if route is None:
+            return _error(404, f"No view function for: {method} - {path}")
+
+        params = dict(parse_qsl(query))
+        token = params.pop("access_token", None)
+        if route.token and not application._validate_token(token):
+            return _error(500, "Invalid access token")
+
+        # `API.host` (used to build tilejson urls) reads the current event, kept
+        # per worker thread (see `ThreadLocalAPI`)
+        event = {
+            "headers": headers,
+            "path": path,
+            "resource": f"{prefix}/{{proxy+}}",
+            "pathParameters": {"proxy": subpath[1:]},
+        }
+        application.event = event
+        application.request_path = ApigwPath(event)
+
+        kwargs = application._get_matching_args(route, subpath)
+        kwargs.update(params)
+        if method in ["POST", "PUT", "PATCH"] and body:
+            kwargs["body"] = body.decode()
+
+        try:
+            response = route.endpoint(**kwargs)
+        except Exception as err:
+            application.log.error(str(err))
+            response = (
+                "ERROR",
+                "application/json",
+                json.dumps({"errorMessage": str(err)}),
+            )
+
+        status = STATUS_CODES.get(response[0], response[0])
+        content = response[2]
+        content = content.encode() if isinstance(content, str) else bytes(content)
+        if status in NO_BODY_STATUSES:
+            content = b""
+
+        response_headers = {"Content-Type": response[1]}
+        if len(response) > 3:
+            response_headers.update(response[3].get("custom_headers", {}))
+        if route.cors:
+            response_headers["Access-Control-Allow-Origin"] = "*"
+            response_headers["Access-Control-Allow-Methods"] = ",".join(route.methods)
+            response_headers["Access-Control-Allow-Credentials"] = "true"
+        if route.cache_control:
+            response_headers["Cache-Control"] = (
+                route.cache_control if status == 200 else "no-cache"
+            )
+        if (
+            content
+            and route.compression
+            and route.compression in headers.get("accept-encoding", "")
+        ):
+            response_headers["Content-Encoding"] = route.compression
+            content = _compress(content, route.compression)
+
+        return status, list(response_headers.items()), content
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable):
+        """ASGI entrypoint."""
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    self.executor.shutdown(wait=False)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+        loop = asyncio.get_event_loop()
+        status, response_headers, content = await loop.run_in_executor(
+            self.executor,
+            self.handle,
+            scope["method"],
+            scope["path"],
+            scope["query_string"].decode(),
+            headers,
+            b"".join(chunks),
+        )
+
+        if status not in NO_BODY_STATUSES:
+            response_headers.append(("Content-Length", str(len(content))))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(k.encode(), v.encode()) for k, v in response_headers],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[Dict, bytes]]:
+    """Read one HTTP/1.x request, return its ASGI scope and body."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+
+    method, target, version = line.decode("latin-1").split()
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers.append((name.strip().lower(), value.strip()))
+
+    header_dict = dict(headers)
+    if "transfer-encoding" in header_dict:
+        raise ValueError("Chunked request bodies are not supported")
+
+    length = int(header_dict.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+
+    connection = header_dict.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        keep_alive = connection != "close"
+    else:
+        keep_alive = connection == "keep-alive"
+
+    path, _, query = target.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": version.split("/")[-1],
+        "method": method.upper(),
+        "scheme": "http",
+        "path": unquote(path),
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "keep_alive": keep_alive,
+    }
+    return scope, body
+
+
+async def _respond(app: Callable, scope: Dict, body: bytes) -> bytes:
+    """Run the ASGI app on a request and serialize its response."""
+    messages: List[Dict] = []
+
+    async def receive() -> Dict:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: Dict):
+        messages.append(message)
+
+    try:
+        await app(scope, receive, send)
+        start = messages[0]
+        status, headers = start["status"], start.get("headers", [])
+        content = b"".join(m.get("body", b"") for m in messages[1:])
+    except Exception as err:
+        status, headers = 500, [(b"content-type", b"text/plain")]
+        content = str(err).encode()
+
+    head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}".encode()]
+    names = set()
+    for name, value in headers:
+        if status in NO_BODY_STATUSES and name.lower() == b"content-length":
+            continue
+        names.add(name.lower())
+        head.append(name + b": " + value)
+    if status in NO_BODY_STATUSES:
+        content = b""
+    elif b"content-length" not in names:
+        head.append(b"Content-Length: " + str(len(content)).encode())
+    head.append(b"Connection: " + (b"keep-alive" if scope["keep_alive"] else b"close"))
+    return b"\r\n".join(head) + b"\r\n\r\n" + content
+
+
+async def _serve_connection(
+    app: Callable,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    pipeline: int = PIPELINE_DEPTH,
+):
+    """Serve a keep-alive connection.
+
+    Pipelined requests are read ahead and processed concurrently (up to
+    `pipeline` per connection), responses are written back in request order.
+    """
+    responses: asyncio.Queue = asyncio.Queue(maxsize=pipeline)
+
+    async def write_responses():
+        while True:
+            task = await responses.get()
+            if task is None:
+                return
+            try:
+                writer.write(await task)
+                await writer.drain()
+            except ConnectionError:
+                pass  # keep consuming so the reading side never blocks
+
+    writing = asyncio.ensure_future(write_responses())
+    try:
+        keep_alive = True
+        while keep_alive:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            scope, body = request
+            keep_alive = scope["keep_alive"]
+            await responses.put(asyncio.ensure_future(_respond(app, scope, body)))
+
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+
+    finally:
+        await responses.put(None)
+        await writing
+        writer.close()
+
+
+def serve(app: Callable, host: str = "", port: int = 8000):
+    """Run the ASGI app on an asyncio HTTP/1.1 server until interrupted."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        asyncio.start_server(
+            lambda reader, writer: _serve_connection(app, reader, writer),
+            host=host or None,
+            port=port,
+        )
+    )
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+
+
+app = ASGIApp()
@@ -0,0 +1,149 @@
+"""landsat_mosaic_tiler.binary: framed binary encoding of raw tile arrays.
+
+A frame is made of:
+
+    offset  size  content
+    0       4     magic, b"LMTF"
+    4       4     header length `n` (uint32, little endian)
+    8       n     JSON header (utf-8), padded with spaces so the data starts on
+                  a 64 bytes boundary
+    8 + n         data buffer, then mask buffer (C order, possibly compressed)
+
+The JSON header holds:
+
+    - dtype, shape: data array dtype (numpy `dtype.str`, e.g. "<u2") and shape
+    - mask: `{"dtype": ..., "shape": ...}` of the mask array, or null
+    - assets: list of assets used to create the tile
+    - compression: null, "lz4" (lz4 frame) or "zstd", applied to the data and
+      the mask buffers separately
+    - data_size, mask_size: stored (compressed) size of the buffers
+
+Uncompressed frames are meant for clients using HTTP compression, and can be
+read without copy with `decode_frame`. LZ4 and Zstd need the `lz4` and
+`zstandard` packages (`pip install landsat-mosaic-tiler[compression]`).
+"""
+
+import io
+import json
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+
+MAGIC = b"LMTF"
+ALIGNMENT = 64
+
+
+def _compressor(compression: str):
+    if compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.compress
+    elif compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress
+
+    raise Exception(f"Unsupported compression: {compression}")
+
+
+def _decompressor(compression: str):
+    if compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.decompress
+    elif compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+
+    raise Exception(f"Unsupported compression: {compression}")
+
+
+def _buffer(arr: numpy.ndarray) -> memoryview:
+    """Flat byte view of an array (copies only if not C-contiguous)."""
+    return memoryview(numpy.ascontiguousarray(arr)).cast("B")
+
+
+def encode_npy(data: numpy.ndarray) -> bytes:
+    """Encode an array to the `.npy` format, without a `numpy.save` round trip."""
+    data = numpy.ascontiguousarray(data)
+    header = io.BytesIO()
+    numpy.lib.format.write_array_header_1_0(
+        header, numpy.lib.format.header_data_from_array_1_0(data)
+    )
+    return b"".join([header.getbuffer(), _buffer(data)])
+
+
+def encode_frame(
+    data: numpy.ndarray,
+    mask: numpy.ndarray = None,
+    assets: Sequence[str] = None,
+    compression: str = None,
+) -> bytes:
+    """Encode data, mask and assets into a frame.
+
+    Array buffers are passed as memoryviews to a single join, so uncompressed
+    data is copied once, into the response body.
+    """
+    buffers: List[Any] = [_buffer(data)]
+    if mask is not None:
+        buffers.append(_buffer(mask))
+    if compression:
+        compress = _compressor(compression)
+        buffers = [compress(buf) for buf in buffers]
+
+    header: Dict[str, Any] = {
+        "dtype": data.dtype.str,
+        "shape": list(data.shape),
+        "mask": None,
+        "assets": list(assets or []),
+        "compression": compression,
+        "data_size": len(buffers[0]),
+        "mask_size": 0,
+    }
+    if mask is not None:
+        header["mask"] = {"dtype": mask.dtype.str, "shape": list(mask.shape)}
+        header["mask_size"] = len(buffers[1])
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    padding = -(len(MAGIC) + 4 + len(header_bytes)) % ALIGNMENT
+    header_bytes += b" " * padding
+
+    return b"".join(
+        [MAGIC, struct.pack("<I", len(header_bytes)), header_bytes, *buffers]
+    )
+
+
+def decode_frame(
+    body: bytes,
+) -> Tuple[numpy.ndarray, Optional[numpy.ndarray], Dict[str, Any]]:
+    """Decode a frame into (data, mask, header).
+
+    Uncompressed arrays are read-only views on `body`.
+    """
+    if bytes(body[:4]) != MAGIC:
+        raise Exception("Not a tile frame")
+
+    (length,) = struct.unpack("<I", body[4:8])
+    header = json.loads(bytes(body[8 : 8 + length]))
+
+    view = memoryview(body)
+    offset = 8 + length
+    data_buf = view[offset : offset + header["data_size"]]
+    offset += header["data_size"]
+    mask_buf = view[offset : offset + header["mask_size"]]
+
+    if header["compression"]:
+        decompress = _decompressor(header["compression"])
+        data_buf = decompress(data_buf)
+        mask_buf = decompress(mask_buf) if header["mask"] else mask_buf
+
+    data = numpy.frombuffer(data_buf, dtype=header["dtype"])
+    data = data.reshape(header["shape"])
+    mask = None
+    if header["mask"]:
+        mask = numpy.frombuffer(mask_buf, dtype=header["mask"]["dtype"])
+        mask = mask.reshape(header["mask"]["shape"])
+
+    return data, mask, header
@@ -0,0 +1,297 @@
+"""landsat_mosaic_tiler.cache: in-process caches."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.packed import PackedMosaic, is_packed
+from landsat_mosaic_tiler.quadkey_index import QuadkeyIndex, index_url
+
+
+class CacheEntry(NamedTuple):
+    """Cached value with its load time and version tag."""
+
+    value: Any
+    timestamp: float
+    version: Optional[str] = None
+    size: int = 0
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache with optional time-to-live and size bound."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = None, maxbytes: int = None):
+        """Create cache bounded by entry count and (optionally) total bytes."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        """Number of cached entries."""
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Check if key is cached (without touching LRU order)."""
+        return key in self._entries
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl is not None and time.monotonic() - entry.timestamp > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value or `default`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, key: Hashable, value: Any, version: str = None, size: int = 0):
+        """Add value to the cache, evicting least recently used entries."""
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        with self._lock:
+            self.invalidate(key)
+            self._entries[key] = CacheEntry(value, time.monotonic(), version, size)
+            self.nbytes += size
+            while len(self._entries) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes
+            ):
+                _, entry = self._entries.popitem(last=False)
+                self.nbytes -= entry.size
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop key from the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry.size
+
+    def clear(self):
+        """Drop every entry and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "nbytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls sharing a key.
+
+    The first caller for a key runs the function, callers arriving while it
+    runs wait for its result (or exception) instead of doing the work again.
+    Nothing is kept once the call returns.
+    """
+
+    def __init__(self):
+        """Create empty call registry."""
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Return `func(*args, **kwargs)`, sharing the call with concurrent callers."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Call counters."""
+        return {"calls": self.calls, "shared": self.shared}
+
+
+class KeyedLock(object):
+    """One lock per key, e.g. to serialize read-modify-write cycles of a mosaic.
+
+    Unlike `SingleFlight`, every caller runs: callers sharing a key just wait
+    for each other.
+    """
+
+    def __init__(self):
+        """Create empty lock registry."""
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, key: Hashable) -> threading.Lock:
+        """Lock of a key."""
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+def get_version(url: str) -> Optional[str]:
+    """Return a cheap version tag (ETag, Last-Modified or mtime) for a mosaic url.
+
+    Returns None when the backend has no notion of version (e.g. DynamoDB).
+    """
+    parsed = urlparse(url)
+
+    if parsed.scheme == "s3":
+        import boto3
+
+        response = boto3.client("s3").head_object(
+            Bucket=parsed.netloc, Key=parsed.path.strip("/")
+        )
+        return response.get("ETag") or str(response.get("LastModified"))
+
+    elif parsed.scheme in ["http", "https"]:
+        with urlopen(Request(url, method="HEAD")) as response:
+            return response.headers.get("ETag") or response.headers.get(
+                "Last-Modified"
+            )
+
+    elif parsed.scheme in ["", "file"]:
+        stat = os.stat(parsed.path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    return None
+
+
+def _load_mosaic(url: str, version: str = None):
+    """Open mosaic as a QuadkeyIndex, falling back to the raw backend.
+
+    Backends which don't hold the tiles in memory (e.g. DynamoDB) are returned
+    as is, and packed mosaics are read block by block. The index sidecar is
+    only used if it was built from the current `version` of the document.
+    """
+    if is_packed(url):
+        return PackedMosaic(url)
+
+    if version and os.getenv("MOSAIC_INDEX_SIDECAR", "FALSE").upper() == "TRUE":
+        try:
+            index = QuadkeyIndex.from_bytes(storage.read(index_url(url)))
+            if index.source_version == version:
+                return index
+        except Exception:
+            pass
+
+    from cogeo_mosaic.backends import MosaicBackend
+
+    mosaic = MosaicBackend(url)
+    mosaic_def = dict(mosaic.mosaic_def)
+    if not mosaic_def.get("tiles"):
+        return mosaic
+
+    return QuadkeyIndex.from_mosaic_def(mosaic_def)
+
+
+class MosaicCache(LRUCache):
+    """Cache of opened mosaics (QuadkeyIndex, PackedMosaic or backend) keyed by url.
+
+    Entries older than `ttl` are revalidated against the mosaic ETag/Last-Modified
+    and only fetched and parsed again if the document changed.
+    """
+
+    def __init__(self, maxsize: int = 16, ttl: float = 300):
+        """Create mosaic cache."""
+        super(MosaicCache, self).__init__(maxsize=maxsize, ttl=ttl)
+        self.revalidations = 0
+        self._loads = SingleFlight()
+
+    def load(self, url: str, version: str = None) -> Any:
+        """Fetch and parse mosaic definition."""
+        return _load_mosaic(url, version)
+
+    def get(self, url: str) -> Any:  # type: ignore
+        """Return mosaic for url, fetching it only when needed."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                if not self._expired(entry):
+                    self.hits += 1
+                    return entry.value
+
+        # Concurrent misses for the same url share one revalidation/load
+        return self._loads.do(url, self._refresh, url, entry)
+
+    def _refresh(self, url: str, entry: Optional[CacheEntry]) -> Any:
+        try:
+            version = get_version(url)
+        except Exception:
+            version = None
+
+        if entry is not None and version is not None and version == entry.version:
+            with self._lock:
+                self._entries[url] = entry._replace(timestamp=time.monotonic())
+                self.revalidations += 1
+                self.hits += 1
+            return entry.value
+
+        with self._lock:
+            self.misses += 1
+
+        mosaic = self.load(url, version)
+        self.set(url, mosaic, version=version)
+        return mosaic
+
+    def version(self, url: str) -> Optional[str]:
+        """Version tag of the cached mosaic."""
+        entry = self._entries.get(url)
+        return entry.version if entry is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters."""
+        stats = super(MosaicCache, self).stats()
+        stats["revalidations"] = self.revalidations
+        return stats
+
+
+mosaic_cache = MosaicCache(
+    maxsize=int(os.getenv("MOSAIC_CACHE_SIZE", 16)),
+    ttl=float(os.getenv("MOSAIC_CACHE_TTL", 300)),
+)
+
+window_cache = LRUCache(
+    maxsize=int(os.getenv("WINDOW_CACHE_ITEMS", 4096)),
+    maxbytes=int(os.getenv("WINDOW_CACHE_BYTES", 128 * 1024 * 1024)),
+)
@@ -0,0 +1,270 @@
+"""landsat_mosaic_tiler.encoding: content-aware tile image encoding.
+
+Replaces `rio_tiler.utils.render` for 8-bit `png`, `jpg` and `webp` tiles:
+
+    - fully masked tiles, and tiles of a single valid color, are served from
+      a cache of encoded blank/solid tiles
+    - `png` tiles are encoded with numpy and zlib (`ADAPTIVE_PNG`, default
+      TRUE), with options picked from the content:
+        - 256 colors or less: palette, with a bit depth of 1, 2, 4 or 8, and
+          masked pixels as one transparent palette entry
+        - otherwise: RGB (or gray), with masked pixels as a transparent color
+          key (1-bit alpha) when a color is free, RGBA (or gray + alpha) if
+          not, and a PNG filter picked per row
+        - zlib level `PNG_PALETTE_ZLEVEL` (default 6) for palette images, and
+          `PNG_ZLEVEL` (default 2) for the noisier RGB images
+"""
+
+import os
+import struct
+import zlib
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy
+
+ADAPTIVE_PNG = os.getenv("ADAPTIVE_PNG", "TRUE").upper() == "TRUE"
+PNG_ZLEVEL = int(os.getenv("PNG_ZLEVEL", 2))
+PNG_PALETTE_ZLEVEL = int(os.getenv("PNG_PALETTE_ZLEVEL", 6))
+
+FORMATS = ["png", "jpg", "webp"]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Pixels sampled to rule out palette mode before counting all the colors
+SAMPLE_SIZE = 4096
+
+
+def _chunk(kind: bytes, body: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(body))
+        + kind
+        + body
+        + struct.pack(">I", zlib.crc32(kind + body))
+    )
+
+
+def _png(
+    rows: bytes,
+    width: int,
+    height: int,
+    depth: int,
+    color_type: int,
+    level: int,
+    palette: bytes = None,
+    transparency: bytes = None,
+) -> bytes:
+    header = struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0)
+    chunks = [PNG_SIGNATURE, _chunk(b"IHDR", header)]
+    if palette is not None:
+        chunks.append(_chunk(b"PLTE", palette))
+    if transparency is not None:
+        chunks.append(_chunk(b"tRNS", transparency))
+    chunks.append(_chunk(b"IDAT", zlib.compress(rows, level)))
+    chunks.append(_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+
+def _pack_bits(index: numpy.ndarray, depth: int) -> numpy.ndarray:
+    """Pack rows of palette indexes at `depth` bits per pixel."""
+    if depth == 8:
+        return index
+
+    per_byte = 8 // depth
+    height, width = index.shape
+    padded = numpy.zeros((height, -(-width // per_byte) * per_byte), numpy.uint8)
+    padded[:, :width] = index
+    groups = padded.reshape(height, -1, per_byte)
+    shifts = numpy.arange(8 - depth, -1, -depth, dtype=numpy.uint8)
+    return numpy.bitwise_or.reduce(groups << shifts, axis=2).astype(numpy.uint8)
+
+
+def _filter(raw: numpy.ndarray, up: numpy.ndarray, bpp: int, kind: int):
+    """Apply PNG filter `kind` to rows of bytes, given the rows above them."""
+    if kind == 0:
+        return raw
+
+    left = numpy.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    if kind == 1:
+        return raw - left
+    if kind == 2:
+        return raw - up
+    if kind == 3:
+        return raw - ((left >> 1) + (up >> 1) + (left & up & 1))
+
+    upper_left = numpy.zeros_like(raw)
+    upper_left[:, bpp:] = up[:, :-bpp]
+    left, up, upper_left = (a.astype(numpy.int16) for a in (left, up, upper_left))
+    estimate = left + up - upper_left
+    dist_left = numpy.abs(estimate - left)
+    dist_up = numpy.abs(estimate - up)
+    dist_upper_left = numpy.abs(estimate - upper_left)
+    paeth = numpy.where(
+        (dist_left <= dist_up) & (dist_left <= dist_upper_left),
+        left,
+        numpy.where(dist_up <= dist_upper_left, up, upper_left),
+    )
+    return raw - paeth.astype(numpy.uint8)
+
+
+def _filter_rows(pixels: numpy.ndarray) -> numpy.ndarray:
+    """Filter rows with the PNG filter that minimizes the sum of absolute
+    (signed) bytes over a sample of rows, and prefix them with its type.
+    """
+    height, width, bpp = pixels.shape
+    raw = pixels.reshape(height, width * bpp)
+    up = numpy.zeros_like(raw)
+    up[1:] = raw[:-1]
+
+    sample = slice(1, None, 8)
+    scores = [
+        numpy.abs(
+            _filter(raw[sample], up[sample], bpp, kind).view(numpy.int8),
+            dtype=numpy.int16,
+        ).sum()
+        for kind in range(5)
+    ]
+    kind = int(numpy.argmin(scores))
+
+    rows = numpy.empty((height, width * bpp + 1), dtype=numpy.uint8)
+    rows[:, 0] = kind
+    rows[:, 1:] = _filter(raw, up, bpp, kind)
+    return rows
+
+
+def _palette_png(
+    pixels: numpy.ndarray, valid: numpy.ndarray, valid_keys: numpy.ndarray
+) -> Optional[bytes]:
+    """Palette PNG of (height, width, bands) pixels, or None if > 256 colors."""
+    height, width, bands = pixels.shape
+    transparent = not valid.all()
+    ncolors = 256 - int(transparent)
+    if valid_keys.size > SAMPLE_SIZE:
+        step = valid_keys.size // SAMPLE_SIZE
+        if numpy.unique(valid_keys[::step]).size > ncolors:
+            return None
+
+    colors, inverse = numpy.unique(valid_keys, return_inverse=True)
+    if colors.size > ncolors:
+        return None
+
+    index = numpy.zeros((height, width), dtype=numpy.uint8)
+    index[valid] = inverse.astype(numpy.uint8) + int(transparent)
+
+    total = colors.size + int(transparent)
+    depth = next(d for d in [1, 2, 4, 8] if total <= 1 << d)
+
+    rgb = numpy.zeros((total, 3), dtype=numpy.uint8)
+    for bdx in range(3):
+        shift = 8 * (bands - 1 - min(bdx, bands - 1))
+        rgb[int(transparent) :, bdx] = (colors >> shift) & 0xFF
+
+    rows = _pack_bits(index, depth)
+    rows = numpy.concatenate([numpy.zeros((height, 1), numpy.uint8), rows], axis=1)
+    return _png(
+        rows.tobytes(),
+        width,
+        height,
+        depth,
+        3,
+        PNG_PALETTE_ZLEVEL,
+        palette=rgb.tobytes(),
+        transparency=b"\x00" if transparent else None,
+    )
+
+
+def encode_png(tile: numpy.ndarray, mask: numpy.ndarray) -> bytes:
+    """Encode an 8-bit (bands, height, width) tile, masked where mask is 0."""
+    pixels = numpy.ascontiguousarray(numpy.moveaxis(tile, 0, -1))
+    valid = mask != 0
+    height, width, bands = pixels.shape
+
+    # Pixel colors as integers
+    keys = numpy.zeros((height, width), dtype=numpy.uint32)
+    for bdx in range(bands):
+        keys = (keys << 8) | pixels[..., bdx]
+    valid_keys = keys[valid]
+
+    content = _palette_png(pixels, valid, valid_keys)
+    if content is not None:
+        return content
+
+    color_type = 2 if bands == 3 else 0
+    transparency = None
+    if not valid.all():
+        # Masked pixels as a color key, unless all the candidates are used
+        gray = 0x010101 if bands == 3 else 1
+        free = [v for v in [0, 255, 1, 254] if not (valid_keys == v * gray).any()]
+        if free:
+            pixels = pixels.copy()
+            pixels[~valid] = free[0]
+            transparency = struct.pack(f">{bands}H", *[free[0]] * bands)
+        else:
+            alpha = numpy.where(valid, 255, 0).astype(numpy.uint8)
+            pixels = numpy.concatenate([pixels, alpha[..., None]], axis=2)
+            color_type += 4
+
+    rows = _filter_rows(pixels)
+    return _png(
+        rows.tobytes(),
+        width,
+        height,
+        8,
+        color_type,
+        PNG_ZLEVEL,
+        transparency=transparency,
+    )
+
+
+@lru_cache(maxsize=256)
+def uniform_tile(ext: str, size: int, color: Optional[Tuple[int, ...]]) -> bytes:
+    """Encoded tile of a single color (None: fully masked)."""
+    bands = len(color) if color is not None else 1
+    tile = numpy.zeros((bands, size, size), dtype=numpy.uint8)
+    mask = numpy.zeros((size, size), dtype=numpy.uint8)
+    if color is not None:
+        tile[:] = numpy.array(color, dtype=numpy.uint8)[:, None, None]
+        mask[:] = 255
+    return _encode(tile, mask, ext)
+
+
+def _encode(tile: numpy.ndarray, mask: numpy.ndarray, ext: str) -> bytes:
+    if ext == "png" and ADAPTIVE_PNG and tile.shape[0] in [1, 3]:
+        return encode_png(tile, mask)
+
+    from rio_tiler.profiles import img_profiles
+    from rio_tiler.utils import render
+
+    driver = "jpeg" if ext == "jpg" else ext
+    return render(tile, mask, img_format=driver, **img_profiles.get(driver, {}))
+
+
+def solid_color(tile: numpy.ndarray, mask: numpy.ndarray) -> Optional[Tuple]:
+    """Band values of a fully valid, single color tile, or None."""
+    if not mask.all():
+        return None
+    first = tile[:, :1, :1]
+    if not (tile == first).all():
+        return None
+    return tuple(first.ravel().tolist())
+
+
+def encode_tile(
+    tile: numpy.ndarray, mask: numpy.ndarray, ext: str, colormap: Dict = None
+) -> bytes:
+    """Encode an 8-bit tile as `png`, `jpg` or `webp`."""
+    if colormap:
+        from rio_tiler.colormap import apply_cmap
+
+        tile, alpha = apply_cmap(tile, colormap)
+        mask = numpy.where((mask != 0) & (alpha != 0), 255, 0).astype(numpy.uint8)
+
+    if not mask.any():
+        return uniform_tile(ext, tile.shape[-1], None)
+
+    color = solid_color(tile, mask)
+    if color is not None:
+        return uniform_tile(ext, tile.shape[-1], color)
+
+    return _encode(tile, mask, ext)
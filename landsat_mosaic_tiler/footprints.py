@@ -0,0 +1,342 @@
+"""landsat_mosaic_tiler.footprints: per tile asset pruning from scene footprints.
+
+Scene footprints and cloud covers are stored next to the mosaic, in a
+`{mosaic url}.footprints` sidecar (numpy .npz: assets, cloud covers and
+float32 lon/lat polygons in CSR layout, about 80 bytes per scene).
+
+Before reading a tile, its assets are pruned:
+
+    - assets whose footprint does not intersect the tile are dropped
+    - the others are ordered by cloud cover bucket (`ASSET_CLOUD_BUCKET`
+      percents) then by decreasing tile coverage
+    - with the `first` pixel selection, assets whose footprint over the tile
+      lies within the footprint (shrunk by `FOOTPRINT_MARGIN` meters) of an
+      asset before them are dropped, and so are all the assets after one
+      covering the whole tile
+
+Assets without a footprint are kept where they are. Footprints are only used
+for the mosaic version they were written with.
+"""
+
+import io
+import json
+import math
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import mercantile
+import numpy
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.cache import LRUCache
+
+ASSET_PRUNING = os.getenv("ASSET_PRUNING", "TRUE").upper() == "TRUE"
+ASSET_CLOUD_BUCKET = float(os.getenv("ASSET_CLOUD_BUCKET", 10))
+FOOTPRINT_MARGIN = float(os.getenv("FOOTPRINT_MARGIN", 250))
+
+EARTH_RADIUS = 6378137.0
+
+footprint_cache = LRUCache(maxsize=16, ttl=float(os.getenv("MOSAIC_CACHE_TTL", 300)))
+
+
+def footprints_url(url: str) -> str:
+    """Location of the footprints stored next to a mosaic."""
+    return f"{url}.footprints"
+
+
+def _mercator(coords: numpy.ndarray) -> numpy.ndarray:
+    """Web mercator x/y (meters) of lon/lat coordinates."""
+    lon = numpy.radians(coords[:, 0].astype(numpy.float64))
+    lat = numpy.radians(numpy.clip(coords[:, 1], -85.0511, 85.0511))
+    return numpy.stack(
+        [
+            EARTH_RADIUS * lon,
+            EARTH_RADIUS * numpy.log(numpy.tan(math.pi / 4 + lat / 2)),
+        ],
+        axis=1,
+    )
+
+
+def clip_polygon(polygon: numpy.ndarray, bounds: mercantile.Bbox) -> numpy.ndarray:
+    """Intersection of a polygon with a box (Sutherland-Hodgman)."""
+    points = [tuple(p) for p in polygon]
+    edges = [
+        (0, bounds.left, True),
+        (0, bounds.right, False),
+        (1, bounds.bottom, True),
+        (1, bounds.top, False),
+    ]
+    for axis, limit, lower in edges:
+        if not points:
+            break
+        clipped = []
+        for idx, current in enumerate(points):
+            previous = points[idx - 1]
+            current_in = current[axis] >= limit if lower else current[axis] <= limit
+            previous_in = previous[axis] >= limit if lower else previous[axis] <= limit
+            if current_in != previous_in:
+                ratio = (limit - previous[axis]) / (current[axis] - previous[axis])
+                clipped.append(
+                    tuple(p + ratio * (c - p) for p, c in zip(previous, current))
+                )
+            if current_in:
+                clipped.append(current)
+        points = clipped
+
+    return numpy.array(points, dtype=numpy.float64).reshape(-1, 2)
+
+
+def _area(polygon: numpy.ndarray) -> float:
+    """Area of a polygon (shoelace formula)."""
+    x, y = polygon[:, 0], polygon[:, 1]
+    return abs(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1))) / 2
+
+
+def _convex(polygon: numpy.ndarray) -> bool:
+    """Whether a polygon is convex."""
+    edges = numpy.roll(polygon, -1, axis=0) - polygon
+    turns = edges[:, 0] * numpy.roll(edges[:, 1], -1) - edges[:, 1] * numpy.roll(
+        edges[:, 0], -1
+    )
+    return bool((turns >= 0).all() or (turns <= 0).all())
+
+
+def _inside(
+    px: numpy.ndarray, py: numpy.ndarray, polygon: numpy.ndarray, margin: float = 0
+) -> numpy.ndarray:
+    """Points inside a polygon, and at least `margin` away from its edges."""
+    x0, y0 = polygon[:, :1], polygon[:, 1:]
+    x1, y1 = numpy.roll(x0, -1, axis=0), numpy.roll(y0, -1, axis=0)
+    dx, dy = x1 - x0, y1 - y0
+
+    crossing = (y0 > py) != (y1 > py)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x0 + (py - y0) * dx / dy
+    inside = numpy.count_nonzero(crossing & (px < x_cross), axis=0) % 2 == 1
+
+    if margin > 0:
+        length = numpy.maximum(dx * dx + dy * dy, 1e-12)
+        t = numpy.clip(((px - x0) * dx + (py - y0) * dy) / length, 0, 1)
+        distance = numpy.hypot(px - x0 - t * dx, py - y0 - t * dy).min(axis=0)
+        inside &= distance >= margin
+
+    return inside
+
+
+class FootprintRecord(NamedTuple):
+    """Footprint of one asset (same fields as `stac.Scene`)."""
+
+    id: str
+    cloud: float
+    footprint: List[Tuple[float, float]]
+
+
+class Footprints(object):
+    """Footprint polygons and cloud covers of the assets of a mosaic."""
+
+    def __init__(
+        self,
+        assets: Sequence[str],
+        cloud: numpy.ndarray,
+        offsets: numpy.ndarray,
+        coords: numpy.ndarray,
+        version: str = None,
+    ):
+        """Create footprints from their arrays (see `from_scenes`)."""
+        self.assets = list(assets)
+        self.cloud = cloud
+        self.offsets = offsets
+        self.coords = coords
+        self.version = version
+        self.rows = {asset: row for row, asset in enumerate(self.assets)}
+        self._xy = _mercator(coords) if len(coords) else coords
+
+    def __len__(self) -> int:
+        """Number of assets."""
+        return len(self.assets)
+
+    @classmethod
+    def from_scenes(cls, scenes: Iterable[Any], version: str = None) -> "Footprints":
+        """Build from `stac.Scene`s (or anything with id, cloud and footprint)."""
+        assets, cloud, offsets, coords = [], [], [0], []
+        for scene in scenes:
+            footprint = list(scene.footprint)
+            if len(footprint) > 1 and footprint[0] == footprint[-1]:
+                footprint = footprint[:-1]
+            assets.append(scene.id)
+            cloud.append(scene.cloud)
+            coords.extend(footprint)
+            offsets.append(len(coords))
+
+        return cls(
+            assets,
+            numpy.array(cloud, dtype=numpy.float32),
+            numpy.array(offsets, dtype=numpy.uint32),
+            numpy.array(coords, dtype=numpy.float32).reshape(-1, 2),
+            version=version,
+        )
+
+    def polygon(self, row: int) -> numpy.ndarray:
+        """Web mercator footprint of an asset."""
+        return self._xy[self.offsets[row] : self.offsets[row + 1]]
+
+    def select(self, assets: Iterable[str], other: "Footprints" = None) -> "Footprints":
+        """Footprints of `assets`, taken from `other` first (e.g. newer scenes)."""
+        scenes = []
+        for asset in assets:
+            for source in [other, self]:
+                row = source.rows.get(asset) if source is not None else None
+                if row is not None:
+                    scenes.append(source.scene(row))
+                    break
+        return Footprints.from_scenes(scenes, version=self.version)
+
+    def scene(self, row: int) -> FootprintRecord:
+        """Asset, cloud cover and lon/lat footprint of a row."""
+        coords = self.coords[self.offsets[row] : self.offsets[row + 1]]
+        return FootprintRecord(
+            self.assets[row], float(self.cloud[row]), [tuple(p) for p in coords]
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serialize footprints (numpy .npz)."""
+        sio = io.BytesIO()
+        numpy.savez_compressed(
+            sio,
+            assets=numpy.frombuffer("\n".join(self.assets).encode(), dtype=numpy.uint8),
+            cloud=self.cloud,
+            offsets=self.offsets,
+            coords=self.coords,
+            metadata=numpy.frombuffer(
+                json.dumps({"version": self.version}).encode(), dtype=numpy.uint8
+            ),
+        )
+        return sio.getvalue()
+
+    @classmethod
+    def from_bytes(cls, body: bytes) -> "Footprints":
+        """Load footprints serialized with `to_bytes`."""
+        with numpy.load(io.BytesIO(body)) as data:
+            assets = data["assets"].tobytes().decode()
+            metadata = json.loads(data["metadata"].tobytes().decode())
+            return cls(
+                assets.split("\n") if assets else [],
+                data["cloud"],
+                data["offsets"],
+                data["coords"],
+                version=metadata.get("version"),
+            )
+
+    def prune(
+        self, assets: Sequence[str], x: int, y: int, z: int, first: bool = False
+    ) -> List[str]:
+        """Assets that can add valid pixels to tile x/y/z, in read order."""
+        bounds = mercantile.xy_bounds(x, y, z)
+        tile_area = (bounds.right - bounds.left) * (bounds.top - bounds.bottom)
+
+        rows = [self.rows.get(asset) for asset in assets]
+        clipped: Dict[int, numpy.ndarray] = {}
+        coverage: Dict[int, float] = {}
+        for idx, row in enumerate(rows):
+            if row is not None:
+                clipped[idx] = clip_polygon(self.polygon(row), bounds)
+                coverage[idx] = (
+                    _area(clipped[idx]) / tile_area if len(clipped[idx]) else 0
+                )
+
+        kept = [idx for idx in range(len(assets)) if coverage.get(idx, 1) > 0]
+        if len(coverage) == len(assets):
+            kept.sort(
+                key=lambda idx: (
+                    self.cloud[rows[idx]] // ASSET_CLOUD_BUCKET,
+                    -coverage[idx],
+                )
+            )
+
+        if first:
+            kept = self._first_pass(kept, rows, clipped, bounds)
+
+        return [assets[idx] for idx in kept]
+
+    def _first_pass(
+        self,
+        kept: List[int],
+        rows: List[Optional[int]],
+        clipped: Dict[int, numpy.ndarray],
+        bounds: mercantile.Bbox,
+    ) -> List[int]:
+        """Drop the assets hidden by the assets before them.
+
+        An asset is hidden when its footprint over the tile lies within the
+        (convex) footprint of a previous asset, shrunk by `FOOTPRINT_MARGIN`.
+        Once a footprint covers the whole tile, the next assets are dropped.
+        """
+        corners = numpy.array(
+            [
+                [bounds.left, bounds.bottom],
+                [bounds.right, bounds.bottom],
+                [bounds.right, bounds.top],
+                [bounds.left, bounds.top],
+            ]
+        )
+
+        def within(points: numpy.ndarray, polygon: numpy.ndarray) -> bool:
+            px, py = points[numpy.newaxis, :, 0], points[numpy.newaxis, :, 1]
+            return bool(_inside(px, py, polygon, FOOTPRINT_MARGIN).all())
+
+        hiding: List[numpy.ndarray] = []
+        selected = []
+        for idx in kept:
+            row = rows[idx]
+            if row is None:
+                selected.append(idx)
+                continue
+
+            if any(within(clipped[idx], polygon) for polygon in hiding):
+                continue
+
+            selected.append(idx)
+            polygon = self.polygon(row)
+            if _convex(polygon):
+                if within(corners, polygon):
+                    break
+                hiding.append(polygon)
+
+        return selected
+
+
+def get_footprints(url: str) -> Optional[Footprints]:
+    """Footprints stored next to a mosaic, or None."""
+    footprints = footprint_cache.get(url)
+    if footprints is None:
+        try:
+            footprints = Footprints.from_bytes(storage.read(footprints_url(url)))
+        except Exception:
+            footprints = False
+        footprint_cache.set(url, footprints)
+
+    return footprints or None
+
+
+def prune_assets(
+    url: str,
+    mosaic: Any,
+    assets: List[str],
+    x: int,
+    y: int,
+    z: int,
+    first: bool = False,
+) -> List[str]:
+    """Prune the assets of tile x/y/z of a mosaic using its footprints, if any."""
+    if not ASSET_PRUNING or not assets:
+        return assets
+
+    footprints = get_footprints(url)
+    if footprints is None:
+        return assets
+
+    version = dict(mosaic.mosaic_def).get("version")
+    if footprints.version != version:
+        return assets
+
+    return footprints.prune(assets, x, y, z, first=first)
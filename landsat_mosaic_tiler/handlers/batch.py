@@ -0,0 +1,242 @@
+"""landsat_mosaic_tiler.handlers.batch: render many tiles in one request."""
+
+import inspect
+import io
+import itertools
+import json
+import os
+import struct
+import tarfile
+import uuid
+from concurrent import futures
+from typing import Any, Dict, List, Sequence, Tuple
+
+import mercantile
+from landsat_mosaic_tiler.handlers.tiles import tiles as tile_handler
+from lambda_proxy.proxy import API
+
+app = API(name="landsat-mosaic-tiler-batch", debug=False)
+
+BATCH_MAX_TILES = int(os.getenv("BATCH_MAX_TILES", 256))
+BATCH_THREADS = int(os.getenv("BATCH_THREADS", 4))
+
+
+def _parse_tiles(
+    tiles: Any = None, bounds: Any = None, minzoom: int = None, maxzoom: int = None
+) -> List[Tuple[int, int, int]]:
+    """Tiles from a "z-x-y,z-x-y" string/list of [z, x, y], or bounds and zooms.
+
+    Tiles over bounds are listed up to `BATCH_MAX_TILES` + 1, enough to tell
+    when there are too many. Raises ValueError on invalid tiles, bounds or
+    zooms.
+    """
+    if tiles:
+        error = f"Invalid tiles: {tiles}, expected z-x-y"
+        if isinstance(tiles, str):
+            tiles = [t.split("-") for t in tiles.split(",")]
+        try:
+            parsed = [tuple(map(int, t)) for t in tiles]
+        except (TypeError, ValueError):
+            raise ValueError(error)
+        if any(len(t) != 3 for t in parsed):
+            raise ValueError(error)
+        return parsed  # type: ignore
+
+    if bounds:
+        if minzoom is None:
+            raise ValueError("Missing 'minzoom' parameter for 'bounds'")
+        error = f"Invalid bounds: {bounds}, expected west,south,east,north"
+        if isinstance(bounds, str):
+            bounds = bounds.split(",")
+        try:
+            bounds = list(map(float, bounds))
+        except (TypeError, ValueError):
+            raise ValueError(error)
+        if len(bounds) != 4:
+            raise ValueError(error)
+        try:
+            minzoom = int(minzoom)
+            maxzoom = int(maxzoom) if maxzoom is not None else minzoom
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid zooms: {minzoom}, {maxzoom}")
+        tiles = mercantile.tiles(*bounds, zooms=range(minzoom, maxzoom + 1))
+        return [(t.z, t.x, t.y) for t in itertools.islice(tiles, BATCH_MAX_TILES + 1)]
+
+    return []
+
+
+def _body(response: Tuple) -> bytes:
+    body = response[2]
+    return body.encode() if isinstance(body, str) else bytes(body)
+
+
+def _name(z: int, x: int, y: int, scale: int, ext: str) -> str:
+    return f"{z}/{x}/{y}@{scale}x.{ext}"
+
+
+def _tar(results: Sequence[Tuple], scale: int, ext: str) -> bytes:
+    sio = io.BytesIO()
+    index = []
+    with tarfile.open(fileobj=sio, mode="w") as tar:
+        for (z, x, y), response in results:
+            name = _name(z, x, y, scale, ext)
+            index.append({"tile": [z, x, y], "status": response[0], "name": name})
+            if response[0] != "OK":
+                continue
+            info = tarfile.TarInfo(name)
+            content = bytes(response[2])
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+        body = json.dumps(index).encode()
+        info = tarfile.TarInfo("index.json")
+        info.size = len(body)
+        tar.addfile(info, io.BytesIO(body))
+
+    return sio.getvalue()
+
+
+def _multipart(results: Sequence[Tuple], scale: int, ext: str) -> Tuple[str, bytes]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for (z, x, y), response in results:
+        headers = {
+            "Content-Type": response[1],
+            "Content-Location": _name(z, x, y, scale, ext),
+            "X-STATUS": response[0],
+        }
+        if len(response) > 3:
+            headers.update(response[3].get("custom_headers", {}))
+        body = _body(response)
+        head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        parts.append(f"--{boundary}\r\n{head}\r\n".encode() + body + b"\r\n")
+
+    parts.append(f"--{boundary}--\r\n".encode())
+    return f"multipart/mixed; boundary={boundary}", b"".join(parts)
+
+
+def _length_prefixed(results: Sequence[Tuple]) -> bytes:
+    """Concatenate `>I` header length, JSON header, `>I` body length, body."""
+    chunks = []
+    for (z, x, y), response in results:
+        body = _body(response)
+        header: Dict[str, Any] = {
+            "tile": [z, x, y],
+            "status": response[0],
+            "content_type": response[1],
+        }
+        if len(response) > 3:
+            header["headers"] = response[3].get("custom_headers", {})
+        header_bytes = json.dumps(header, separators=(",", ":")).encode()
+        chunks += [
+            struct.pack(">I", len(header_bytes)),
+            header_bytes,
+            struct.pack(">I", len(body)),
+            body,
+        ]
+    return b"".join(chunks)
+
+
+@app.route(
+    "/tiles",
+    methods=["GET", "POST"],
+    cors=True,
+    payload_compression_method="gzip",
+    binary_b64encode=True,
+    tag=["tiles"],
+    cache_control=os.getenv("CACHE_CONTROL", None),
+)
+def batch(
+    url: str = None,
+    tiles: str = None,
+    bounds: str = None,
+    minzoom: int = None,
+    maxzoom: int = None,
+    format: str = "tar",
+    body: str = None,
+    **kwargs: Any,
+) -> Tuple:
+    """Handle /tiles batch requests.
+
+    Args:
+        - url: Mosaic url
+        - tiles: Comma-separated "z-x-y" tile list, or
+        - bounds, minzoom, maxzoom: All the tiles over bounds at the given zooms
+        - format: Output container, one of 'tar' (with an index.json),
+          'multipart' (multipart/mixed) or 'binary' (length-prefixed records)
+        - kwargs: Render options shared by all tiles (scale, ext, bands, expr,
+          rescale, color_ops, color_map, pixel_selection...)
+
+    Options can also be sent as a JSON body, with `tiles` as a list of
+    [z, x, y].
+    """
+    options: Dict[str, Any] = dict(
+        url=url, tiles=tiles, bounds=bounds, minzoom=minzoom, maxzoom=maxzoom, **kwargs
+    )
+    if body:
+        options.update(json.loads(body))
+    options = {k: v for k, v in options.items() if v is not None}
+    format = options.pop("format", format)
+    if format not in ["tar", "multipart", "binary"]:
+        return ("NOK", "text/plain", f"Invalid format: {format}")
+
+    if not options.get("url"):
+        return ("NOK", "text/plain", "Missing 'URL' parameter")
+
+    try:
+        tile_list = _parse_tiles(
+            options.pop("tiles", None),
+            options.pop("bounds", None),
+            options.pop("minzoom", None),
+            options.pop("maxzoom", None),
+        )
+    except ValueError as err:
+        return ("NOK", "text/plain", str(err))
+    if not tile_list:
+        return ("NOK", "text/plain", "No tiles nor bounds given")
+
+    if len(tile_list) > BATCH_MAX_TILES:
+        return ("NOK", "text/plain", f"Too many tiles (max {BATCH_MAX_TILES})")
+
+    # Only forward render options the tile handler knows about (the tile
+    # coordinates are given per tile)
+    parameters = set(inspect.signature(tile_handler).parameters) - {"z", "x", "y"}
+    options = {k: v for k, v in options.items() if k in parameters}
+    options["scale"] = int(options.get("scale", 1))
+    options.setdefault("ext", "png")
+
+    def _render(tile: Tuple[int, int, int]) -> Tuple:
+        z, x, y = tile
+        try:
+            return tile_handler(z=z, x=x, y=y, **options)
+        except Exception as err:
+            return ("ERROR", "text/plain", str(err))
+
+    # Sort the tiles so that neighbours are rendered close in time and are more
+    # likely to find their source windows still cached
+    ordered = sorted(set(tile_list))
+    with futures.ThreadPoolExecutor(max_workers=BATCH_THREADS) as executor:
+        responses = dict(zip(ordered, executor.map(_render, ordered)))
+    results = [(tile, responses[tile]) for tile in tile_list]
+
+    if format == "tar":
+        content = _tar(results, options["scale"], options["ext"])
+        return ("OK", "application/x-tar", content)
+
+    elif format == "multipart":
+        content_type, content = _multipart(results, options["scale"], options["ext"])
+        return ("OK", content_type, content)
+
+    return ("OK", "application/x-binary", _length_prefixed(results))
+
+
+@app.route(
+    "/favicon.ico",
+    methods=["GET"],
+    cors=True,
+    tag=["other"],
+    cache_control=os.getenv("CACHE_CONTROL", None),
+)
+def favicon() -> Tuple[str, str, str]:
+    """Favicon."""
+    return ("EMPTY", "text/plain", "")
@@ -3,18 +3,35 @@
 import json
 import os
 from datetime import datetime
-from typing import Any, Tuple
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import urlparse
 
-from landsat_mosaic_tiler.utils import get_hash, get_tilejson
-from cogeo_mosaic.backends import MosaicBackend
+import mercantile
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.cache import (
+    KeyedLock,
+    SingleFlight,
+    get_version,
+    mosaic_cache,
+)
+from landsat_mosaic_tiler.footprints import (
+    Footprints,
+    footprint_cache,
+    footprints_url,
+    get_footprints,
+)
+from landsat_mosaic_tiler.packed import PackedMosaic, is_packed, pack
+from landsat_mosaic_tiler.quadkey_index import QuadkeyIndex, index_url
+from landsat_mosaic_tiler.utils import bump_version, get_hash, get_tilejson, merge_tiles
 from lambda_proxy.proxy import API
 
-from landsat_cogeo_mosaic.mosaic import features_to_mosaicJSON
-from landsat_cogeo_mosaic.stac import search
-from landsat_cogeo_mosaic.util import filter_season
-
 app = API(name="landsat-mosaic-tiler-mosaic", debug=True)
 
+create_requests = SingleFlight()
+# Updates of a mosaic read, merge and write it back: one at a time per url
+update_locks = KeyedLock()
+
 
 @app.route("/create", methods=["POST"], cors=True, tag=["mosaic"])
 def create(
@@ -78,50 +95,244 @@ def create(
     if "{mosaicid}" in url:
         url = url.replace("{mosaicid}", mosaicid)
 
-    # Load mosaic if it already exists
-    try:
-        with MosaicBackend(url) as mosaic:
-            mosaic_def = dict(mosaic.mosaic_def)
-
-        return get_tilejson(
-            mosaic_def,
-            url,
-            tile_scale,
-            tile_format,
-            host=app.host,
-            path="/tiles",
-            **kwargs,
-        )
-
-    except Exception:
-        pass
-
-    features = search(
-        bounds=bounds,
+    # Concurrent creates of the same mosaic share one search and write
+    mosaic_def = create_requests.do(
+        (mosaicid, url),
+        _get_or_create,
+        url,
+        bounds,
+        quadkey_zoom=int(quadkey_zoom),
+        minzoom=minzoom,
+        maxzoom=maxzoom,
         min_cloud=min_cloud,
         max_cloud=max_cloud,
         min_date=min_date,
         max_date=max_date,
         period=period,
         period_qty=period_qty,
+        seasons=seasons,
     )
+    if mosaic_def is None:
+        return ("NOK", "text/plain", "No assets found for query")
 
-    if seasons:
-        features = filter_season(features, seasons)
+    return get_tilejson(
+        mosaic_def, url, tile_scale, tile_format, host=app.host, path="/tiles", **kwargs
+    )
 
-    if not features:
-        return ("NOK", "text/plain", "No assets found for query")
 
-    mosaic_def = features_to_mosaicJSON(
-        features=features, quadkey_zoom=quadkey_zoom, minzoom=minzoom, maxzoom=maxzoom
+def _get_or_create(
+    url: str,
+    bounds: Tuple[float, ...],
+    quadkey_zoom: int = 8,
+    minzoom: int = 7,
+    maxzoom: int = 12,
+    **query: Any,
+) -> Optional[Dict]:
+    """Load mosaic definition, or search scenes and write a new mosaic.
+
+    Returns None if the search finds no scene.
+    """
+    # Load mosaic if it already exists
+    try:
+        return dict(mosaic_cache.get(url).mosaic_def)
+    except Exception:
+        pass
+
+    from landsat_mosaic_tiler.stac import MosaicBuilder, search_scenes
+
+    # Scenes are assigned to quadkeys while the search pages stream in
+    builder = MosaicBuilder(quadkey_zoom=quadkey_zoom, minzoom=minzoom, maxzoom=maxzoom)
+    for scene in search_scenes(bounds, **query):
+        builder.add(scene)
+
+    if not len(builder):
+        return None
+
+    mosaic_def = builder.mosaic_def()
+    _write_mosaic(url, mosaic_def)
+    footprints = Footprints.from_scenes(builder.used_scenes())
+    _write_footprints(url, footprints, mosaic_def.get("version"))
+    mosaic_cache.invalidate(url)
+    return mosaic_def
+
+
+def _apply_delta(
+    url: str, builder: Any, prefer_newer: bool = True
+) -> Tuple[Dict, Set[str]]:
+    """Merge the scenes of a MosaicBuilder into a mosaic and write it back.
+
+    Returns the mosaic definition and the changed quadkeys.
+    """
+    mosaic = mosaic_cache.get(url)
+    if isinstance(mosaic, (QuadkeyIndex, PackedMosaic)):
+        mosaic_def = mosaic.to_mosaic_def()
+    else:
+        mosaic_def = dict(mosaic.mosaic_def)
+
+    if not len(builder):
+        return mosaic_def, set()
+
+    delta_def = builder.mosaic_def()
+    existing = {
+        quadkey: mosaic.tile(*mercantile.quadkey_to_tile(quadkey))
+        for quadkey in delta_def["tiles"]
+    }
+    tiles, changed = merge_tiles(
+        existing, delta_def["tiles"], prefer_newer=prefer_newer
     )
+    if not changed:
+        return mosaic_def, changed
+
+    mosaic_def.setdefault("tiles", {}).update({qk: tiles[qk] for qk in changed})
+    old_bounds, new_bounds = mosaic_def["bounds"], delta_def["bounds"]
+    mosaic_def["bounds"] = [
+        min(old_bounds[0], new_bounds[0]),
+        min(old_bounds[1], new_bounds[1]),
+        max(old_bounds[2], new_bounds[2]),
+        max(old_bounds[3], new_bounds[3]),
+    ]
+    mosaic_def["version"] = bump_version(mosaic_def.get("version"))
+
+    if urlparse(url).scheme == "dynamodb":
+        _write_quadkeys(url, mosaic_def, changed)
+    else:
+        _write_mosaic(url, mosaic_def)
+
+    # Merge the new scenes into the stored footprints. DynamoDB mosaics
+    # only hold the changed quadkeys here, so keep all their footprints.
+    footprints = Footprints.from_scenes(builder.used_scenes())
+    existing_footprints = get_footprints(url)
+    if existing_footprints is not None:
+        assets = dict.fromkeys(existing_footprints.assets + footprints.assets)
+        if urlparse(url).scheme != "dynamodb":
+            used = {a for assets in mosaic_def["tiles"].values() for a in assets}
+            assets = [asset for asset in assets if asset in used]
+        footprints = existing_footprints.select(assets, footprints)
+    _write_footprints(url, footprints, mosaic_def["version"])
+
+    mosaic_cache.invalidate(url)
+    return mosaic_def, changed
+
+
+def _write_mosaic(url: str, mosaic_def: Dict):
+    """Write a packed mosaic, or a MosaicJSON (and its index sidecar)."""
+    if is_packed(url):
+        storage.write(url, pack(mosaic_def), content_type="application/octet-stream")
+        return
+
+    from cogeo_mosaic.backends import MosaicBackend
 
     with MosaicBackend(url, mosaic_def=mosaic_def) as mosaic:
         mosaic.write()
 
-    return get_tilejson(
+    if os.getenv("MOSAIC_INDEX_SIDECAR", "FALSE").upper() == "TRUE":
+        # Tagged with the version of the document written, so that the sidecar
+        # is ignored once the document is rewritten by other means
+        index = QuadkeyIndex.from_mosaic_def(dict(mosaic.mosaic_def))
+        storage.write(index_url(url), index.to_bytes(get_version(url)))
+
+
+def _write_footprints(url: str, footprints: Footprints, version: Optional[str]):
+    """Write the asset footprints of a mosaic, tagged with the mosaic version."""
+    footprints.version = version
+    storage.write(footprints_url(url), footprints.to_bytes())
+    footprint_cache.invalidate(url)
+
+
+def _write_quadkeys(url: str, mosaic_def: Dict, quadkeys: Iterable[str]):
+    """Write metadata and only the given quadkeys of a DynamoDB mosaic.
+
+    Follows the cogeo-mosaic table layout: one item per quadkey and the
+    metadata under the "-1" quadkey.
+    """
+    import boto3
+
+    parsed = urlparse(url)
+    table = boto3.resource(
+        "dynamodb", region_name=parsed.netloc or os.getenv("AWS_REGION")
+    ).Table(parsed.path.strip("/"))
+
+    metadata = {k: v for k, v in mosaic_def.items() if k != "tiles"}
+    with table.batch_writer() as batch:
+        batch.put_item(
+            Item=json.loads(
+                json.dumps(dict(metadata, quadkey="-1")), parse_float=Decimal
+            )
+        )
+        for quadkey in quadkeys:
+            batch.put_item(
+                Item={"quadkey": quadkey, "assets": mosaic_def["tiles"][quadkey]}
+            )
+
+
+@app.route("/update", methods=["POST"], cors=True, tag=["mosaic"])
+def update(
+    url: str,
+    bounds: str = None,
+    min_cloud: float = 0,
+    max_cloud: float = 100,
+    min_date="2013-01-01",
+    max_date=datetime.strftime(datetime.today(), "%Y-%m-%d"),
+    period: str = None,
+    period_qty: int = 1,
+    seasons: str = None,
+    prefer_newer: str = "true",
+    tile_format: str = "jpg",
+    tile_scale: int = 1,
+    **kwargs: Any,
+) -> Tuple[str, str, str]:
+    """Handle /update requests: merge the scenes of a delta query into a mosaic.
+
+    Only the delta (e.g. a new date window, or an extra bounding box) is
+    searched, and the new scenes are merged into the affected quadkeys: existing
+    assets keep their priority, new path/rows are appended and, if
+    `prefer_newer`, a newer scene replaces the existing one of its path/row.
+
+    Args:
+        - url: Existing mosaic url
+        - bounds: Delta bounding box (defaults to the mosaic bounds)
+        - min_cloud, max_cloud, min_date, max_date, period, period_qty, seasons:
+          Delta query, see /create
+        - prefer_newer: Replace existing scenes by newer ones of the same path/row
+    """
+    try:
+        mosaic = mosaic_cache.get(url)
+    except Exception:
+        return ("NOK", "text/plain", f"Could not open mosaic {url}")
+
+    from landsat_mosaic_tiler.stac import MosaicBuilder, search_scenes
+
+    mosaic_def = dict(mosaic.mosaic_def)
+    bounds = tuple(map(float, bounds.split(","))) if bounds else mosaic_def["bounds"]
+    builder = MosaicBuilder(
+        quadkey_zoom=mosaic.quadkey_zoom,
+        minzoom=mosaic_def["minzoom"],
+        maxzoom=mosaic_def["maxzoom"],
+    )
+    for scene in search_scenes(
+        bounds,
+        min_cloud=float(min_cloud),
+        max_cloud=float(max_cloud),
+        min_date=min_date,
+        max_date=max_date,
+        period=period,
+        period_qty=period_qty,
+        seasons=seasons.split(",") if seasons else None,
+    ):
+        builder.add(scene)
+
+    # Merge into the latest mosaic, so concurrent updates don't drop a delta
+    with update_locks(url):
+        mosaic_cache.invalidate(url)
+        mosaic_def, changed = _apply_delta(
+            url, builder, prefer_newer=prefer_newer.lower() == "true"
+        )
+
+    status, content_type, body = get_tilejson(
         mosaic_def, url, tile_scale, tile_format, host=app.host, path="/tiles", **kwargs
     )
+    return_kwargs = {"custom_headers": {"X-CHANGED": str(len(changed))}}
+    return (status, content_type, body, return_kwargs)
 
 
 @app.route(
@@ -136,7 +347,10 @@ def info(url: str) -> Tuple[str, str, str]:
     if url is None:
         return ("NOK", "text/plain", "Missing 'URL' parameter")
 
-    with MosaicBackend(url) as mosaic:
+    mosaic = mosaic_cache.get(url)
+    if isinstance(mosaic, (QuadkeyIndex, PackedMosaic)):
+        mosaic_def = mosaic.to_mosaic_def()
+    else:
         mosaic_def = dict(mosaic.mosaic_def)
 
     return ("OK", "application/json", json.dumps(mosaic_def))
@@ -1,26 +1,39 @@
 """landsat_mosaic_tiler.handlers.tiles: handle request for landsat mosaic."""
+import functools
 import io
 import json
+import math
 import os
-from typing import Any, BinaryIO, Tuple
+from typing import Any, BinaryIO, Dict, List, Sequence, Tuple
 
 import mercantile
 import numpy
-from landsat_mosaic_tiler.pixel_methods import pixSel
-from landsat_mosaic_tiler.utils import get_tilejson, post_process_tile
-from cogeo_mosaic.backends import MosaicBackend
+from landsat_mosaic_tiler import timing
+from landsat_mosaic_tiler.binary import encode_frame, encode_npy
+from landsat_mosaic_tiler.cache import SingleFlight, mosaic_cache
+from landsat_mosaic_tiler.encoding import (
+    FORMATS as IMAGE_FORMATS,
+    encode_tile,
+    uniform_tile,
+)
+from landsat_mosaic_tiler.footprints import prune_assets
+from landsat_mosaic_tiler.multires import downsample, quadrants
+from landsat_mosaic_tiler.pyramid import pyramid_tile
+from landsat_mosaic_tiler.tile_cache import tile_cache, tile_key
+from landsat_mosaic_tiler.utils import (
+    get_hash,
+    get_tilejson,
+    post_process_tile,
+    scene_date,
+)
+from landsat_mosaic_tiler.vector import vector_tile
+from landsat_mosaic_tiler.warmup import WARMUP, warmup
 from lambda_proxy.proxy import API
-from PIL import Image
-from rasterio.transform import from_bounds
-from rio_tiler.colormap import get_colormap
-from rio_tiler.io.landsat8 import tile as landsatTiler
-from rio_tiler.profiles import img_profiles
-from rio_tiler.utils import expression as expressionTiler
-from rio_tiler.utils import render
-from rio_tiler_mosaic.mosaic import mosaic_tiler
 
 app = API(name="landsat-mosaic-tiler-tiles", debug=False)
 
+tile_requests = SingleFlight()
+
 
 @app.route(
     "/tilejson.json",
@@ -43,8 +56,7 @@ def tilejson(
     if url is None:
         return ("NOK", "text/plain", "Missing 'URL' parameter")
 
-    with MosaicBackend(url) as mosaic:
-        mosaic_def = dict(mosaic.mosaic_def)
+    mosaic_def = dict(mosaic_cache.get(url).mosaic_def)
 
     return get_tilejson(
         mosaic_def, url, tile_scale, tile_format, host=app.host, path="/tiles", **kwargs
@@ -78,50 +90,131 @@ def npy_tiles(
     bands: str = None,
     expr: str = None,
     pixel_selection: str = "first",
+    format: str = "npy",
+    compression: str = None,
 ) -> Tuple[str, str, BinaryIO]:
-    """Handle tile requests."""
+    """Handle tile requests.
+
+    Args:
+        - format: Output encoding, one of
+            - 'npy': pickled (data, mask) tuple, to be read with
+              `numpy.load(..., allow_pickle=True)`
+            - 'array': plain `.npy` of the data array
+            - 'frame': data, mask and assets in a framed binary (see
+              `landsat_mosaic_tiler.binary`), optionally compressed
+        - compression: 'lz4' or 'zstd' compression of 'frame' outputs
+    """
+    with timing.request("npy_tiles", z=z) as timer:
+        response = render_array(
+            url,
+            z,
+            x,
+            y,
+            scale=scale,
+            bands=bands,
+            expr=expr,
+            pixel_selection=pixel_selection,
+            format=format,
+            compression=compression,
+        )
+    return timing.with_header(response, timer)
+
+
+def render_array(
+    url: str,
+    z: int,
+    x: int,
+    y: int,
+    scale: int = 1,
+    bands: str = None,
+    expr: str = None,
+    pixel_selection: str = "first",
+    format: str = "npy",
+    compression: str = None,
+) -> Tuple:
+    """Read and mosaic a tile as arrays (see `npy_tiles`)."""
+    if format not in ["npy", "array", "frame"]:
+        return ("NOK", "text/plain", f"Invalid format: {format}")
+
     if url is None:
         return ("NOK", "text/plain", "Missing 'URL' parameter")
 
-    with MosaicBackend(url) as mosaic:
-        assets = mosaic.tile(x, y, z)
+    assets = _get_assets(url, x, y, z, first=pixel_selection == "first")
 
     if not assets:
         return ("EMPTY", "text/plain", f"No assets found for tile {z}-{x}-{y}")
 
-    tilesize = 256 * scale
+    if expr is None and bands is None:
+        return ("NOK", "text/plain", "No bands nor expression given")
 
-    pixel_selection = pixSel[pixel_selection]
-    if expr is not None:
-        results = mosaic_tiler(
-            assets,
-            x,
-            y,
-            z,
-            expressionTiler,
-            pixel_selection=pixel_selection(),
-            expr=expr,
-            tilesize=tilesize,
-        )
+    from landsat_mosaic_tiler.pixel_methods import pixSel
+
+    results = _read_tile(
+        assets,
+        x,
+        y,
+        z,
+        256 * scale,
+        pixSel[pixel_selection](),
+        bands=bands,
+        expr=expr,
+    )
 
-    elif bands is not None:
-        results = mosaic_tiler(
-            assets,
-            x,
-            y,
-            z,
-            landsatTiler,
-            pixel_selection=pixel_selection(),
-            bands=tuple(bands.split(",")),
-            tilesize=tilesize,
-        )
-    else:
-        return ("NOK", "text/plain", "No bands nor expression given")
+    if format == "npy":
+        with timing.stage("encode"):
+            sio = io.BytesIO()
+            numpy.save(sio, results)
+        return ("OK", "application/x-binary", sio.getbuffer())
 
-    sio = io.BytesIO()
-    numpy.save(sio, results)
-    sio.seek(0)
-    return ("OK", "application/x-binary", sio.getvalue())
+    data, mask = results
+    if data is None:
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    # `pixel_selection=all` returns one array per asset
+    if isinstance(data, (list, tuple)):
+        data, mask = numpy.stack(data), numpy.stack(mask)
+
+    return_kwargs = {
+        "custom_headers": {"X-ASSETS": json.dumps(assets, separators=(",", ":"))}
+    }
+    with timing.stage("encode"):
+        if format == "array":
+            content = encode_npy(data)
+        else:
+            content = encode_frame(data, mask, assets=assets, compression=compression)
+    return ("OK", "application/x-binary", content, return_kwargs)
+
+
+@app.route(
+    "/<int:z>/<int:x>/<int:y>.mvt",
+    methods=["GET"],
+    cors=True,
+    payload_compression_method="gzip",
+    binary_b64encode=True,
+    tag=["tiles"],
+    cache_control=os.getenv("CACHE_CONTROL", None),
+)
+@app.route(
+    "/<int:z>/<int:x>/<int:y>.pbf",
+    methods=["GET"],
+    cors=True,
+    payload_compression_method="gzip",
+    binary_b64encode=True,
+    tag=["tiles"],
+    cache_control=os.getenv("CACHE_CONTROL", None),
+)
+def vector_tiles(url: str, z: int, x: int, y: int) -> Tuple[str, str, bytes]:
+    """Handle vector tile requests: quadkeys and scene footprints of a mosaic."""
+    if url is None:
+        return ("NOK", "text/plain", "Missing 'URL' parameter")
+
+    with timing.request("vector_tiles", z=z) as timer:
+        content = vector_tile(url, x, y, z)
+        if content is None:
+            response = ("EMPTY", "text/plain", f"No assets found for tile {z}-{x}-{y}")
+        else:
+            response = ("OK", "application/x-protobuf", content)
+    return timing.with_header(response, timer)
 
 
 @app.route(
@@ -156,112 +249,380 @@ def tiles(
     color_map: str = None,
     pan: bool = False,
     pixel_selection: str = "first",
+    max_frames: int = None,
+    children: int = None,
 ) -> Tuple[str, str, BinaryIO]:
-    """Handle tile requests."""
-    with MosaicBackend(url) as mosaic:
-        assets = mosaic.tile(x, y, z)
+    """Handle tile requests.
+
+    `gif` tiles, and `png`/`webp` tiles with `pixel_selection=all`, are
+    animations with one frame per asset (at most `max_frames`).
+
+    With `children` (a scale, e.g. 1 or 2) and a tile cache, the four z+1
+    children of the tile at @`children`x, and the tile at the other scales the
+    read covers, are rendered from the same mosaic read and cached.
+    """
+    options = dict(
+        scale=scale,
+        ext=ext,
+        bands=bands,
+        expr=expr,
+        rescale=rescale,
+        color_ops=color_ops,
+        color_map=color_map,
+        pan=pan,
+        pixel_selection=pixel_selection,
+        max_frames=max_frames,
+    )
+    children = int(children) if children else None
+    with timing.request("tiles", z=z) as timer:
+        # Identical concurrent requests are rendered once
+        key = get_hash(url=url, z=z, x=x, y=y, children=children, **options)
+        response = tile_requests.do(
+            key, cached_tile, url, z, x, y, children=children, **options
+        )
+    return timing.with_header(response, timer)
+
+
+def cached_tile(
+    url: str, z: int, x: int, y: int, children: int = None, **options: Any
+) -> Tuple:
+    """Return tile from the pyramid or the tile cache, rendering it on miss.
+
+    With `children`, tiles rendered along with the requested one (see
+    `render_family`) are cached too.
+    """
+    with timing.stage("pyramid"):
+        response = pyramid_tile(url, z, x, y, **options)
+    if response is not None:
+        return response
+
+    if tile_cache is None:
+        return render_tile(url, z, x, y, **options)
+
+    mosaic = mosaic_cache.get(url)
+    version = mosaic_cache.version(url) or dict(mosaic.mosaic_def).get("version")
+    key = tile_key(url, version, z, x, y, **options)
+    with timing.stage("cache"):
+        response = tile_cache.get(key)
+    if response is not None:
+        return response
+
+    # Children are only rendered along when the read at @`scale`x covers them
+    # (e.g. not @3x tiles, which would need a larger read)
+    animated = _animated(options.get("ext", "png"), options.get("pixel_selection"))
+    if children and int(options.get("scale", 1)) % (2 * children):
+        children = None
+    if not children or animated:
+        response = render_tile(url, z, x, y, **options)
+        if response[0] == "OK":
+            tile_cache.set(key, response)
+        return response
+
+    scale = int(options.pop("scale", 1))
+    family = render_family(url, z, x, y, [scale], children, **options)
+    with timing.stage("cache"):
+        for (tz, tx, ty, tscale), rendered in family.items():
+            if rendered[0] == "OK":
+                tkey = tile_key(url, version, tz, tx, ty, scale=tscale, **options)
+                tile_cache.set(tkey, rendered)
+
+    return family[(z, x, y, scale)]
+
+
+def _animated(ext: str, pixel_selection: str) -> bool:
+    return ext == "gif" or (pixel_selection == "all" and ext in ["png", "webp"])
+
+
+def render_tile(
+    url: str,
+    z: int,
+    x: int,
+    y: int,
+    scale: int = 1,
+    ext: str = "png",
+    bands: str = None,
+    expr: str = None,
+    rescale: str = None,
+    color_ops: str = None,
+    color_map: str = None,
+    pan: bool = False,
+    pixel_selection: str = "first",
+    max_frames: int = None,
+) -> Tuple:
+    """Read, mosaic and render a tile (see `tiles`)."""
+    assets = _get_assets(url, x, y, z, first=pixel_selection == "first")
 
     if not assets:
         return ("EMPTY", "text/plain", f"No assets found for tile {z}-{x}-{y}")
 
-    tilesize = 256 * scale
+    if color_map:
+        from rio_tiler.colormap import get_colormap
 
-    pixel_selection = pixSel[pixel_selection]
-    if expr is not None:
-        tile, mask = mosaic_tiler(
-            assets,
-            x,
-            y,
-            z,
-            expressionTiler,
-            pixel_selection=pixel_selection(),
-            expr=expr,
-            tilesize=tilesize,
-            pan=pan,
+        color_map = get_colormap(color_map, format="gdal")
+
+    # Modules only used by some formats are imported on first use, to keep
+    # cold starts short
+    animated = _animated(ext, pixel_selection)
+    if animated:
+        from landsat_mosaic_tiler.animation import (
+            MAX_FRAMES,
+            FrameStack,
+            encode_animation,
         )
 
-    elif bands is not None:
-        tile, mask = mosaic_tiler(
-            assets,
-            x,
-            y,
-            z,
-            landsatTiler,
-            pixel_selection=pixel_selection(),
-            bands=tuple(bands.split(",")),
-            tilesize=tilesize,
-            pan=pan,
+        pixel_selection = FrameStack(
+            rescale=rescale,
+            color_formula=color_ops,
+            colormap=color_map,
+            max_frames=int(max_frames) if max_frames else MAX_FRAMES,
         )
     else:
+        from landsat_mosaic_tiler.pixel_methods import pixSel
+
+        pixel_selection = pixSel[pixel_selection]()
+
+    if expr is None and bands is None:
         return ("NOK", "text/plain", "No bands nor expression given")
 
+    tile, mask = _read_tile(
+        assets, x, y, z, 256 * scale, pixel_selection, bands=bands, expr=expr, pan=pan
+    )
     if tile is None:
         return ("EMPTY", "text/plain", "empty tiles")
 
+    if animated:
+        with timing.stage("encode"):
+            content = encode_animation(tile, ext)
+        return ("OK", f"image/{ext}", content, _assets_header(assets))
+
+    return _encode_tile(
+        tile,
+        mask,
+        assets,
+        x,
+        y,
+        z,
+        ext=ext,
+        rescale=rescale,
+        color_ops=color_ops,
+        color_map=color_map,
+    )
+
+
+def _lcm(a: int, b: int) -> int:
+    return a * b // math.gcd(a, b)
+
+
+def render_family(
+    url: str,
+    z: int,
+    x: int,
+    y: int,
+    scales: Sequence[int],
+    children: int,
+    ext: str = "png",
+    bands: str = None,
+    expr: str = None,
+    rescale: str = None,
+    color_ops: str = None,
+    color_map: str = None,
+    pan: bool = False,
+    pixel_selection: str = "first",
+    max_frames: int = None,
+) -> Dict[Tuple[int, int, int, int], Tuple]:
+    """Render a tile and its four z+1 children from a single mosaic read.
+
+    The mosaic is read once, at the least common multiple of `scales` and
+    2 * `children` (the children at @`children`x), so that every tile is a
+    whole block average of the read. Children are block-averaged quarters of
+    the read, and the tile is block-averaged down to each of `scales` and to
+    the other scales the read covers.
+
+    Returns responses keyed by `(z, x, y, scale)`.
+    """
+    scale = functools.reduce(_lcm, scales, 2 * children)
+    tilesize = 256 * scale
+    family = [(z, x, y, s) for s in range(1, scale + 1) if scale % s == 0]
+    family += [
+        (z + 1, 2 * x + dx, 2 * y + dy, children) for dy in [0, 1] for dx in [0, 1]
+    ]
+
+    assets = _get_assets(url, x, y, z, first=pixel_selection == "first")
+    if not assets:
+        empty = ("EMPTY", "text/plain", f"No assets found for tile {z}-{x}-{y}")
+        return {key: empty for key in family}
+
+    if expr is None and bands is None:
+        invalid = ("NOK", "text/plain", "No bands nor expression given")
+        return {key: invalid for key in family}
+
+    from landsat_mosaic_tiler.pixel_methods import pixSel
+
+    tile, mask = _read_tile(
+        assets,
+        x,
+        y,
+        z,
+        tilesize,
+        pixSel[pixel_selection](),
+        bands=bands,
+        expr=expr,
+        pan=pan,
+    )
+    if tile is None:
+        return {key: ("EMPTY", "text/plain", "empty tiles") for key in family}
+
     if color_map:
+        from rio_tiler.colormap import get_colormap
+
         color_map = get_colormap(color_map, format="gdal")
 
-    assets_str = json.dumps(assets, separators=(",", ":"))
-    return_kwargs = {"custom_headers": {"X-ASSETS": assets_str}}
-
-    if ext == "gif":
-        frames = []
-        options = img_profiles.get("png", {})
-        for i in range(len(tile)):
-            img = post_process_tile(
-                tile[i].copy(), mask[i].copy(), rescale=rescale, color_formula=color_ops
-            )
-            frames.append(
-                Image.open(
-                    io.BytesIO(
-                        render(
-                            img,
-                            mask[i],
-                            img_format="png",
-                            colormap=color_map,
-                            **options,
-                        )
-                    )
-                )
-            )
-        sio = io.BytesIO()
-        frames[0].save(
-            sio,
-            "gif",
-            save_all=True,
-            append_images=frames[1:],
-            duration=300,
-            loop=0,
-            optimize=True,
+    def _encode(tile, mask, tx, ty, tz):
+        return _encode_tile(
+            tile,
+            mask,
+            assets,
+            tx,
+            ty,
+            tz,
+            ext=ext,
+            rescale=rescale,
+            color_ops=color_ops,
+            color_map=color_map,
         )
-        sio.seek(0)
-        return ("OK", f"image/{ext}", sio.getvalue(), return_kwargs)
 
-    rtile = post_process_tile(tile, mask, rescale=rescale, color_formula=color_ops)
+    responses = {}
+    with timing.stage("resample"):
+        for tz, tx, ty, tscale in family:
+            if tz == z:
+                data, data_mask = downsample(tile, mask, scale // tscale)
+                responses[(tz, tx, ty, tscale)] = _encode(data, data_mask, tx, ty, tz)
+
+        factor = scale // (2 * children)
+        for dx, dy, data, data_mask in quadrants(tile, mask):
+            data, data_mask = downsample(data, data_mask, factor)
+            tx, ty = 2 * x + dx, 2 * y + dy
+            responses[(z + 1, tx, ty, children)] = _encode(
+                data, data_mask, tx, ty, z + 1
+            )
+
+    return responses
+
+
+def _read_tile(
+    assets: List[str],
+    x: int,
+    y: int,
+    z: int,
+    tilesize: int,
+    pixel_selection: Any,
+    bands: str = None,
+    expr: str = None,
+    pan: bool = False,
+) -> Tuple:
+    from landsat_mosaic_tiler.reader import mosaic_tiler
+    from landsat_mosaic_tiler.tilers import (
+        landsat_expression,
+        landsat_extra_bands,
+        landsat_tile,
+    )
+
+    if expr is not None:
+        tiler, options = landsat_expression, dict(expr=expr)
+    else:
+        tiler, options = landsat_tile, dict(bands=tuple(bands.split(",")))
+
+    # Methods using the quality band (or other bands) to select pixels
+    extra_bands = getattr(pixel_selection, "extra_bands", None)
+    if extra_bands:
+        options.update(reader=tiler, extra_bands=extra_bands)
+        tiler = landsat_extra_bands
+    if getattr(pixel_selection, "newest_first", False):
+        assets = sorted(assets, key=scene_date, reverse=True)
+
+    return mosaic_tiler(
+        assets,
+        x,
+        y,
+        z,
+        tiler,
+        pixel_selection=pixel_selection,
+        tilesize=tilesize,
+        pan=pan,
+        **options,
+    )
+
+
+def _assets_header(assets: List[str]) -> Dict:
+    assets_str = json.dumps(assets, separators=(",", ":"))
+    return {"custom_headers": {"X-ASSETS": assets_str}}
+
+
+def _encode_tile(
+    tile: numpy.ndarray,
+    mask: numpy.ndarray,
+    assets: List[str],
+    x: int,
+    y: int,
+    z: int,
+    ext: str = "png",
+    rescale: str = None,
+    color_ops: str = None,
+    color_map: Any = None,
+) -> Tuple:
+    return_kwargs = _assets_header(assets)
+
+    # Tiles of masked pixels only (e.g. mosaic edges) skip post processing
+    if ext in IMAGE_FORMATS and not mask.any():
+        with timing.stage("encode"):
+            content = uniform_tile(ext, tile.shape[-1], None)
+        return ("OK", f"image/{ext}", content, return_kwargs)
+
+    with timing.stage("post"):
+        rtile = post_process_tile(tile, mask, rescale=rescale, color_formula=color_ops)
+
+    if ext in IMAGE_FORMATS and rtile.dtype == numpy.uint8:
+        with timing.stage("encode"):
+            content = encode_tile(rtile, mask, ext, colormap=color_map)
+        return ("OK", f"image/{ext}", content, return_kwargs)
 
     if ext == "bin":
-        # Flatten in Row-major order
-        buf = rtile.tobytes(order='C')
+        # Row-major bytes, without copy when already C-contiguous
+        buf = memoryview(numpy.ascontiguousarray(rtile)).cast("B")
         return ("OK", "application/x-binary", buf, return_kwargs)
 
+    from rio_tiler.profiles import img_profiles
+    from rio_tiler.utils import render
+
     driver = "jpeg" if ext == "jpg" else ext
     options = img_profiles.get(driver, {})
 
     if ext == "tif":
+        from rasterio.transform import from_bounds
+
         ext = "tiff"
         driver = "GTiff"
+        tilesize = tile.shape[-1]
         tile_bounds = mercantile.xy_bounds(mercantile.Tile(x=x, y=y, z=z))
         options = dict(
             crs={"init": "EPSG:3857"},
             transform=from_bounds(*tile_bounds, tilesize, tilesize),
         )
 
-    return (
-        "OK",
-        f"image/{ext}",
-        render(rtile, mask, img_format=driver, colormap=color_map, **options),
-        return_kwargs,
-    )
+    with timing.stage("encode"):
+        content = render(rtile, mask, img_format=driver, colormap=color_map, **options)
+    return ("OK", f"image/{ext}", content, return_kwargs)
+
+
+def _get_assets(url: str, x: int, y: int, z: int, first: bool = False) -> List[str]:
+    with timing.stage("fetch"):
+        mosaic = mosaic_cache.get(url)
+    with timing.stage("lookup"):
+        assets = mosaic.tile(x, y, z)
+    with timing.stage("prune"):
+        pruned = prune_assets(url, mosaic, assets, x, y, z, first=first)
+    timing.count("pruned", len(assets) - len(pruned))
+    return pruned
 
 
 @app.route(
@@ -274,3 +635,7 @@ def tiles(
 def favicon() -> Tuple[str, str, str]:
     """Favicon."""
     return ("EMPTY", "text/plain", "")
+
+
+if WARMUP:
+    warmup()
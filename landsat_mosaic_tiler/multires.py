@@ -0,0 +1,50 @@
+"""landsat_mosaic_tiler.multires: several tile resolutions from one mosaic read.
+
+A tile read at `256 * 2 * s` pixels holds the tile at @2s and, pixel for
+pixel, its four children at @s. Lower resolutions are block averages of it.
+"""
+
+from typing import Iterator, Tuple
+
+import numpy
+
+
+def downsample(
+    data: numpy.ndarray, mask: numpy.ndarray, factor: int
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Average `factor` x `factor` blocks of valid pixels.
+
+    A block is valid (mask 255) if any of its pixels is. The arrays returned
+    are always new ones, as post processing may rescale them in place.
+    """
+    if factor == 1:
+        return data.copy(), mask.copy()
+
+    bands, height, width = data.shape
+    shape = (height // factor, factor, width // factor, factor)
+    valid = (mask != 0).reshape(shape)
+    count = valid.sum(axis=(1, 3))
+
+    total = numpy.where(valid, data.reshape((bands,) + shape), 0).sum(
+        axis=(2, 4), dtype=numpy.float64
+    )
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean = numpy.where(count > 0, total / count, 0)
+
+    if numpy.issubdtype(data.dtype, numpy.integer):
+        mean = numpy.rint(mean)
+
+    out_mask = numpy.where(count > 0, 255, 0).astype(mask.dtype)
+    return mean.astype(data.dtype), out_mask
+
+
+def quadrants(
+    data: numpy.ndarray, mask: numpy.ndarray
+) -> Iterator[Tuple[int, int, numpy.ndarray, numpy.ndarray]]:
+    """Yield the `(dx, dy, data, mask)` views of the four child tiles."""
+    half_y, half_x = data.shape[-2] // 2, data.shape[-1] // 2
+    for dy in range(2):
+        for dx in range(2):
+            rows = slice(dy * half_y, (dy + 1) * half_y)
+            cols = slice(dx * half_x, (dx + 1) * half_x)
+            yield dx, dy, data[..., rows, cols], mask[rows, cols]
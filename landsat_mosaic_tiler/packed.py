@@ -0,0 +1,268 @@
+"""landsat_mosaic_tiler.packed: binary mosaic format with partial reads.
+
+A packed mosaic (`*.pmosaic`) holds the same quadkey -> assets mapping as a
+MosaicJSON, in blocks of `block_size` sorted quadkeys:
+
+    offset  size  content
+    0       4     magic, b"LMPK"
+    4       4     header length `n` (uint32, little endian)
+    8       n     JSON header: mosaic metadata (MosaicJSON without `tiles`),
+                  `quadkey_zoom`, `count` (quadkeys), `block_size`, and the
+                  `assets` and `index` sections as [offset, length] from the
+                  end of the header
+    ...           assets: zlib compressed, newline separated, sorted assets
+    ...           index: first quadkey (uint64) of every block, then the block
+                  offsets (uint64, `blocks + 1` values, from the end of the index)
+    ...           blocks: zlib compressed uint32 number of quadkeys `k`, uint32
+                  number of asset ids `m`, quadkeys (uint64, delta encoded),
+                  CSR offsets (uint32, `k + 1`) and asset ids (uint32, `m`)
+
+Quadkeys are stored as integers (see `quadkey_index`). Opening a mosaic reads
+its head (header, assets and index) once, then looking up a tile only reads and
+decompresses the block holding its quadkey (or, below `quadkey_zoom`, the run
+of contiguous blocks holding its children) with a single range request. Local
+files are memory mapped.
+"""
+
+import json
+import mmap
+import struct
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlparse
+
+import numpy
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.quadkey_index import (
+    QuadkeyIndex,
+    int_to_quadkey,
+    key_range,
+    rollup_ids,
+    tile_to_int,
+)
+
+MAGIC = b"LMPK"
+EXTENSION = ".pmosaic"
+
+# Bytes read when opening a mosaic, enough for the head of most mosaics
+HEAD_SIZE = 64 * 1024
+
+Block = Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+
+
+def is_packed(url: str) -> bool:
+    """Whether url points to a packed mosaic."""
+    return urlparse(url).path.endswith(EXTENSION)
+
+
+def _encode_block(keys: numpy.ndarray, offsets: numpy.ndarray, ids: numpy.ndarray):
+    deltas = numpy.diff(keys, prepend=numpy.uint64(0))
+    return zlib.compress(
+        b"".join(
+            [
+                struct.pack("<II", len(keys), len(ids)),
+                deltas.astype("<u8").tobytes(),
+                (offsets - offsets[0]).astype("<u4").tobytes(),
+                ids.astype("<u4").tobytes(),
+            ]
+        ),
+        9,
+    )
+
+
+def _decode_block(body: bytes) -> Block:
+    raw = zlib.decompress(body)
+    count, nids = struct.unpack("<II", raw[:8])
+    keys = numpy.cumsum(numpy.frombuffer(raw, "<u8", count, 8), dtype=numpy.uint64)
+    start = 8 + 8 * count
+    offsets = numpy.frombuffer(raw, "<u4", count + 1, start)
+    ids = numpy.frombuffer(raw, "<u4", nids, start + 4 * (count + 1))
+    return keys, offsets, ids
+
+
+def pack(mosaic_def: Dict, block_size: int = 256) -> bytes:
+    """Encode a MosaicJSON document."""
+    index = QuadkeyIndex.from_mosaic_def(mosaic_def)
+
+    # Sorted assets compress better (Landsat scene ids share long prefixes)
+    order = sorted(range(len(index.assets)), key=index.assets.__getitem__)
+    remap = numpy.empty(len(order), dtype=numpy.uint32)
+    remap[order] = numpy.arange(len(order), dtype=numpy.uint32)
+    assets = [index.assets[i] for i in order]
+    asset_ids = remap[index.asset_ids] if len(index.asset_ids) else index.asset_ids
+
+    blocks = []
+    for start in range(0, len(index.keys), block_size):
+        stop = min(start + block_size, len(index.keys))
+        row_offsets = index.offsets[start : stop + 1]
+        ids = asset_ids[row_offsets[0] : row_offsets[-1]]
+        blocks.append(_encode_block(index.keys[start:stop], row_offsets, ids))
+
+    block_offsets = numpy.cumsum([0] + [len(b) for b in blocks], dtype="<u8")
+    first_keys = index.keys[::block_size].astype("<u8")
+
+    assets_bytes = zlib.compress("\n".join(assets).encode(), 9)
+    index_bytes = first_keys.tobytes() + block_offsets.tobytes()
+
+    header = dict(
+        index.mosaic_def,
+        quadkey_zoom=index.quadkey_zoom,
+        count=len(index.keys),
+        block_size=block_size,
+        assets=[0, len(assets_bytes)],
+        index=[len(assets_bytes), len(index_bytes)],
+    )
+    header_bytes = json.dumps(header, default=str).encode()
+
+    return b"".join(
+        [
+            MAGIC,
+            struct.pack("<I", len(header_bytes)),
+            header_bytes,
+            assets_bytes,
+            index_bytes,
+            *blocks,
+        ]
+    )
+
+
+class PackedMosaic(object):
+    """Read-only packed mosaic, with the `tile(x, y, z)` and `mosaic_def`
+    interface of the other mosaic backends.
+    """
+
+    def __init__(self, url: str, block_cache_size: int = 256):
+        """Open mosaic and read its head."""
+        self.url = url
+        self._mmap = None
+        if urlparse(url).scheme in ["", "file"]:
+            with open(urlparse(url).path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        head = self._read(0, HEAD_SIZE - 1)
+        if head[:4] != MAGIC:
+            raise Exception(f"{url} is not a packed mosaic")
+
+        (length,) = struct.unpack("<I", head[4:8])
+        header = json.loads(head[8 : 8 + length])
+        start = 8 + length
+        index_offset, index_length = header.pop("index")
+        assets_offset, assets_length = header.pop("assets")
+
+        end = start + index_offset + index_length
+        if len(head) < end:
+            head += self._read(len(head), end - 1)
+
+        assets = zlib.decompress(
+            head[start + assets_offset : start + assets_offset + assets_length]
+        ).decode()
+        self.assets = assets.split("\n") if assets else []
+
+        nblocks = -(-header["count"] // header["block_size"])
+        index = numpy.frombuffer(
+            head, "<u8", 2 * nblocks + 1, start + index_offset
+        ).astype(numpy.uint64)
+        self.first_keys = index[:nblocks]
+        self.block_offsets = index[nblocks:] + numpy.uint64(end)
+
+        self.quadkey_zoom = header["quadkey_zoom"]
+        self.count = header.pop("count")
+        self.block_size = header.pop("block_size")
+        self.mosaic_def = header
+
+        self._block = lru_cache(maxsize=block_cache_size)(self._load_blocks)
+        self._rollup = lru_cache(maxsize=4096)(self._rollup_assets)
+
+    def __len__(self) -> int:
+        """Number of quadkeys."""
+        return self.count
+
+    def _read(self, start: int, end: int) -> bytes:
+        """Bytes [start, end] (inclusive) of the mosaic file."""
+        if self._mmap is not None:
+            return self._mmap[start : end + 1]
+        return storage.read(self.url, start, end)
+
+    def _load_blocks(self, first: int, last: int) -> List[Block]:
+        """Decoded blocks `first` to `last` (inclusive), in one read."""
+        start = int(self.block_offsets[first])
+        body = self._read(start, int(self.block_offsets[last + 1]) - 1)
+        blocks = []
+        for idx in range(first, last + 1):
+            offset = int(self.block_offsets[idx]) - start
+            size = int(self.block_offsets[idx + 1] - self.block_offsets[idx])
+            blocks.append(_decode_block(body[offset : offset + size]))
+        return blocks
+
+    def rows(
+        self, x: int, y: int, z: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Keys, offsets and asset ids (indexes in `assets`) of the quadkeys
+        within tile x/y/z (or containing it).
+        """
+        start, stop = key_range(x, y, z, self.quadkey_zoom)
+        first = max(int(numpy.searchsorted(self.first_keys, start, "right")) - 1, 0)
+        last = int(numpy.searchsorted(self.first_keys, stop)) - 1
+        if not self.count or last < first:
+            return (
+                numpy.zeros(0, dtype=numpy.uint64),
+                numpy.zeros(1, dtype=numpy.uint32),
+                numpy.zeros(0, dtype=numpy.uint32),
+            )
+
+        # Merge the blocks into one CSR table
+        if first == last:
+            blocks = self._block(first, last)
+        else:
+            blocks = self._load_blocks(first, last)
+        keys = numpy.concatenate([block[0] for block in blocks])
+        asset_ids = numpy.concatenate([block[2] for block in blocks])
+        bases = numpy.cumsum([0] + [len(block[2]) for block in blocks])
+        offsets = numpy.concatenate(
+            [block[1][:-1] + base for block, base in zip(blocks, bases)] + [bases[-1:]]
+        )
+
+        lo, hi = numpy.searchsorted(keys, numpy.array([start, stop], numpy.uint64))
+        offsets = offsets[lo : hi + 1]
+        return keys[lo:hi], offsets - offsets[0], asset_ids[offsets[0] : offsets[-1]]
+
+    def _rollup_assets(self, x: int, y: int, z: int) -> List[str]:
+        """Assets of all the children quadkeys of a tile below quadkey_zoom."""
+        keys, offsets, asset_ids = self.rows(x, y, z)
+        if not len(keys):
+            return []
+        ids = rollup_ids(keys, offsets, asset_ids, x, y, z, self.quadkey_zoom)
+        return [self.assets[i] for i in ids]
+
+    def tile(self, x: int, y: int, z: int) -> List[str]:
+        """Retrieve assets for tile."""
+        if not self.count:
+            return []
+
+        if z < self.quadkey_zoom:
+            return list(self._rollup(x, y, z))
+
+        shift = z - self.quadkey_zoom
+        key = tile_to_int(x >> shift, y >> shift, self.quadkey_zoom)
+        block = int(numpy.searchsorted(self.first_keys, key, "right")) - 1
+        if block < 0:
+            return []
+
+        [(keys, offsets, ids)] = self._block(block, block)
+        row = int(numpy.searchsorted(keys, numpy.uint64(key)))
+        if row == len(keys) or keys[row] != key:
+            return []
+        return [self.assets[i] for i in ids[offsets[row] : offsets[row + 1]]]
+
+    def to_mosaic_def(self) -> Dict[str, Any]:
+        """Rebuild the full MosaicJSON document."""
+        tiles = {}
+        if self.count:
+            for keys, offsets, ids in self._load_blocks(0, len(self.first_keys) - 1):
+                for row, key in enumerate(keys):
+                    tiles[int_to_quadkey(int(key), self.quadkey_zoom)] = [
+                        self.assets[i] for i in ids[offsets[row] : offsets[row + 1]]
+                    ]
+        return dict(self.mosaic_def, tiles=tiles)
@@ -1,5 +1,8 @@
 """landsat-mosaic-tiler.mosaic: create mosaicJSON from a stac query."""
 
+import os
+from functools import lru_cache
+
 import numpy
 
 from rio_tiler_mosaic.methods import defaults
@@ -30,43 +33,243 @@ class allStack(MosaicMethodBase):
 class LastBandHigh(MosaicMethodBase):
     """Feed the mosaic tile using the last band as decision factor."""
 
+    def __init__(self):
+        """Overwrite base and init LastBandHigh method."""
+        super(LastBandHigh, self).__init__()
+        self.mask = None
+        self._pidex = None
+        self._delta = None
+
     @property
     def data(self):
         """Return data and mask."""
         if self.tile is not None:
-            return self.tile.data[:-1], ~self.tile.mask[0] * 255
+            return self.tile[:-1], numpy.logical_not(self.mask).view(numpy.uint8) * 255
         else:
             return None, None
 
     def feed(self, tile: numpy.ma.array):
         """Add data to tile."""
+        mask = numpy.ma.getmaskarray(tile)[0]
         if self.tile is None:
-            self.tile = tile
+            self.tile = tile.data.copy()
+            self.mask = mask.copy()
+            self._pidex = numpy.empty_like(self.mask)
+            if issubclass(self.tile.dtype.type, numpy.integer):
+                self._delta = numpy.empty_like(self.tile)
             return
 
-        pidex = (
-            numpy.bitwise_and(tile.data[-1] > self.tile.data[-1], ~tile.mask)
-            | self.tile.mask
-        )
+        # pidex = (last band is higher & valid) | current pixel is masked
+        pidex = self._pidex
+        numpy.greater(tile.data[-1], self.tile[-1], out=pidex)
+        numpy.greater(pidex, mask, out=pidex)
+        numpy.logical_or(pidex, self.mask, out=pidex)
+
+        if self._delta is not None:
+            # Branch-free select for integers: tile += (new - tile) * pidex
+            # (wrapping arithmetic gives back `new` exactly where pidex is set)
+            numpy.subtract(tile.data, self.tile, out=self._delta)
+            numpy.multiply(self._delta, pidex.view(numpy.uint8), out=self._delta)
+            numpy.add(self.tile, self._delta, out=self.tile)
+        else:
+            numpy.copyto(self.tile, tile.data, where=pidex)
 
-        mask = numpy.where(pidex, tile.mask, self.tile.mask)
-        self.tile = numpy.ma.where(pidex, tile, self.tile)
-        self.tile.mask = mask
+        # Pixels only stay masked if masked in both tiles
+        numpy.logical_and(self.mask, mask, out=self.mask)
 
 
 class CountValidMethod(MosaicMethodBase):
     """Feed the mosaic tile and return the number of valid observation by pixel."""
 
-    def feed(self, tile):
+    def __init__(self):
+        """Overwrite base and init CountValid method."""
+        super(CountValidMethod, self).__init__()
+        self._valid = None
+
+    @property
+    def data(self):
+        """Return data and mask."""
+        if self.tile is not None:
+            return self.tile, (self.tile[0] > 0).view(numpy.uint8) * 255
+        else:
+            return None, None
+
+    def feed(self, tile: numpy.ma.array):
         """Add data to tile."""
-        tile = numpy.ma.array(~tile.mask * 1, mask=tile.mask)
+        mask = numpy.ma.getmaskarray(tile)
         if self.tile is None:
-            self.tile = tile
-            return
+            self.tile = numpy.zeros(mask.shape, dtype=numpy.uint16)
+            self._valid = numpy.empty(mask.shape, dtype=bool)
+
+        numpy.logical_not(mask, out=self._valid)
+        numpy.add(self.tile, self._valid, out=self.tile)
+
+
+# Minimum confidence (1: low, 2: medium, 3: high) of the cloud, cloud shadow
+# and cirrus flags of the Landsat 8 quality band for a pixel to be masked
+QA_CONFIDENCE = int(os.getenv("QA_CONFIDENCE", 2))
+QA_MEDIAN_DEPTH = int(os.getenv("QA_MEDIAN_DEPTH", 5))
+
+
+@lru_cache(maxsize=4)
+def qa_clear_table(confidence: int = QA_CONFIDENCE) -> numpy.ndarray:
+    """Clear (not fill, cloud, cloud shadow or cirrus) flag of each BQA value."""
+    qa = numpy.arange(1 << 16, dtype=numpy.uint32)
+    fill = qa & 1
+    cloud = (qa >> 4) & 1
+    cloud_confidence = (qa >> 5) & 3
+    shadow_confidence = (qa >> 7) & 3
+    cirrus_confidence = (qa >> 11) & 3
+    return (
+        (fill == 0)
+        & (cloud == 0)
+        & (cloud_confidence < confidence)
+        & (shadow_confidence < confidence)
+        & (cirrus_confidence < confidence)
+    )
+
+
+class QAMethodBase(MosaicMethodBase):
+    """Base of the methods compositing the clear pixels of the quality band.
+
+    The reader appends `extra_bands` (the quality band last) to the tiles
+    fed to the method, and reads the assets newest first if `newest_first`.
+    """
+
+    extra_bands = ("QA",)
+    newest_first = False
+
+    def __init__(self):
+        """Overwrite base and init QA method."""
+        super(QAMethodBase, self).__init__()
+        self.mask = None
+
+    def split(self, tile: numpy.ma.array):
+        """Requested bands, extra bands and clear pixels of a tile."""
+        nextra = len(self.extra_bands)
+        qa = tile.data[-1].astype(numpy.uint16)
+        clear = qa_clear_table()[qa]
+        numpy.greater(clear, numpy.ma.getmaskarray(tile)[0], out=clear)
+        return tile.data[:-nextra], tile.data[-nextra:-1], clear
+
+    @property
+    def data(self):
+        """Return data and mask."""
+        if self.tile is not None:
+            return self.tile, numpy.logical_not(self.mask).view(numpy.uint8) * 255
+        else:
+            return None, None
+
+
+class RecentClearMethod(QAMethodBase):
+    """Feed the mosaic tile with the most recent clear pixels."""
+
+    newest_first = True
+
+    @property
+    def is_done(self):
+        """All the pixels are filled."""
+        return self.mask is not None and not self.mask.any()
+
+    def feed(self, tile: numpy.ma.array):
+        """Fill the masked pixels with the clear pixels of the tile."""
+        data, _, clear = self.split(tile)
+        if self.tile is None:
+            self.tile = numpy.zeros_like(data)
+            self.mask = numpy.ones(clear.shape, dtype=bool)
+
+        numpy.logical_and(clear, self.mask, out=clear)
+        numpy.copyto(self.tile, data, where=clear)
+        numpy.greater(self.mask, clear, out=self.mask)
+
+
+class ClearMedianMethod(QAMethodBase):
+    """Feed the mosaic tile with the median of the first clear pixels.
+
+    Only the first `QA_MEDIAN_DEPTH` clear values of each pixel are kept, so
+    memory does not grow with the number of assets, and reading stops once
+    all the pixels have them.
+    """
+
+    def __init__(self, depth: int = QA_MEDIAN_DEPTH):
+        """Overwrite base and init ClearMedian method."""
+        super(ClearMedianMethod, self).__init__()
+        self.depth = depth
+        self._values = None
+        self._count = None
+
+    @property
+    def is_done(self):
+        """All the pixels have `depth` clear values."""
+        return self._count is not None and bool((self._count >= self.depth).all())
+
+    @property
+    def data(self):
+        """Return data and mask."""
+        if self._values is None:
+            return None, None
+
+        # Sort the kept values, with the empty slots (max value) last
+        values = numpy.sort(self._values, axis=0)
+        count = self._count.astype(numpy.intp)[numpy.newaxis, numpy.newaxis]
+        lower = numpy.take_along_axis(values, numpy.maximum(count - 1, 0) // 2, 0)
+        upper = numpy.take_along_axis(values, count // 2, 0)
+        median = (lower[0].astype(numpy.float64) + upper[0]) / 2
+        if numpy.issubdtype(values.dtype, numpy.integer):
+            median = numpy.floor(median)
+
+        valid = self._count > 0
+        tile = numpy.where(valid, median, 0).astype(values.dtype)
+        return tile, valid.view(numpy.uint8) * 255
+
+    def feed(self, tile: numpy.ma.array):
+        """Add the clear pixels of the tile to the kept values."""
+        data, _, clear = self.split(tile)
+        if self._values is None:
+            if numpy.issubdtype(data.dtype, numpy.integer):
+                empty = numpy.iinfo(data.dtype).max
+            else:
+                empty = numpy.inf
+            self._values = numpy.full((self.depth,) + data.shape, empty, data.dtype)
+            self._count = numpy.zeros(clear.shape, dtype=numpy.uint8)
+            self.tile = self._values[0]
+
+        slot = numpy.empty_like(clear)
+        for idx in range(self.depth):
+            numpy.equal(self._count, idx, out=slot)
+            numpy.logical_and(slot, clear, out=slot)
+            numpy.copyto(self._values[idx], data, where=slot)
+        numpy.add(self._count, clear & (self._count < self.depth), out=self._count)
+
+
+class MaxNDVIMethod(QAMethodBase):
+    """Feed the mosaic tile with the clear pixels of highest NDVI."""
+
+    extra_bands = ("4", "5", "QA")
+
+    def __init__(self):
+        """Overwrite base and init MaxNDVI method."""
+        super(MaxNDVIMethod, self).__init__()
+        self._ndvi = None
+
+    def feed(self, tile: numpy.ma.array):
+        """Keep the clear pixels with a higher NDVI than the current ones."""
+        data, (red, nir), clear = self.split(tile)
+        red = red.astype(numpy.float32)
+        nir = nir.astype(numpy.float32)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            ndvi = (nir - red) / (nir + red)
+        numpy.nan_to_num(ndvi, copy=False, nan=-1.0)
+
+        if self.tile is None:
+            self.tile = numpy.zeros_like(data)
+            self.mask = numpy.ones(clear.shape, dtype=bool)
+            self._ndvi = numpy.full(clear.shape, -numpy.inf, dtype=numpy.float32)
 
-        mask = numpy.bitwise_or(~tile.mask, ~self.tile.mask)
-        self.tile = numpy.ma.array(self.tile.data + tile.data, fill_value=0)
-        self.tile.mask = ~mask
+        numpy.logical_and(clear, ndvi > self._ndvi, out=clear)
+        numpy.copyto(self.tile, data, where=clear)
+        numpy.copyto(self._ndvi, ndvi, where=clear)
+        numpy.greater(self.mask, clear, out=self.mask)
 
 
 pixSel = {
@@ -79,4 +282,7 @@ pixSel = {
     "all": allStack,
     "count": CountValidMethod,
     "lastband": LastBandHigh,
+    "recentclear": RecentClearMethod,
+    "clearmedian": ClearMedianMethod,
+    "maxndvi": MaxNDVIMethod,
 }
@@ -0,0 +1,277 @@
+"""landsat_mosaic_tiler.pyramid: pre-rendered tile pyramid for low zooms.
+
+Low zoom tiles cover dozens of scenes and are the slowest to render. A pyramid
+bakes them once, for one render recipe (bands/expr, rescale, color_ops,
+pixel_selection...), as a regular `{z}/{x}/{y}.{ext}` tile tree next to a
+`pyramid.json` manifest:
+
+    {
+        "mosaic": mosaic url,
+        "version": mosaic version (ETag, or `version` without one) the
+                   pyramid was built from,
+        "recipe": render options,
+        "minzoom", "maxzoom": zooms in the pyramid,
+        "quadkey_zoom": mosaic quadkey zoom,
+        "content_type": tiles content type,
+        "quadkeys": {quadkey: fingerprint of its assets},
+        "empty": ["z-x-y", ...] tiles with no data
+    }
+
+The pyramid lives at `{PYRAMID_ROOT}/{hash of the mosaic url}` if set, else at
+`{mosaic url}.pyramid`. Rebuilds only render the tiles over quadkeys whose
+assets changed since the previous build.
+"""
+
+import hashlib
+import json
+import os
+from concurrent import futures
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import mercantile
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.cache import LRUCache, mosaic_cache
+from landsat_mosaic_tiler.packed import PackedMosaic
+from landsat_mosaic_tiler.quadkey_index import QuadkeyIndex
+from landsat_mosaic_tiler.utils import get_hash
+
+PYRAMID_ROOT = os.getenv("PYRAMID_ROOT")
+
+# Render options (and their defaults, see `handlers.tiles.tiles`)
+RECIPE_DEFAULTS: Dict[str, Any] = {
+    "scale": 1,
+    "ext": "png",
+    "bands": None,
+    "expr": None,
+    "rescale": None,
+    "color_ops": None,
+    "color_map": None,
+    "pan": False,
+    "pixel_selection": "first",
+    "max_frames": None,
+}
+
+manifest_cache = LRUCache(maxsize=64, ttl=float(os.getenv("PYRAMID_MANIFEST_TTL", 300)))
+
+
+def pyramid_url(url: str) -> Optional[str]:
+    """Pyramid location of a mosaic (None if it can't have one)."""
+    if PYRAMID_ROOT:
+        return f"{PYRAMID_ROOT.rstrip('/')}/{get_hash(url=url)}"
+
+    if urlparse(url).scheme in ["s3", "file", ""]:
+        return f"{url}.pyramid"
+
+    return None
+
+
+def recipe_key(**options: Any) -> Dict[str, str]:
+    """Normalized render options, comparable between query and build."""
+    recipe = dict(RECIPE_DEFAULTS)
+    recipe.update(
+        {k: v for k, v in options.items() if k in RECIPE_DEFAULTS and v is not None}
+    )
+    return {k: str(v) for k, v in recipe.items() if v is not None}
+
+
+def _fingerprint(assets: List[str]) -> str:
+    return hashlib.sha1(json.dumps(assets).encode()).hexdigest()[:16]
+
+
+def _quadkey_assets(mosaic: Any, mosaic_def: Dict) -> Dict[str, List[str]]:
+    if mosaic_def.get("tiles"):
+        return mosaic_def["tiles"]
+
+    # Backends not holding the tiles in memory (e.g. DynamoDB)
+    tiles = {}
+    for tile in mercantile.tiles(*mosaic_def["bounds"], zooms=mosaic.quadkey_zoom):
+        assets = mosaic.tile(tile.x, tile.y, tile.z)
+        if assets:
+            tiles[mercantile.quadkey(tile)] = assets
+    return tiles
+
+
+def _pyramid_tiles(
+    quadkey: str, minzoom: int, maxzoom: int
+) -> Iterator[Tuple[int, int, int]]:
+    """Pyramid tiles covering a quadkey: its parents and/or children."""
+    tile = mercantile.quadkey_to_tile(quadkey)
+    for z in range(minzoom, maxzoom + 1):
+        if z <= tile.z:
+            parent = mercantile.quadkey_to_tile(quadkey[:z])
+            yield (z, parent.x, parent.y)
+        else:
+            for child in mercantile.children(tile, zoom=z):
+                yield (z, child.x, child.y)
+
+
+def mosaic_version(url: str) -> Optional[str]:
+    """Version tag of a mosaic: its ETag (see `tile_cache`), else its `version`."""
+    mosaic = mosaic_cache.get(url)
+    return mosaic_cache.version(url) or dict(mosaic.mosaic_def).get("version")
+
+
+def get_manifest(url: str, version: str = None) -> Optional[Dict]:
+    """Pyramid manifest of a mosaic, or None.
+
+    Manifests (and their absence) are cached per mosaic version, so a mosaic
+    rewritten at the same url looks its pyramid up again.
+    """
+    manifest = manifest_cache.get((url, version))
+    if manifest is None:
+        prefix = pyramid_url(url)
+        try:
+            manifest = json.loads(storage.read(f"{prefix}/pyramid.json"))
+            manifest["empty"] = set(manifest["empty"])
+        except Exception:
+            manifest = False
+        manifest_cache.set((url, version), manifest)
+
+    return manifest or None
+
+
+def pyramid_tile(url: str, z: int, x: int, y: int, **options: Any) -> Optional[Tuple]:
+    """Pre-rendered tile response, or None if the pyramid can't serve it."""
+    version = mosaic_version(url)
+    manifest = get_manifest(url, version)
+    if manifest is None or not manifest["minzoom"] <= z <= manifest["maxzoom"]:
+        return None
+
+    if manifest["recipe"] != recipe_key(**options):
+        return None
+
+    # Mosaic updated since the build
+    if manifest["version"] != version:
+        return None
+
+    if f"{z}-{x}-{y}" in manifest["empty"]:
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    ext = manifest["recipe"]["ext"]
+    try:
+        body = storage.read(f"{pyramid_url(url)}/{z}/{x}/{y}.{ext}")
+    except Exception:
+        return None
+
+    return_kwargs = {"custom_headers": {"X-PYRAMID": "1"}}
+    return ("OK", manifest["content_type"], body, return_kwargs)
+
+
+def build_pyramid(
+    url: str,
+    maxzoom: int,
+    minzoom: int = None,
+    threads: int = 4,
+    full: bool = False,
+    **options: Any,
+) -> Dict[str, int]:
+    """Render the pyramid of a mosaic for zooms `minzoom` to `maxzoom`.
+
+    Only tiles over quadkeys whose assets changed since the previous build are
+    rendered again, unless `full` or the recipe or zooms changed.
+    """
+    from landsat_mosaic_tiler.handlers.tiles import render_tile
+
+    prefix = pyramid_url(url)
+    if prefix is None:
+        raise Exception(f"No pyramid location for {url}, set PYRAMID_ROOT")
+
+    mosaic_cache.invalidate(url)
+    mosaic = mosaic_cache.get(url)
+    version = mosaic_version(url)
+    if isinstance(mosaic, (QuadkeyIndex, PackedMosaic)):
+        mosaic_def = mosaic.to_mosaic_def()
+    else:
+        mosaic_def = dict(mosaic.mosaic_def)
+
+    minzoom = mosaic_def["minzoom"] if minzoom is None else minzoom
+    recipe = recipe_key(**options)
+    quadkeys: Dict[str, Optional[str]] = {
+        quadkey: _fingerprint(assets)
+        for quadkey, assets in _quadkey_assets(mosaic, mosaic_def).items()
+    }
+
+    try:
+        previous = json.loads(storage.read(f"{prefix}/pyramid.json"))
+    except Exception:
+        previous = None
+
+    layout = (recipe, minzoom, maxzoom, mosaic.quadkey_zoom)
+    if (
+        full
+        or previous is None
+        or layout
+        != tuple(
+            previous[key] for key in ["recipe", "minzoom", "maxzoom", "quadkey_zoom"]
+        )
+    ):
+        changed = set(quadkeys)
+        empty: Set[str] = set()
+        content_type = None
+    else:
+        built = previous["quadkeys"]
+        changed = {
+            quadkey
+            for quadkey in set(quadkeys) | set(built)
+            if quadkeys.get(quadkey) != built.get(quadkey)
+        }
+        empty = set(previous["empty"])
+        content_type = previous["content_type"]
+
+    tiles: Dict[Tuple[int, int, int], Set[str]] = {}
+    for quadkey in changed:
+        for tile in _pyramid_tiles(quadkey, minzoom, maxzoom):
+            tiles.setdefault(tile, set()).add(quadkey)
+
+    def _render(tile: Tuple[int, int, int]) -> Tuple:
+        z, x, y = tile
+        try:
+            return render_tile(url, z, x, y, **options)
+        except Exception as err:
+            return ("ERROR", "text/plain", str(err))
+
+    stats = {"quadkeys": len(changed), "tiles": len(tiles), "rendered": 0}
+    stats.update(empty=0, errors=0)
+    ordered = sorted(tiles)
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for (z, x, y), response in zip(ordered, executor.map(_render, ordered)):
+            tile_id = f"{z}-{x}-{y}"
+            if response[0] == "OK":
+                storage.write(
+                    f"{prefix}/{z}/{x}/{y}.{recipe['ext']}",
+                    bytes(response[2]),
+                    content_type=response[1],
+                )
+                content_type = response[1]
+                empty.discard(tile_id)
+                stats["rendered"] += 1
+            elif response[0] == "EMPTY":
+                empty.add(tile_id)
+                stats["empty"] += 1
+            else:
+                # Leave the quadkeys unbuilt so the next build retries them
+                for quadkey in tiles[(z, x, y)]:
+                    quadkeys[quadkey] = None
+                stats["errors"] += 1
+
+    manifest = {
+        "mosaic": url,
+        "version": version,
+        "recipe": recipe,
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "quadkey_zoom": mosaic.quadkey_zoom,
+        "content_type": content_type,
+        "quadkeys": quadkeys,
+        "empty": sorted(empty),
+    }
+    storage.write(
+        f"{prefix}/pyramid.json",
+        json.dumps(manifest).encode(),
+        content_type="application/json",
+    )
+    manifest_cache.invalidate((url, version))
+
+    return stats
@@ -0,0 +1,250 @@
+"""landsat_mosaic_tiler.quadkey_index: compact quadkey -> assets lookup table.
+
+Quadkeys at `quadkey_zoom` are stored as integers (the quadkey read as a base-4
+number, i.e. the interleaved x/y bits of the tile), sorted, with a CSR-style
+offsets array into a flat array of interned asset ids. All the children of a
+lower zoom tile are then a contiguous slice of the sorted keys.
+"""
+
+import io
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+
+# Mask selecting the low (x) bit of every base-4 digit
+_LOW_BITS = numpy.uint64(0x5555555555555555)
+
+
+def tile_to_int(x: int, y: int, z: int) -> int:
+    """Integer value of the quadkey of tile x/y/z."""
+    value = 0
+    for i in range(z - 1, -1, -1):
+        value = (value << 2) | (((y >> i) & 1) << 1) | ((x >> i) & 1)
+    return value
+
+
+def int_to_quadkey(value: int, z: int) -> str:
+    """Quadkey string of an integer key at zoom z."""
+    return "".join(str((value >> (2 * i)) & 3) for i in range(z - 1, -1, -1))
+
+
+def key_range(x: int, y: int, z: int, quadkey_zoom: int) -> Tuple[int, int]:
+    """Range [start, stop) of the integer keys at quadkey_zoom within tile x/y/z
+    (or containing it, above quadkey_zoom).
+    """
+    if z >= quadkey_zoom:
+        shift = z - quadkey_zoom
+        key = tile_to_int(x >> shift, y >> shift, quadkey_zoom)
+        return key, key + 1
+
+    shift = 2 * (quadkey_zoom - z)
+    parent = tile_to_int(x, y, z)
+    return parent << shift, (parent + 1) << shift
+
+
+def key_to_xy(keys: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Tile x and y of integer keys (de-interleaved bits)."""
+
+    def compact(bits: numpy.ndarray) -> numpy.ndarray:
+        bits = bits & _LOW_BITS
+        for shift, mask in [
+            (1, 0x3333333333333333),
+            (2, 0x0F0F0F0F0F0F0F0F),
+            (4, 0x00FF00FF00FF00FF),
+            (8, 0x0000FFFF0000FFFF),
+            (16, 0x00000000FFFFFFFF),
+        ]:
+            bits = (bits | (bits >> numpy.uint64(shift))) & numpy.uint64(mask)
+        return bits.astype(numpy.int64)
+
+    keys = numpy.asarray(keys, dtype=numpy.uint64)
+    return compact(keys), compact(keys >> numpy.uint64(1))
+
+
+def rollup_ids(
+    keys: numpy.ndarray,
+    offsets: numpy.ndarray,
+    asset_ids: numpy.ndarray,
+    x: int,
+    y: int,
+    z: int,
+    quadkey_zoom: int,
+) -> numpy.ndarray:
+    """Asset ids of all the children quadkeys of a tile below quadkey_zoom.
+
+    Children are merged in `mercantile.children` order and duplicated
+    assets are only kept at their first position.
+    """
+    start, stop = numpy.searchsorted(
+        keys, numpy.array(key_range(x, y, z, quadkey_zoom), dtype=numpy.uint64)
+    )
+    if start == stop:
+        return asset_ids[:0]
+
+    # mercantile.children yields digits in 0, 1, 3, 2 order (gray code)
+    children = keys[start:stop]
+    order = numpy.argsort(children ^ ((children >> numpy.uint64(1)) & _LOW_BITS))
+    rows = order + start
+    ids = numpy.concatenate([asset_ids[offsets[r] : offsets[r + 1]] for r in rows])
+    _, first = numpy.unique(ids, return_index=True)
+    return ids[numpy.sort(first)]
+
+
+class QuadkeyIndex(object):
+    """Array-backed quadkey -> assets index over a mosaic definition.
+
+    Exposes the same `tile(x, y, z)` and `mosaic_def` interface as the
+    cogeo-mosaic backends used by the handlers.
+    """
+
+    def __init__(
+        self,
+        keys: numpy.ndarray,
+        offsets: numpy.ndarray,
+        asset_ids: numpy.ndarray,
+        assets: Sequence[str],
+        quadkey_zoom: int,
+        mosaic_def: Dict = None,
+        rollup_cache_size: int = 4096,
+    ):
+        """Create index from its arrays (see `from_mosaic_def`)."""
+        self.keys = keys
+        self.offsets = offsets
+        self.asset_ids = asset_ids
+        self.assets = list(assets)
+        self.quadkey_zoom = quadkey_zoom
+        self.mosaic_def = mosaic_def or {}
+        # Version tag (ETag, mtime) of the document a sidecar index was built from
+        self.source_version: Optional[str] = None
+        self._rollup = lru_cache(maxsize=rollup_cache_size)(self._rollup_assets)
+
+    def __len__(self) -> int:
+        """Number of quadkeys."""
+        return len(self.keys)
+
+    @classmethod
+    def from_mosaic_def(cls, mosaic_def: Dict, **kwargs: Any) -> "QuadkeyIndex":
+        """Build index from a MosaicJSON document."""
+        tiles = mosaic_def["tiles"]
+        quadkeys = list(tiles)
+        quadkey_zoom = len(quadkeys[0]) if quadkeys else mosaic_def["minzoom"]
+
+        keys = numpy.fromiter(
+            (int(qk, 4) for qk in quadkeys), dtype=numpy.uint64, count=len(quadkeys)
+        )
+        order = numpy.argsort(keys, kind="stable")
+
+        table: Dict[str, int] = {}
+        ids: List[int] = []
+        offsets = numpy.zeros(len(quadkeys) + 1, dtype=numpy.uint32)
+        for row, idx in enumerate(order):
+            ids.extend(table.setdefault(a, len(table)) for a in tiles[quadkeys[idx]])
+            offsets[row + 1] = len(ids)
+
+        metadata = {k: v for k, v in mosaic_def.items() if k != "tiles"}
+        return cls(
+            keys[order],
+            offsets,
+            numpy.array(ids, dtype=numpy.uint32),
+            list(table),
+            quadkey_zoom,
+            mosaic_def=metadata,
+            **kwargs,
+        )
+
+    def to_mosaic_def(self) -> Dict:
+        """Rebuild the full MosaicJSON document."""
+        mosaic_def = dict(self.mosaic_def)
+        mosaic_def["tiles"] = {
+            int_to_quadkey(int(key), self.quadkey_zoom): self._row_assets(row)
+            for row, key in enumerate(self.keys)
+        }
+        return mosaic_def
+
+    def _row_assets(self, row: int) -> List[str]:
+        ids = self.asset_ids[self.offsets[row] : self.offsets[row + 1]]
+        return [self.assets[i] for i in ids]
+
+    def _find(self, key: int) -> int:
+        row = int(numpy.searchsorted(self.keys, numpy.uint64(key)))
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+    def _rollup_assets(self, x: int, y: int, z: int) -> List[str]:
+        """Assets of all the children quadkeys of a tile below quadkey_zoom."""
+        ids = rollup_ids(
+            self.keys, self.offsets, self.asset_ids, x, y, z, self.quadkey_zoom
+        )
+        return [self.assets[i] for i in ids]
+
+    def rows(
+        self, x: int, y: int, z: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Keys, offsets and asset ids (indexes in `assets`) of the quadkeys
+        within tile x/y/z (or containing it).
+        """
+        start, stop = numpy.searchsorted(
+            self.keys,
+            numpy.array(key_range(x, y, z, self.quadkey_zoom), dtype=numpy.uint64),
+        )
+        offsets = self.offsets[start : stop + 1]
+        return (
+            self.keys[start:stop],
+            offsets - offsets[0],
+            self.asset_ids[offsets[0] : offsets[-1]],
+        )
+
+    def tile(self, x: int, y: int, z: int) -> List[str]:
+        """Retrieve assets for tile."""
+        if z < self.quadkey_zoom:
+            return list(self._rollup(x, y, z))
+
+        shift = z - self.quadkey_zoom
+        row = self._find(tile_to_int(x >> shift, y >> shift, self.quadkey_zoom))
+        return self._row_assets(row) if row >= 0 else []
+
+    def to_bytes(self, source_version: str = None) -> bytes:
+        """Serialize index (numpy .npz), tagged with its source document version."""
+        sio = io.BytesIO()
+        numpy.savez(
+            sio,
+            source=numpy.frombuffer((source_version or "").encode(), dtype=numpy.uint8),
+            keys=self.keys,
+            offsets=self.offsets,
+            asset_ids=self.asset_ids,
+            assets=numpy.frombuffer("\n".join(self.assets).encode(), dtype=numpy.uint8),
+            metadata=numpy.frombuffer(
+                json.dumps(
+                    dict(self.mosaic_def, quadkey_zoom=self.quadkey_zoom), default=str
+                ).encode(),
+                dtype=numpy.uint8,
+            ),
+        )
+        return sio.getvalue()
+
+    @classmethod
+    def from_bytes(cls, body: bytes, **kwargs: Any) -> "QuadkeyIndex":
+        """Load index serialized with `to_bytes`."""
+        with numpy.load(io.BytesIO(body)) as data:
+            metadata = json.loads(data["metadata"].tobytes().decode())
+            assets = data["assets"].tobytes().decode()
+            index = cls(
+                data["keys"],
+                data["offsets"],
+                data["asset_ids"],
+                assets.split("\n") if assets else [],
+                metadata["quadkey_zoom"],
+                mosaic_def=metadata,
+                **kwargs,
+            )
+            if "source" in data.files:
+                index.source_version = data["source"].tobytes().decode() or None
+            return index
+
+
+def index_url(url: str) -> str:
+    """Location of the serialized index stored next to a mosaic."""
+    return f"{url}.idx"
@@ -0,0 +1,165 @@
+"""landsat_mosaic_tiler.reader: concurrent per-asset reads for mosaic tiles.
+
+Drop-in replacement for `rio_tiler_mosaic.mosaic.mosaic_tiler`: assets are read
+by a shared thread pool, fed to the pixel selection method in asset order and
+pending reads are cancelled as soon as the method reports it is done.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from functools import partial
+from itertools import islice
+from typing import Callable, Deque, Optional, Sequence, Tuple
+
+import numpy
+from rio_tiler_mosaic.methods.base import MosaicMethodBase
+
+from landsat_mosaic_tiler import timing
+
+logger = logging.getLogger(__name__)
+
+READ_THREADS = int(os.getenv("MOSAIC_READ_THREADS", 10))
+READ_TIMEOUT = float(os.getenv("MOSAIC_READ_TIMEOUT", 8))
+
+_executor: Optional[futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> futures.ThreadPoolExecutor:
+    """Return the process-wide reader pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=READ_THREADS)
+        return _executor
+
+
+def mosaic_tiler(
+    assets: Sequence[str],
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    tiler: Callable,
+    pixel_selection: MosaicMethodBase = None,
+    threads: int = READ_THREADS,
+    timeout: float = READ_TIMEOUT,
+    **kwargs,
+) -> Tuple[Optional[numpy.ndarray], Optional[numpy.ndarray]]:
+    """Create mercator tile from multiple assets.
+
+    Args:
+        - assets: Assets to read, in priority order
+        - tile_x, tile_y, tile_z: Mercator tile index
+        - tiler: Function returning `(data, mask)` for an asset
+        - pixel_selection: Pixel selection method instance
+        - threads: Number of concurrent reads (0 or 1 read sequentially)
+        - timeout: Seconds after which pending reads are dropped and the
+          tile is returned from the assets read so far
+        - kwargs: Forwarded to the tiler
+
+    """
+    if not isinstance(pixel_selection, MosaicMethodBase):
+        raise Exception(
+            "Mosaic filling algorithm should be an instance of"
+            "'rio_tiler_mosaic.methods.base.MosaicMethodBase'"
+        )
+
+    _tiler = partial(tiler, tile_x=tile_x, tile_y=tile_y, tile_z=tile_z, **kwargs)
+    timer = timing.current()
+    if timer is not None:
+        _tiler = partial(_counted, _tiler, timer)
+    deadline = time.monotonic() + timeout if timeout else None
+
+    feed = partial(_feed, pixel_selection)
+    tile = f"{tile_z}-{tile_x}-{tile_y}"
+    if threads <= 1 or len(assets) <= 1:
+        _read_sequential(assets, _tiler, feed, deadline, tile)
+    else:
+        _read_pooled(assets, _tiler, feed, deadline, threads, tile)
+
+    with timing.stage("select"):
+        return pixel_selection.data
+
+
+def _feed(
+    pixel_selection: MosaicMethodBase, data: numpy.ndarray, mask: numpy.ndarray
+) -> bool:
+    """Feed a read to the method, return whether it is done."""
+    with timing.stage("select"):
+        tile = numpy.ma.array(data)
+        tile.mask = mask == 0
+        pixel_selection.feed(tile)
+    return pixel_selection.is_done
+
+
+def _read_sequential(
+    assets: Sequence[str],
+    tiler: Callable,
+    feed: Callable,
+    deadline: Optional[float],
+    tile: str,
+):
+    """Read and feed the assets one after the other."""
+    for asset in assets:
+        if deadline and time.monotonic() > deadline:
+            logger.warning(f"Read deadline reached for {tile}")
+            break
+        try:
+            with timing.stage("read"):
+                data, mask = tiler(asset)
+        except Exception as err:
+            logger.info(f"Could not read {asset}: {err}")
+            continue
+        if feed(data, mask):
+            break
+
+
+def _read_pooled(
+    assets: Sequence[str],
+    tiler: Callable,
+    feed: Callable,
+    deadline: Optional[float],
+    threads: int,
+    tile: str,
+):
+    """Read the assets in the shared pool, feed them in asset order."""
+    # Keep at most `threads` reads in flight, consumed in asset order
+    executor = get_executor()
+    pending = iter(assets)
+    tasks: Deque = deque(
+        (asset, executor.submit(tiler, asset)) for asset in islice(pending, threads)
+    )
+    try:
+        while tasks:
+            asset, task = tasks.popleft()
+            next_asset = next(pending, None)
+            if next_asset is not None:
+                tasks.append((next_asset, executor.submit(tiler, next_asset)))
+
+            remaining = deadline - time.monotonic() if deadline else None
+            try:
+                with timing.stage("read"):
+                    data, mask = task.result(timeout=remaining)
+            except futures.TimeoutError:
+                logger.warning(f"Read deadline reached for {tile}")
+                break
+            except Exception as err:
+                logger.info(f"Could not read {asset}: {err}")
+                continue
+            if feed(data, mask):
+                break
+    finally:
+        for _, task in tasks:
+            task.cancel()
+
+
+def _counted(tiler: Callable, timer: timing.Timer, asset: str) -> Tuple:
+    """Read an asset, counting assets and decoded bytes on the request timer."""
+    data, mask = tiler(asset)
+    timer.count("assets")
+    timer.count("bytes", data.nbytes + mask.nbytes)
+    return data, mask
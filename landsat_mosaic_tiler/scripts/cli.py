@@ -8,10 +8,11 @@ from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qsl
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+from landsat_mosaic_tiler.handlers.batch import app as app_batch
 from landsat_mosaic_tiler.handlers.mosaic import app as app_mosaic
 from landsat_mosaic_tiler.handlers.tiles import app as app_tiles
 
-app.https = False
+app_batch.https = False
 app_tiles.https = False
 app_mosaic.https = False
 
@@ -37,9 +38,13 @@ class Handler(BaseHTTPRequestHandler):
             application = app_mosaic
             resource = "/mosaic/{proxy+}"
             pathParameters = {"proxy": q.path.replace("/mosaic/", "")}
+        elif q.path.startswith("/batch/"):
+            application = app_batch
+            resource = "/batch/{proxy+}"
+            pathParameters = {"proxy": q.path.replace("/batch/", "")}
         else:
-            resource = "/"
-            application = app
+            self.send_error(404, f"No view function for: {self.command} - {q.path}")
+            return
 
         request = {
             "resource": resource,
@@ -79,9 +84,13 @@ class Handler(BaseHTTPRequestHandler):
             application = app_mosaic
             resource = "/mosaic/{proxy+}"
             pathParameters = {"proxy": q.path.replace("/mosaic/", "")}
+        elif q.path.startswith("/batch/"):
+            application = app_batch
+            resource = "/batch/{proxy+}"
+            pathParameters = {"proxy": q.path.replace("/batch/", "")}
         else:
-            resource = "/"
-            application = app
+            self.send_error(404, f"No view function for: {self.command} - {q.path}")
+            return
 
         request = {
             "resource": resource,
@@ -108,11 +117,26 @@ class Handler(BaseHTTPRequestHandler):
 
 @click.command(short_help="Local Server")
 @click.option("--port", type=int, default=8000, help="port")
-def run(port):
+@click.option(
+    "--server",
+    type=click.Choice(["asyncio", "threaded"]),
+    default="asyncio",
+    help="asyncio (ASGI app, keep-alive) or threaded (API Gateway emulation)",
+)
+@click.option(
+    "--workers", type=int, default=None, help="Worker threads (asyncio server)"
+)
+def run(port, server, workers):
     """Launch server."""
+    click.echo(f"Starting local server at http://127.0.0.1:{port}", err=True)
+    if server == "asyncio":
+        from landsat_mosaic_tiler.asgi import ASGIApp, ASGI_WORKERS, serve
+
+        serve(ASGIApp(workers=workers or ASGI_WORKERS), port=port)
+        return
+
     server_address = ("", port)
     httpd = ThreadingSimpleServer(server_address, Handler)
-    click.echo(f"Starting local server at http://127.0.0.1:{port}", err=True)
     httpd.serve_forever()
 
 
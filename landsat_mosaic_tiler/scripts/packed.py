@@ -0,0 +1,42 @@
+"""Convert mosaics between MosaicJSON and the packed format."""
+
+import click
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.packed import EXTENSION, PackedMosaic, pack
+
+
+@click.group(short_help="Convert packed mosaics")
+def cli():
+    """Convert mosaics between MosaicJSON and the packed format."""
+
+
+@cli.command(name="pack", short_help="MosaicJSON to packed mosaic")
+@click.argument("src", type=str)
+@click.argument("dst", type=str)
+@click.option("--block-size", type=int, default=256, help="Quadkeys per block")
+def pack_mosaic(src, dst, block_size):
+    """Convert the mosaic at SRC (any cogeo-mosaic url) to a packed mosaic."""
+    from cogeo_mosaic.backends import MosaicBackend
+
+    if not dst.endswith(EXTENSION):
+        raise click.BadParameter(f"must end with {EXTENSION}", param_hint="DST")
+
+    with MosaicBackend(src) as mosaic:
+        mosaic_def = dict(mosaic.mosaic_def)
+
+    body = pack(mosaic_def, block_size=block_size)
+    storage.write(dst, body, content_type="application/octet-stream")
+    click.echo(f"{len(mosaic_def['tiles'])} quadkeys, {len(body)} bytes", err=True)
+
+
+@cli.command(name="unpack", short_help="Packed mosaic to MosaicJSON")
+@click.argument("src", type=str)
+@click.argument("dst", type=str)
+def unpack_mosaic(src, dst):
+    """Convert the packed mosaic at SRC to a MosaicJSON (any cogeo-mosaic url)."""
+    from cogeo_mosaic.backends import MosaicBackend
+
+    mosaic_def = PackedMosaic(src).to_mosaic_def()
+    with MosaicBackend(dst, mosaic_def=mosaic_def) as mosaic:
+        mosaic.write()
@@ -0,0 +1,42 @@
+"""Build the pre-rendered low zoom pyramid of a mosaic."""
+
+import json
+
+import click
+
+from landsat_mosaic_tiler.pyramid import build_pyramid
+
+
+@click.command(short_help="Build low zoom tile pyramid")
+@click.argument("url", type=str)
+@click.option("--maxzoom", type=int, required=True, help="Last zoom in the pyramid")
+@click.option("--minzoom", type=int, default=None, help="Defaults to mosaic minzoom")
+@click.option("--bands", type=str, default=None, help="e.g. 4,3,2")
+@click.option("--expr", type=str, default=None, help="e.g. (b5-b4)/(b5+b4)")
+@click.option("--rescale", type=str, default=None)
+@click.option("--color-ops", type=str, default=None)
+@click.option("--color-map", type=str, default=None)
+@click.option("--pan", is_flag=True, help="Pan-sharpen the bands")
+@click.option("--pixel-selection", type=str, default="first")
+@click.option("--max-frames", type=int, default=None, help="For animated ext")
+@click.option("--ext", type=str, default="png")
+@click.option("--scale", type=int, default=1)
+@click.option("--threads", type=int, default=4)
+@click.option("--full", is_flag=True, help="Rebuild every tile")
+def build(url, maxzoom, minzoom, threads, full, **options):
+    """Render zooms up to MAXZOOM of the mosaic at URL with one render recipe.
+
+    Tiles requested with the same options are then served from the pyramid.
+    Rebuilds only render tiles over quadkeys whose assets changed.
+    """
+    if not options["bands"] and not options["expr"]:
+        raise click.UsageError("--bands or --expr is required")
+
+    stats = build_pyramid(
+        url, maxzoom, minzoom=minzoom, threads=threads, full=full, **options
+    )
+    click.echo(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    build()
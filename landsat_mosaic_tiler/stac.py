@@ -0,0 +1,255 @@
+"""landsat_mosaic_tiler.stac: streaming STAC search and incremental mosaic creation.
+
+Search pages are fetched concurrently (a bounded window of pages in flight),
+every feature is filtered and reduced to a compact `Scene` record on arrival,
+and scenes are assigned to quadkeys one by one, so the full list of STAC
+features is never held in memory.
+"""
+
+import calendar
+import json
+import math
+import os
+from collections import deque
+from concurrent import futures
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Sequence, Tuple
+from urllib.request import Request, urlopen
+
+import mercantile
+
+STAC_API_URL = os.getenv(
+    "STAC_API_URL", "https://earth-search.aws.element84.com/v0/search"
+)
+STAC_COLLECTION = os.getenv("STAC_COLLECTION", "landsat-8-l1-c1")
+STAC_PAGE_SIZE = int(os.getenv("STAC_PAGE_SIZE", 500))
+STAC_THREADS = int(os.getenv("STAC_THREADS", 4))
+
+
+class Scene(NamedTuple):
+    """Compact record of a STAC feature."""
+
+    id: str
+    pathrow: str
+    cloud: float
+    date: str
+    footprint: Tuple[Tuple[float, float], ...]
+
+    @property
+    def geometry(self) -> Dict:
+        """GeoJSON polygon of the footprint."""
+        return {"type": "Polygon", "coordinates": [list(map(list, self.footprint))]}
+
+
+def period_end(min_date: str, period: str, period_qty: int = 1) -> str:
+    """Last day (inclusive) of `period_qty` periods starting at `min_date`."""
+    start = datetime.strptime(min_date, "%Y-%m-%d")
+    period_qty = int(period_qty)
+    if period == "day":
+        end = start + timedelta(days=period_qty)
+    elif period == "week":
+        end = start + timedelta(weeks=period_qty)
+    elif period in ["month", "year"]:
+        month = start.month - 1 + period_qty * (12 if period == "year" else 1)
+        year, month = start.year + month // 12, month % 12 + 1
+        day = min(start.day, calendar.monthrange(year, month)[1])
+        end = start.replace(year=year, month=month, day=day)
+    else:
+        raise Exception(f"Invalid period: {period}")
+
+    return datetime.strftime(end - timedelta(days=1), "%Y-%m-%d")
+
+
+def _post(url: str, query: Dict) -> Dict:
+    request = Request(
+        url,
+        data=json.dumps(query).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def _matched(page: Dict) -> int:
+    context = page.get("context") or {}
+    meta = page.get("meta") or {}
+    return context.get("matched", meta.get("found"))
+
+
+def search_features(
+    bounds: Sequence[float],
+    min_cloud: float = 0,
+    max_cloud: float = 100,
+    min_date: str = "2013-01-01",
+    max_date: str = None,
+    url: str = STAC_API_URL,
+    collection: str = STAC_COLLECTION,
+    limit: int = STAC_PAGE_SIZE,
+    threads: int = STAC_THREADS,
+) -> Iterator[Dict]:
+    """Yield STAC features page by page, fetching up to `threads` pages at once."""
+    max_date = max_date or datetime.strftime(datetime.today(), "%Y-%m-%d")
+    query: Dict[str, Any] = {
+        "bbox": list(bounds),
+        "datetime": f"{min_date}T00:00:00Z/{max_date}T23:59:59Z",
+        "collections": [collection],
+        "query": {"eo:cloud_cover": {"gte": min_cloud, "lte": max_cloud}},
+        "limit": limit,
+    }
+
+    first = _post(url, dict(query, page=1))
+    yield from first.get("features", [])
+
+    matched = _matched(first)
+    if matched is None:
+        # No count in the response: follow pages until a short one
+        page, returned = 1, len(first.get("features", []))
+        while returned == limit:
+            page += 1
+            features = _post(url, dict(query, page=page)).get("features", [])
+            returned = len(features)
+            yield from features
+        return
+
+    pages = iter(range(2, math.ceil(matched / limit) + 1))
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        tasks: Deque = deque(
+            executor.submit(_post, url, dict(query, page=page))
+            for page in (next(pages, None) for _ in range(threads))
+            if page is not None
+        )
+        while tasks:
+            result = tasks.popleft().result()
+            page = next(pages, None)
+            if page is not None:
+                tasks.append(executor.submit(_post, url, dict(query, page=page)))
+            yield from result.get("features", [])
+
+
+def to_scene(feature: Dict) -> Scene:
+    """Reduce a STAC feature to a Scene."""
+    properties = feature["properties"]
+    sceneid = properties.get("landsat:product_id") or feature["id"]
+    pathrow = "{:03d}{:03d}".format(
+        int(properties.get("landsat:wrs_path", sceneid.split("_")[2][:3])),
+        int(properties.get("landsat:wrs_row", sceneid.split("_")[2][3:])),
+    )
+    footprint = tuple(
+        (round(lon, 5), round(lat, 5))
+        for lon, lat in feature["geometry"]["coordinates"][0]
+    )
+    return Scene(
+        id=sceneid,
+        pathrow=pathrow,
+        cloud=float(properties.get("eo:cloud_cover", 0)),
+        date=properties["datetime"][:10],
+        footprint=footprint,
+    )
+
+
+def search_scenes(
+    bounds: Sequence[float],
+    min_cloud: float = 0,
+    max_cloud: float = 100,
+    min_date: str = "2013-01-01",
+    max_date: str = None,
+    period: str = None,
+    period_qty: int = 1,
+    seasons: Sequence[str] = None,
+    **kwargs: Any,
+) -> Iterator[Scene]:
+    """Search, filter (cloud, season) and compact scenes on the fly."""
+    if period:
+        max_date = period_end(min_date, period, period_qty)
+
+    if seasons:
+        from landsat_cogeo_mosaic.util import filter_season
+
+    for feature in search_features(
+        bounds,
+        min_cloud=min_cloud,
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        **kwargs,
+    ):
+        cloud = feature["properties"].get("eo:cloud_cover", 0)
+        if not min_cloud <= cloud <= max_cloud:
+            continue
+        if seasons and not filter_season([feature], seasons):
+            continue
+        yield to_scene(feature)
+
+
+class MosaicBuilder(object):
+    """Assign scenes to quadkeys as they arrive and build a MosaicJSON.
+
+    Each quadkey keeps one scene per path/row, the least cloudy one, and its
+    assets are ordered by increasing cloud cover.
+    """
+
+    def __init__(self, quadkey_zoom: int = 8, minzoom: int = 7, maxzoom: int = 12):
+        """Create empty mosaic."""
+        self.quadkey_zoom = quadkey_zoom
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.tiles: Dict[str, Dict[str, Tuple[float, str]]] = {}
+        self.scenes: Dict[str, Scene] = {}
+        self.bounds = [180.0, 90.0, -180.0, -90.0]
+
+    def __len__(self) -> int:
+        """Number of quadkeys."""
+        return len(self.tiles)
+
+    def add(self, scene: Scene):
+        """Add scene to the quadkeys its footprint covers."""
+        from supermercado import burntiles
+
+        feature = {"type": "Feature", "properties": {}, "geometry": scene.geometry}
+        for x, y, z in burntiles.burn([feature], self.quadkey_zoom):
+            quadkey = mercantile.quadkey(int(x), int(y), int(z))
+            pathrows = self.tiles.setdefault(quadkey, {})
+            current = pathrows.get(scene.pathrow)
+            if current is None or scene.cloud < current[0]:
+                pathrows[scene.pathrow] = (scene.cloud, scene.id)
+                self.scenes[scene.id] = scene
+
+        lons = [lon for lon, _ in scene.footprint]
+        lats = [lat for _, lat in scene.footprint]
+        self.bounds = [
+            min(self.bounds[0], min(lons)),
+            min(self.bounds[1], min(lats)),
+            max(self.bounds[2], max(lons)),
+            max(self.bounds[3], max(lats)),
+        ]
+
+    def used_scenes(self) -> List[Scene]:
+        """Scenes listed in at least one quadkey."""
+        used = {
+            sceneid
+            for pathrows in self.tiles.values()
+            for _, sceneid in pathrows.values()
+        }
+        return [scene for sceneid, scene in self.scenes.items() if sceneid in used]
+
+    def mosaic_def(self) -> Dict:
+        """MosaicJSON document."""
+        tiles: Dict[str, List[str]] = {
+            quadkey: [sceneid for _, sceneid in sorted(pathrows.values())]
+            for quadkey, pathrows in self.tiles.items()
+        }
+        return {
+            "mosaicjson": "0.0.2",
+            "version": "1.0.0",
+            "minzoom": self.minzoom,
+            "maxzoom": self.maxzoom,
+            "quadkey_zoom": self.quadkey_zoom,
+            "bounds": self.bounds,
+            "center": [
+                (self.bounds[0] + self.bounds[2]) / 2,
+                (self.bounds[1] + self.bounds[3]) / 2,
+                self.minzoom,
+            ],
+            "tiles": tiles,
+        }
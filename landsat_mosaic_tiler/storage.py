@@ -0,0 +1,64 @@
+"""landsat_mosaic_tiler.storage: read and write bytes on S3, HTTP or local disk."""
+
+import os
+import threading
+from typing import Optional
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+
+def _s3_client():
+    import boto3
+
+    return boto3.client("s3")
+
+
+def read(url: str, start: int = None, end: int = None) -> bytes:
+    """Read object at url, optionally only bytes [start, end] (inclusive)."""
+    parsed = urlparse(url)
+    byte_range = None
+    if start is not None:
+        byte_range = f"bytes={start}-{end if end is not None else ''}"
+
+    if parsed.scheme == "s3":
+        kwargs = {"Bucket": parsed.netloc, "Key": parsed.path.strip("/")}
+        if byte_range:
+            kwargs["Range"] = byte_range
+        return _s3_client().get_object(**kwargs)["Body"].read()
+
+    elif parsed.scheme in ["http", "https"]:
+        headers = {"Range": byte_range} if byte_range else {}
+        with urlopen(Request(url, headers=headers)) as response:
+            return response.read()
+
+    with open(parsed.path, "rb") as f:
+        if start is None:
+            return f.read()
+        f.seek(start)
+        return f.read(end - start + 1 if end is not None else -1)
+
+
+def write(url: str, body: bytes, content_type: Optional[str] = None):
+    """Write bytes to url (S3 or local path)."""
+    parsed = urlparse(url)
+
+    if parsed.scheme == "s3":
+        kwargs = {"Bucket": parsed.netloc, "Key": parsed.path.strip("/"), "Body": body}
+        if content_type:
+            kwargs["ContentType"] = content_type
+        _s3_client().put_object(**kwargs)
+        return
+
+    elif parsed.scheme in ["http", "https"]:
+        raise Exception(f"Can't write to {url}")
+
+    dirname = os.path.dirname(parsed.path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    # Replace atomically: readers never see a partial file, and memory maps of
+    # the previous file (e.g. packed mosaics) stay valid
+    tmp_path = f"{parsed.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, parsed.path)
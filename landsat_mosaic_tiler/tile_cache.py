@@ -0,0 +1,180 @@
+"""landsat_mosaic_tiler.tile_cache: persistent cache of rendered tiles.
+
+Tier one is a size-bounded directory on local disk (e.g. under /tmp), tier
+two an S3 prefix (or any local directory, which is handy for tests). Hits
+from tier two are copied back to tier one.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from landsat_mosaic_tiler import storage
+from landsat_mosaic_tiler.utils import get_hash
+
+
+class DiskCache(object):
+    """Local directory cache evicting least recently used files over `maxbytes`."""
+
+    def __init__(self, path: str, maxbytes: int = 256 * 1024 * 1024):
+        """Create cache in `path`."""
+        self.path = path
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.nbytes = sum(size for _, _, size in self._files())
+
+    def _files(self) -> List[Tuple[float, str, int]]:
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Read cached bytes, bumping the file mtime for LRU eviction."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+            os.utime(path)
+            return body
+        except OSError:
+            return None
+
+    def set(self, key: str, body: bytes):
+        """Write bytes atomically, evicting old files if needed."""
+        if len(body) > self.maxbytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+
+        with self._lock:
+            # Overwritten files no longer count
+            try:
+                previous = os.stat(path).st_size
+            except OSError:
+                previous = 0
+            os.replace(tmp, path)
+            self.nbytes += len(body) - previous
+            if self.nbytes > self.maxbytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files())
+        self.nbytes = sum(size for _, _, size in files)
+        target = self.maxbytes * 0.9
+        for _, path, size in files:
+            if self.nbytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.nbytes -= size
+            except OSError:
+                pass
+
+
+class ObjectStoreCache(object):
+    """Cache stored under an S3 prefix (`s3://bucket/prefix`) or local directory."""
+
+    def __init__(self, url: str):
+        """Create cache rooted at `url`."""
+        self.url = url.rstrip("/")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Read cached bytes."""
+        try:
+            return storage.read(f"{self.url}/{key}")
+        except Exception:
+            return None
+
+    def set(self, key: str, body: bytes):
+        """Write bytes."""
+        storage.write(f"{self.url}/{key}", body)
+
+
+def _pack(response: Tuple) -> bytes:
+    _, content_type, body = response[:3]
+    headers = response[3].get("custom_headers", {}) if len(response) > 3 else {}
+    meta = json.dumps({"content_type": content_type, "headers": headers})
+    return meta.encode() + b"\n" + bytes(body)
+
+
+def _unpack(value: bytes) -> Tuple[str, str, bytes, Dict]:
+    meta, body = value.split(b"\n", 1)
+    meta = json.loads(meta)
+    return ("OK", meta["content_type"], body, {"custom_headers": meta["headers"]})
+
+
+class TileCache(object):
+    """Multi-tier cache of rendered tile responses."""
+
+    def __init__(self, tiers: List[Any]):
+        """Create cache from tiers, fastest first."""
+        self.tiers = tiers
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple]:
+        """Return cached `("OK", content_type, body, kwargs)` response."""
+        for idx, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for upper in self.tiers[:idx]:
+                    try:
+                        upper.set(key, value)
+                    except Exception:
+                        pass
+                self.hits += 1
+                return _unpack(value)
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, response: Tuple):
+        """Store a rendered response in every tier."""
+        value = _pack(response)
+        for tier in self.tiers:
+            try:
+                tier.set(key, value)
+            except Exception:
+                pass
+
+
+def tile_key(
+    url: str, version: Optional[str], z: int, x: int, y: int, **kwargs: Any
+) -> str:
+    """Cache key of a rendered tile, tied to the mosaic version."""
+    return get_hash(url=url, version=version, z=z, x=x, y=y, **kwargs)
+
+
+def get_tile_cache() -> Optional[TileCache]:
+    """Create tile cache from `TILE_CACHE_DIR` and `TILE_CACHE_URL`."""
+    tiers: List[Any] = []
+    if os.getenv("TILE_CACHE_DIR"):
+        tiers.append(
+            DiskCache(
+                os.environ["TILE_CACHE_DIR"],
+                maxbytes=int(os.getenv("TILE_CACHE_BYTES", 256 * 1024 * 1024)),
+            )
+        )
+    if os.getenv("TILE_CACHE_URL"):
+        tiers.append(ObjectStoreCache(os.environ["TILE_CACHE_URL"]))
+
+    return TileCache(tiers) if tiers else None
+
+
+tile_cache = get_tile_cache()
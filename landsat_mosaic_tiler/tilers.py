@@ -0,0 +1,274 @@
+"""landsat_mosaic_tiler.tilers: per-asset tile readers backed by the window cache."""
+
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Sequence, Tuple
+
+import numexpr
+import numpy
+from rio_tiler.io.landsat8 import tile as landsatTiler
+
+from landsat_mosaic_tiler.cache import window_cache
+
+EXPRESSION_CACHE_SIZE = int(os.getenv("EXPRESSION_CACHE_SIZE", 128))
+
+
+def _cache_band(key: Tuple, data: numpy.ndarray, mask: numpy.ndarray):
+    data.setflags(write=False)
+    mask.setflags(write=False)
+    window_cache.set(key, (data, mask), size=data.nbytes + mask.nbytes)
+
+
+def landsat_tile(
+    sceneid: str,
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    bands: Sequence[str] = ("4", "3", "2"),
+    tilesize: int = 256,
+    pan: bool = False,
+    **kwargs,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Read Landsat 8 bands for a mercator tile, reusing decoded band windows.
+
+    Bands are cached separately (keyed by scene, band, z, x, y, tilesize) so
+    requests for other band combinations or expressions over the same scene
+    only read the bands not seen yet. Pan-sharpened reads depend on all the
+    bands and are cached as a whole.
+    """
+    bands = tuple(bands)
+    if pan:
+        key = (sceneid, bands, tile_z, tile_x, tile_y, tilesize, pan)
+        cached = window_cache.get(key)
+        if cached is None:
+            data, mask = landsatTiler(
+                sceneid,
+                tile_x,
+                tile_y,
+                tile_z,
+                bands=bands,
+                tilesize=tilesize,
+                pan=pan,
+                **kwargs,
+            )
+            _cache_band(key, data, mask)
+            cached = (data, mask)
+        return cached[0].copy(), cached[1]
+
+    keys = [(sceneid, band, tile_z, tile_x, tile_y, tilesize) for band in bands]
+    windows = [window_cache.get(key) for key in keys]
+
+    missing = [idx for idx, window in enumerate(windows) if window is None]
+    if missing:
+        data, mask = landsatTiler(
+            sceneid,
+            tile_x,
+            tile_y,
+            tile_z,
+            bands=tuple(bands[idx] for idx in missing),
+            tilesize=tilesize,
+            **kwargs,
+        )
+        for bdx, idx in enumerate(missing):
+            windows[idx] = (data[bdx], mask)
+            _cache_band(keys[idx], data[bdx], mask)
+
+    data = numpy.stack([window[0] for window in windows])
+    masks = {id(window[1]): window[1] for window in windows}
+    if len(masks) == 1:
+        mask = windows[0][1]
+    else:
+        mask = numpy.minimum.reduce(list(masks.values()))
+
+    return data, mask
+
+
+def landsat_qa(
+    sceneid: str,
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    tilesize: int = 256,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Read the Landsat 8 quality band (BQA) for a mercator tile.
+
+    The band holds bit flags, so it is resampled with the nearest pixel (and
+    cached apart from reads of the `QA` band through `landsat_tile`).
+    """
+    key = (sceneid, "QA", tile_z, tile_x, tile_y, tilesize, "nearest")
+    cached = window_cache.get(key)
+    if cached is None:
+        data, mask = landsatTiler(
+            sceneid,
+            tile_x,
+            tile_y,
+            tile_z,
+            bands=("QA",),
+            tilesize=tilesize,
+            resampling_method="nearest",
+        )
+        _cache_band(key, data, mask)
+        cached = (data, mask)
+    return cached
+
+
+def landsat_extra_bands(
+    sceneid: str,
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    reader: Callable = landsat_tile,
+    extra_bands: Sequence[str] = ("QA",),
+    tilesize: int = 256,
+    **kwargs,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Read a tile with `reader`, followed by `extra_bands` (`QA` last).
+
+    Used by the pixel selection methods deciding from other bands than the
+    requested ones (e.g. the quality band).
+    """
+    data, mask = reader(sceneid, tile_x, tile_y, tile_z, tilesize=tilesize, **kwargs)
+    arrays, masks = [data], [mask]
+
+    bands = tuple(band for band in extra_bands if band != "QA")
+    if bands:
+        extra, extra_mask = landsat_tile(
+            sceneid, tile_x, tile_y, tile_z, bands=bands, tilesize=tilesize
+        )
+        arrays.append(extra)
+        masks.append(extra_mask)
+
+    if "QA" in extra_bands:
+        qa, qa_mask = landsat_qa(sceneid, tile_x, tile_y, tile_z, tilesize=tilesize)
+        arrays.append(qa)
+        masks.append(qa_mask)
+
+    return numpy.concatenate(arrays), numpy.minimum.reduce(masks)
+
+
+class Expression(object):
+    """Band math expression (e.g `(b5-b4)/(b5+b4)`), parsed once.
+
+    Comma-separated blocks are compiled by numexpr once per input dtype (and
+    reading thread, as numexpr programs are not shared across threads) and
+    evaluated straight into their output array.
+    """
+
+    def __init__(self, expr: str):
+        """Parse blocks and the bands they use."""
+        self.blocks = tuple(bloc.strip() for bloc in expr.split(","))
+        self.block_bands = tuple(
+            tuple(sorted(set(re.findall(r"b(?P<bands>[0-9A-Z]+)", bloc))))
+            for bloc in self.blocks
+        )
+        self.bands = tuple(sorted(set().union(*self.block_bands)))
+        self._local = threading.local()
+
+    def program(self, idx: int, dtype: numpy.dtype) -> Any:
+        """Compiled numexpr program of a block for `dtype` inputs."""
+        programs = getattr(self._local, "programs", None)
+        if programs is None:
+            programs = self._local.programs = {}
+
+        program = programs.get((idx, dtype))
+        if program is None:
+            kind = _numexpr_type(dtype)
+            signature = [(f"b{band}", kind) for band in self.block_bands[idx]]
+            program = numexpr.NumExpr(self.blocks[idx], signature=signature)
+            programs[(idx, dtype)] = program
+        return program
+
+    def evaluate(self, idx: int, data: Dict[str, numpy.ndarray]) -> numpy.ndarray:
+        """Evaluate one block on band arrays (keyed by band name)."""
+        arrays = [data[band] for band in self.block_bands[idx]]
+        program = self.program(idx, arrays[0].dtype)
+        out = numpy.empty(arrays[0].shape, dtype=_NUMEXPR_TYPES[program.fullsig[:1]])
+        program(*arrays, out=out, ex_uses_vml=False)
+        if out.dtype.kind == "f":
+            numpy.nan_to_num(out, copy=False)
+        return out
+
+
+def _numexpr_type(dtype: numpy.dtype) -> type:
+    """Type of the numexpr program inputs for band arrays of `dtype`.
+
+    Integers are computed as 32 or 64-bit integers, and numexpr's `float` is
+    single precision.
+    """
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == "b":
+        return bool
+    if dtype.kind in "iu":
+        return numpy.int32 if numpy.can_cast(dtype, numpy.int32) else numpy.int64
+    if dtype.kind == "f":
+        return float if dtype.itemsize <= 4 else numpy.float64
+    raise ValueError(f"Unsupported band data type: {dtype}")
+
+
+# numexpr signature codes of the result types
+_NUMEXPR_TYPES = {
+    b"b": numpy.bool_,
+    b"i": numpy.int32,
+    b"l": numpy.int64,
+    b"f": numpy.float32,
+    b"d": numpy.float64,
+    b"c": numpy.complex128,
+}
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def get_expression(expr: str) -> Expression:
+    """Parsed expression, cached by expression string."""
+    return Expression(expr)
+
+
+def landsat_expression(
+    sceneid: str,
+    tile_x: int,
+    tile_y: int,
+    tile_z: int,
+    expr: str = None,
+    tilesize: int = 256,
+    **kwargs,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Apply band math expression (e.g `(b5-b4)/(b5+b4)`) on a Landsat 8 tile.
+
+    Evaluated blocks are kept in the window cache, so repeated expressions (or
+    expressions sharing a block) over the same scene tile are not recomputed,
+    and only the bands of the missing blocks are read.
+    """
+    if not expr:
+        raise Exception("Missing expression")
+
+    expression = get_expression(expr)
+    # Reader options (e.g. `pan`) change the bands read, so they key the blocks
+    options = tuple(sorted(kwargs.items()))
+    keys = [
+        ("expr", sceneid, bloc, tile_z, tile_x, tile_y, tilesize, options)
+        for bloc in expression.blocks
+    ]
+    results = [window_cache.get(key) for key in keys]
+
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    if missing:
+        bands = tuple(
+            sorted(set().union(*[expression.block_bands[idx] for idx in missing]))
+        )
+        arr, mask = landsat_tile(
+            sceneid, tile_x, tile_y, tile_z, bands=bands, tilesize=tilesize, **kwargs
+        )
+        data = {band: arr[bdx] for bdx, band in enumerate(bands)}
+        for idx in missing:
+            block = expression.evaluate(idx, data)
+            _cache_band(keys[idx], block, mask)
+            results[idx] = (block, mask)
+
+    masks = {id(result[1]): result[1] for result in results}
+    if len(masks) == 1:
+        mask = results[0][1]
+    else:
+        mask = numpy.minimum.reduce(list(masks.values()))
+
+    return numpy.stack([result[0] for result in results]), mask
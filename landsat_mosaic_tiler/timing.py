@@ -0,0 +1,185 @@
+"""landsat_mosaic_tiler.timing: per-request stage timing and metrics.
+
+A request timer is bound to the handling thread by `request`. Code on the
+request path times its stages with `stage` and counts things with `count`;
+both are no-ops when no timer is active, so instrumented code costs nothing
+when timing is off.
+
+When the request ends, its timings are (optionally) added to the response as
+a `Server-Timing` header (`SERVER_TIMING`, default TRUE) and sent to the
+`METRICS_SINK`:
+
+    - none (default): nothing
+    - log: one JSON line per request on the `landsat_mosaic_tiler.timing` logger
+    - emf: CloudWatch Embedded Metric Format on stdout (picked up by Lambda)
+    - statsd: StatsD timers and counters over UDP (`STATSD_HOST`, `STATSD_PORT`)
+
+Timing is disabled altogether when `SERVER_TIMING=FALSE` and there is no sink.
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "TRUE").upper() == "TRUE"
+METRICS_SINK = os.getenv("METRICS_SINK", "none").lower()
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "landsat-mosaic-tiler")
+STATSD_HOST = os.getenv("STATSD_HOST", "127.0.0.1")
+STATSD_PORT = int(os.getenv("STATSD_PORT", 8125))
+
+ENABLED = SERVER_TIMING or METRICS_SINK != "none"
+
+_local = threading.local()
+_null = nullcontext()
+_statsd: Optional[socket.socket] = None
+
+
+class Timer(object):
+    """Stage durations and counters of one request."""
+
+    def __init__(self, name: str, **tags: Any):
+        """Start timer."""
+        self.name = name
+        self.tags = tags
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.duration: Optional[float] = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage (durations of repeated stages add up)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """Add time to a stage."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        """Increment a counter (safe to call from other threads)."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stop(self):
+        """Stop timer."""
+        self.duration = time.perf_counter() - self._start
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value, in milliseconds."""
+        metrics = [f"{name};dur={sec * 1000:.1f}" for name, sec in self.stages.items()]
+        metrics.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Timings (in milliseconds), counters and tags."""
+        return {
+            "name": self.name,
+            **self.tags,
+            "total": round(self.duration * 1000, 3),
+            **{name: round(sec * 1000, 3) for name, sec in self.stages.items()},
+            **self.counters,
+        }
+
+
+def current() -> Optional[Timer]:
+    """Timer of the request handled by this thread, if any."""
+    return getattr(_local, "timer", None)
+
+
+def stage(name: str):
+    """Context manager timing a stage of the current request."""
+    timer = getattr(_local, "timer", None)
+    return timer.stage(name) if timer is not None else _null
+
+
+def count(name: str, value: int = 1):
+    """Increment a counter of the current request."""
+    timer = getattr(_local, "timer", None)
+    if timer is not None:
+        timer.count(name, value)
+
+
+@contextmanager
+def request(name: str, **tags: Any) -> Iterator[Optional[Timer]]:
+    """Time a request handled by this thread, and emit its metrics when done."""
+    if not ENABLED:
+        yield None
+        return
+
+    timer = _local.timer = Timer(name, **tags)
+    try:
+        yield timer
+    finally:
+        _local.timer = None
+        timer.stop()
+        try:
+            emit(timer)
+        except Exception as err:
+            logger.warning(f"Could not emit metrics: {err}")
+
+
+def with_header(response: Tuple, timer: Optional[Timer]) -> Tuple:
+    """Add the `Server-Timing` header to a handler response."""
+    if timer is None or not SERVER_TIMING or timer.duration is None:
+        return response
+
+    kwargs = dict(response[3]) if len(response) > 3 else {}
+    headers = dict(kwargs.get("custom_headers", {}))
+    headers["Server-Timing"] = timer.server_timing()
+    kwargs["custom_headers"] = headers
+    return (*response[:3], kwargs)
+
+
+def emit(timer: Timer):
+    """Send request metrics to the configured sink."""
+    if METRICS_SINK == "log":
+        logger.info(json.dumps(timer.to_dict()))
+
+    elif METRICS_SINK == "emf":
+        metrics = [{"Name": "total", "Unit": "Milliseconds"}]
+        metrics += [{"Name": name, "Unit": "Milliseconds"} for name in timer.stages]
+        metrics += [{"Name": name, "Unit": "Count"} for name in timer.counters]
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["name"]],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            **timer.to_dict(),
+        }
+        sys.stdout.write(json.dumps(document) + "\n")
+        sys.stdout.flush()
+
+    elif METRICS_SINK == "statsd":
+        global _statsd
+        if _statsd is None:
+            _statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        prefix = f"{METRICS_NAMESPACE}.{timer.name}"
+        lines = [f"{prefix}.total:{timer.duration * 1000:.3f}|ms"]
+        lines += [
+            f"{prefix}.{name}:{sec * 1000:.3f}|ms" for name, sec in timer.stages.items()
+        ]
+        lines += [
+            f"{prefix}.{name}:{value}|c" for name, value in timer.counters.items()
+        ]
+        _statsd.sendto("\n".join(lines).encode(), (STATSD_HOST, STATSD_PORT))
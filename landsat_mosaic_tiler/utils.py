@@ -2,13 +2,12 @@
 
 import hashlib
 import json
-from typing import Any, Tuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Sequence, Set, Tuple
 from urllib.parse import urlencode
 
 import numpy
-from rio_color.operations import parse_operations
-from rio_color.utils import scale_dtype, to_math_type
-from rio_tiler.utils import linear_rescale
 
 
 def get_tilejson(mosaic_def, url, tile_scale, tile_format, host, path="", **kwargs):
@@ -56,13 +55,85 @@ def get_hash(**kwargs: Any) -> str:
     ).hexdigest()
 
 
-def post_process_tile(
+def scene_pathrow(sceneid: str) -> str:
+    """Path/row ("044034") of a Landsat scene id (collection or pre-collection)."""
+    if "_" in sceneid:
+        return sceneid.split("_")[2]
+    return sceneid[3:9]
+
+
+def scene_date(sceneid: str) -> str:
+    """Acquisition date (YYYYMMDD) of a Landsat scene id."""
+    if "_" in sceneid:
+        return sceneid.split("_")[3]
+    year, doy = int(sceneid[9:13]), int(sceneid[13:16])
+    return datetime.strftime(datetime(year, 1, 1) + timedelta(days=doy - 1), "%Y%m%d")
+
+
+def merge_assets(
+    existing: Sequence[str], new: Sequence[str], prefer_newer: bool = True
+) -> List[str]:
+    """Merge new scenes into the asset list of a quadkey.
+
+    Existing assets keep their position (and so their priority). A new scene
+    for a path/row already in the list replaces the existing one in place if
+    `prefer_newer` is set and it was acquired later; scenes for new path/rows
+    are appended in their own priority order.
+    """
+    merged = list(existing)
+    positions = {scene_pathrow(asset): idx for idx, asset in enumerate(merged)}
+    for asset in new:
+        if asset in merged:
+            continue
+
+        pathrow = scene_pathrow(asset)
+        idx = positions.get(pathrow)
+        if idx is None:
+            positions[pathrow] = len(merged)
+            merged.append(asset)
+        elif prefer_newer and scene_date(asset) > scene_date(merged[idx]):
+            merged[idx] = asset
+
+    return merged
+
+
+def merge_tiles(
+    existing: Dict[str, List[str]],
+    new: Dict[str, List[str]],
+    prefer_newer: bool = True,
+) -> Tuple[Dict[str, List[str]], Set[str]]:
+    """Merge delta mosaic `tiles`, return merged tiles and the changed quadkeys."""
+    tiles = dict(existing)
+    changed = set()
+    for quadkey, assets in new.items():
+        merged = merge_assets(existing.get(quadkey, []), assets, prefer_newer)
+        if merged != existing.get(quadkey):
+            tiles[quadkey] = merged
+            changed.add(quadkey)
+
+    return tiles, changed
+
+
+def bump_version(version: str = None) -> str:
+    """Increment the patch number of a mosaic version ("1.0.0" -> "1.0.1")."""
+    parts = (version or "1.0.0").split(".")
+    try:
+        parts[-1] = str(int(parts[-1]) + 1)
+    except ValueError:
+        parts.append("1")
+    return ".".join(parts)
+
+
+def _reference_post_process(
     tile: numpy.ndarray,
     mask: numpy.ndarray,
     rescale: str = None,
-    color_formula: str = None,
-) -> Tuple[numpy.ndarray, numpy.ndarray]:
-    """Tile data post processing."""
+    operations: Sequence[Callable] = (),
+) -> numpy.ndarray:
+    """Rescale and apply color operations band by band (reference pipeline)."""
+    from rio_color.utils import scale_dtype, to_math_type
+    from rio_tiler.utils import linear_rescale
+
     if rescale:
         rescale_arr = (tuple(map(float, rescale.split(","))),) * tile.shape[0]
         for bdx in range(tile.shape[0]):
@@ -75,14 +146,110 @@ def post_process_tile(
             )
         tile = tile.astype(numpy.uint8)
 
-    if color_formula:
+    if operations:
         if issubclass(tile.dtype.type, numpy.floating):
             tile = tile.astype(numpy.int16)
 
         # make sure one last time we don't have
         # negative value before applying color formula
         tile[tile < 0] = 0
-        for ops in parse_operations(color_formula):
+        for ops in operations:
             tile = scale_dtype(ops(to_math_type(tile)), numpy.uint8)
 
     return tile
+
+
+@lru_cache(maxsize=64)
+def _lookup_tables(
+    dtype: str,
+    count: int,
+    rescale: str = None,
+    color_formula: str = None,
+    nops: int = 0,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Per-band uint8 lookup tables of rescale + the first `nops` color operations.
+
+    Tables are built by running the reference pipeline once over every value of
+    `dtype`, plus one masked pixel whose output is returned separately.
+    """
+    unsigned = numpy.dtype(dtype.replace("i", "u"))
+    domain = numpy.arange(numpy.iinfo(unsigned).max + 2, dtype=numpy.int64)
+    domain[-1] = 0
+    domain = domain.astype(unsigned).view(dtype)
+
+    tile = numpy.repeat(domain[None, None, :], count, axis=0)
+    mask = numpy.full((1, domain.size), 255, dtype=numpy.uint8)
+    mask[0, -1] = 0
+
+    operations = []
+    if color_formula:
+        from rio_color.operations import parse_operations
+
+        operations = parse_operations(color_formula)[:nops]
+    tables = _reference_post_process(tile, mask, rescale, operations)[:, 0, :]
+    tables = numpy.ascontiguousarray(tables, dtype=numpy.uint8)
+    tables.setflags(write=False)
+    return tables[:, :-1], tables[:, -1]
+
+
+def post_process_tile(
+    tile: numpy.ndarray,
+    mask: numpy.ndarray,
+    rescale: str = None,
+    color_formula: str = None,
+) -> numpy.ndarray:
+    """Tile data post processing.
+
+    Rescaling and the per-band color operations (gamma, sigmoidal) map each
+    value independently, so for 8 and 16 bits tiles they are fused into one
+    lookup table per band, applied in a single pass. Float tiles are rescaled
+    in place. `saturation` mixes bands and runs as a regular operation.
+    """
+    if not rescale and not color_formula:
+        return tile
+
+    operations = []
+    if color_formula:
+        from rio_color.operations import parse_operations
+
+        operations = parse_operations(color_formula)
+    names = [ops.__name__ for ops in operations]
+    nops = names.index("saturation") if "saturation" in names else len(names)
+
+    if issubclass(tile.dtype.type, numpy.floating):
+        if rescale:
+            # Same operations as `linear_rescale`, without temporaries
+            imin, imax = map(float, rescale.split(","))
+            numpy.clip(tile, imin, imax, out=tile)
+            tile -= imin
+            tile /= imax - imin
+            tile *= 255
+            numpy.multiply(tile, mask != 0, out=tile)
+            tile = tile.astype(numpy.uint8)
+            rescale = None
+        else:
+            tile = tile.astype(numpy.int16)
+
+    if tile.dtype.kind not in "ui" or tile.dtype.itemsize > 2:
+        return _reference_post_process(tile, mask, rescale, operations)
+
+    if rescale or nops:
+        tables, masked = _lookup_tables(
+            tile.dtype.str, tile.shape[0], rescale, color_formula, nops
+        )
+        index = tile.view(tile.dtype.str.replace("i", "u"))
+        output = numpy.empty(tile.shape, dtype=numpy.uint8)
+        for bdx in range(tile.shape[0]):
+            numpy.take(tables[bdx], index[bdx], out=output[bdx])
+
+        if rescale:
+            # Bitwise blend of the masked value (0xFF/0x00 masks, no indexing)
+            valid = numpy.negative((mask != 0).view(numpy.uint8))
+            numpy.bitwise_and(output, valid, out=output)
+            invalid = numpy.invert(valid)
+            for bdx in numpy.flatnonzero(masked):
+                numpy.bitwise_or(output[bdx], invalid & masked[bdx], out=output[bdx])
+
+        tile = output
+
+    return _reference_post_process(tile, mask, operations=operations[nops:])
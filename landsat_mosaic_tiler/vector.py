@@ -0,0 +1,422 @@
+"""landsat_mosaic_tiler.vector: vector tiles (MVT) of the layout of a mosaic.
+
+Tiles are built from the mosaic definition and its footprints sidecar only
+(no COG is read), with two layers:
+
+    - `quadkeys`: the square of each quadkey within the tile, with its
+      `quadkey`, number of assets (`count`) and `assets` (comma separated,
+      in mosaic order)
+    - `scenes`: the footprint of each scene listed by these quadkeys, with
+      its `id`, `date`, `path`, `row` and `cloud` cover. Scenes missing from
+      the footprints sidecar are drawn as the bounding box of their quadkeys
+      within the tile, without cloud cover.
+
+Tiles spanning more than `MVT_MAX_QUADKEYS` quadkeys (zoomed out too far from
+the mosaic quadkey zoom) are empty.
+
+All the features of a layer are written as one numpy array of protobuf
+varints. Quadkey and scene properties are cached per mosaic version, and
+encoded tiles in `vector_cache`.
+"""
+
+import os
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import mercantile
+import numpy
+
+from landsat_mosaic_tiler import timing
+from landsat_mosaic_tiler.cache import LRUCache, mosaic_cache
+from landsat_mosaic_tiler.footprints import clip_polygon, get_footprints
+from landsat_mosaic_tiler.quadkey_index import int_to_quadkey, key_range, key_to_xy
+from landsat_mosaic_tiler.utils import scene_date, scene_pathrow
+
+MVT_EXTENT = int(os.getenv("MVT_EXTENT", 4096))
+MVT_BUFFER = int(os.getenv("MVT_BUFFER", 64))
+MVT_MAX_QUADKEYS = int(os.getenv("MVT_MAX_QUADKEYS", 4096))
+# Most quadkeys looked up one by one, for backends without a quadkey table
+MVT_MAX_LOOKUPS = int(os.getenv("MVT_MAX_LOOKUPS", 64))
+
+vector_cache = LRUCache(maxsize=int(os.getenv("MVT_CACHE_SIZE", 512)))
+properties_cache = LRUCache(maxsize=16)
+
+# Geometry commands (command id | count << 3)
+MOVE_TO = 1 | 1 << 3
+CLOSE_PATH = 7 | 1 << 3
+POLYGON = 3
+
+
+def varint_sizes(values: numpy.ndarray) -> numpy.ndarray:
+    """Size (bytes) of the varints of non-negative integers."""
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    sizes = numpy.ones(values.shape, dtype=numpy.int64)
+    for k in range(1, 10):
+        sizes += values >= numpy.uint64(1 << (7 * k))
+    return sizes
+
+
+def encode_varints(values: Sequence[int]) -> bytes:
+    """Protobuf varints of non-negative integers."""
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    sizes = varint_sizes(values)
+    starts = numpy.cumsum(sizes) - sizes
+    out = numpy.zeros(int(sizes.sum()), dtype=numpy.uint8)
+    for k in range(int(sizes.max(initial=0))):
+        sel = sizes > k
+        byte = (values[sel] >> numpy.uint64(7 * k)) & numpy.uint64(0x7F)
+        byte |= numpy.where(sizes[sel] > k + 1, numpy.uint64(0x80), numpy.uint64(0))
+        out[starts[sel] + k] = byte
+    return out.tobytes()
+
+
+def zigzag(values: Sequence[int]) -> numpy.ndarray:
+    """Zigzag encoding of signed integers."""
+    values = numpy.asarray(values, dtype=numpy.int64)
+    return ((values << 1) ^ (values >> 63)).astype(numpy.uint64)
+
+
+def _field(tag: int, body: bytes) -> bytes:
+    return bytes([tag]) + encode_varints([len(body)]) + body
+
+
+def _value(value: Any) -> bytes:
+    """Body of a `Value` message."""
+    if isinstance(value, bool):
+        return bytes([0x38, int(value)])
+    if isinstance(value, int):
+        if value >= 0:
+            return b"\x28" + encode_varints([value])
+        return b"\x30" + encode_varints(zigzag([value]))
+    if isinstance(value, float):
+        return b"\x19" + struct.pack("<d", value)
+    return _field(0x0A, str(value).encode())
+
+
+def _segment_sums(values: numpy.ndarray, counts: numpy.ndarray) -> numpy.ndarray:
+    ends = numpy.cumsum(counts)
+    totals = numpy.concatenate([[0], numpy.cumsum(values)])
+    return totals[ends] - totals[ends - counts]
+
+
+def _positions(starts: numpy.ndarray, counts: numpy.ndarray) -> numpy.ndarray:
+    """Indexes of `counts` items from each of `starts`."""
+    local = numpy.arange(counts.sum()) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts
+    )
+    return numpy.repeat(starts, counts) + local
+
+
+def encode_layer(
+    name: str,
+    properties: Dict[str, Sequence[Any]],
+    geometry: numpy.ndarray,
+    counts: numpy.ndarray,
+    extent: int = MVT_EXTENT,
+) -> bytes:
+    """Encode a layer of polygons as a vector tile field.
+
+    Args:
+        - properties: Values of each property, one per feature (None: unset)
+        - geometry: Geometry commands of all the features, concatenated
+        - counts: Number of geometry commands of each feature
+
+    """
+    nfeatures = len(counts)
+    if not nfeatures:
+        return b""
+
+    # Tags are (key index, value index) pairs, values are shared by all keys
+    values: Dict[Tuple[type, Any], int] = {}
+    columns, valid = [], []
+    for kdx, column in enumerate(properties.values()):
+        ids = [
+            values.setdefault((type(v), v), len(values)) if v is not None else -1
+            for v in column
+        ]
+        columns.extend([numpy.full(nfeatures, kdx), numpy.array(ids)])
+        valid.extend([numpy.array(ids) >= 0] * 2)
+
+    valid = numpy.stack(valid, axis=1)
+    tags = numpy.stack(columns, axis=1)[valid].astype(numpy.uint64)
+    ntags = valid.sum(axis=1)
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+
+    tags_length = _segment_sums(varint_sizes(tags), ntags)
+    geometry_length = _segment_sums(varint_sizes(geometry), counts)
+    feature_length = (
+        1
+        + varint_sizes(tags_length)
+        + tags_length
+        + 3
+        + varint_sizes(geometry_length)
+        + geometry_length
+    )
+
+    # Feature messages: features field (2), tags field (2), tags, type field
+    # (3), type, geometry field (4), geometry
+    width = 8 + ntags + counts
+    starts = numpy.cumsum(width) - width
+    tokens = numpy.zeros(int(width.sum()), dtype=numpy.uint64)
+    tokens[starts] = 0x12
+    tokens[starts + 1] = feature_length
+    tokens[starts + 2] = 0x12
+    tokens[starts + 3] = tags_length
+    tokens[_positions(starts + 4, ntags)] = tags
+    after = starts + 4 + ntags
+    tokens[after] = 0x18
+    tokens[after + 1] = POLYGON
+    tokens[after + 2] = 0x22
+    tokens[after + 3] = geometry_length
+    tokens[_positions(after + 4, counts)] = geometry
+
+    body = [b"\x78\x02", _field(0x0A, name.encode()), encode_varints(tokens)]
+    body.extend(_field(0x1A, key.encode()) for key in properties)
+    body.extend(_field(0x22, _value(value)) for _, value in values)
+    body.append(b"\x28" + encode_varints([extent]))
+    return _field(0x1A, b"".join(body))
+
+
+def rectangles(
+    x0: numpy.ndarray, y0: numpy.ndarray, x1: numpy.ndarray, y1: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Geometry commands (and their counts) of rectangles in tile coordinates."""
+    width, height = x1 - x0, y1 - y0
+    zero = numpy.zeros(len(x0), dtype=numpy.uint64)
+    commands = numpy.stack(
+        [
+            numpy.full(len(x0), MOVE_TO, dtype=numpy.uint64),
+            zigzag(x0),
+            zigzag(y0),
+            numpy.full(len(x0), 2 | 3 << 3, dtype=numpy.uint64),
+            zigzag(width),
+            zero,
+            zero,
+            zigzag(height),
+            zigzag(-width),
+            zero,
+            numpy.full(len(x0), CLOSE_PATH, dtype=numpy.uint64),
+        ],
+        axis=1,
+    )
+    return commands.ravel(), numpy.full(len(x0), 11)
+
+
+def ring(points: numpy.ndarray) -> Optional[numpy.ndarray]:
+    """Geometry commands of a polygon in tile coordinates (None if empty)."""
+    points = numpy.rint(points).astype(numpy.int64)
+    points = points[(points != numpy.roll(points, 1, axis=0)).any(axis=1)]
+    if len(points) < 3:
+        return None
+
+    x, y = points[:, 0], points[:, 1]
+    area = numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1))
+    if area == 0:
+        return None
+    if area < 0:
+        points = points[::-1]
+
+    deltas = zigzag(numpy.diff(points, axis=0, prepend=[[0, 0]])).ravel()
+    line_to = 2 | (len(points) - 1) << 3
+    return numpy.concatenate(
+        [[MOVE_TO], deltas[:2], [line_to], deltas[2:], [CLOSE_PATH]]
+    ).astype(numpy.uint64)
+
+
+def _quadkey_zoom(mosaic: Any) -> int:
+    quadkey_zoom = getattr(mosaic, "quadkey_zoom", None)
+    if quadkey_zoom is None:
+        mosaic_def = dict(mosaic.mosaic_def)
+        quadkey_zoom = mosaic_def.get("quadkey_zoom", mosaic_def["minzoom"])
+    return quadkey_zoom
+
+
+def mosaic_rows(
+    mosaic: Any, x: int, y: int, z: int
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, List[str]]:
+    """Keys, offsets, asset ids and assets of the quadkeys within tile x/y/z."""
+    if hasattr(mosaic, "rows"):
+        return (*mosaic.rows(x, y, z), mosaic.assets)
+
+    # Other backends (e.g. DynamoDB): look the quadkeys up one by one
+    quadkey_zoom = _quadkey_zoom(mosaic)
+    start, stop = key_range(x, y, z, quadkey_zoom)
+    keys, offsets, ids = [], [0], []
+    table: Dict[str, int] = {}
+    if stop - start <= MVT_MAX_LOOKUPS:
+        candidates = numpy.arange(start, stop, dtype=numpy.uint64)
+        for key, qx, qy in zip(candidates, *key_to_xy(candidates)):
+            assets = mosaic.tile(int(qx), int(qy), quadkey_zoom)
+            if assets:
+                keys.append(key)
+                ids.extend(table.setdefault(asset, len(table)) for asset in assets)
+                offsets.append(len(ids))
+
+    return (
+        numpy.array(keys, dtype=numpy.uint64),
+        numpy.array(offsets, dtype=numpy.uint32),
+        numpy.array(ids, dtype=numpy.uint32),
+        list(table),
+    )
+
+
+def _scene_properties(sceneid: str) -> Tuple:
+    try:
+        date = scene_date(sceneid)
+        pathrow = scene_pathrow(sceneid)
+        return f"{date[:4]}-{date[4:6]}-{date[6:]}", int(pathrow[:3]), int(pathrow[3:])
+    except (IndexError, ValueError):
+        return None, None, None
+
+
+def _scene_boxes(
+    offsets: numpy.ndarray, asset_ids: numpy.ndarray, squares: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Asset ids in order of first appearance, and the bounding box of their
+    quadkey squares (left, top, right, bottom columns).
+    """
+    ids, first, inverse = numpy.unique(
+        asset_ids, return_index=True, return_inverse=True
+    )
+    rows = numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+    boxes = numpy.empty((len(ids), 4), dtype=squares.dtype)
+    boxes[:, :2] = MVT_EXTENT + MVT_BUFFER
+    boxes[:, 2:] = -MVT_BUFFER
+    for col, reduce in enumerate([numpy.minimum] * 2 + [numpy.maximum] * 2):
+        reduce.at(boxes[:, col], inverse, squares[rows, col])
+
+    order = numpy.argsort(first)
+    return ids[order], boxes[order]
+
+
+def _scenes_layer(
+    url: str,
+    mosaic: Any,
+    cached: Dict[str, Tuple],
+    scenes: List[str],
+    boxes: numpy.ndarray,
+    bounds: mercantile.Bbox,
+) -> bytes:
+    footprints = get_footprints(url)
+    if footprints is not None:
+        if footprints.version != dict(mosaic.mosaic_def).get("version"):
+            footprints = None
+
+    size = bounds.right - bounds.left
+    clip_box = mercantile.Bbox(
+        -MVT_BUFFER, -MVT_BUFFER, MVT_EXTENT + MVT_BUFFER, MVT_EXTENT + MVT_BUFFER
+    )
+
+    geometries, properties = [], []
+    for sceneid, (left, top, right, bottom) in zip(scenes, boxes):
+        row = footprints.rows.get(sceneid) if footprints is not None else None
+        if row is not None:
+            polygon = footprints.polygon(row)
+            pixels = numpy.stack(
+                [
+                    (polygon[:, 0] - bounds.left) * MVT_EXTENT / size,
+                    (bounds.top - polygon[:, 1]) * MVT_EXTENT / size,
+                ],
+                axis=1,
+            )
+            commands = ring(clip_polygon(pixels, clip_box))
+            cloud = round(float(footprints.cloud[row]), 2)
+        else:
+            corners = [[left, top], [right, top], [right, bottom], [left, bottom]]
+            commands = ring(numpy.array(corners))
+            cloud = None
+
+        if commands is None:
+            continue
+
+        record = cached.get(sceneid)
+        if record is None:
+            record = cached[sceneid] = _scene_properties(sceneid)
+        geometries.append(commands)
+        properties.append((sceneid, *record, cloud))
+
+    if not geometries:
+        return b""
+
+    return encode_layer(
+        "scenes",
+        dict(zip(["id", "date", "path", "row", "cloud"], zip(*properties))),
+        numpy.concatenate(geometries),
+        numpy.array([len(commands) for commands in geometries]),
+    )
+
+
+def _vector_tile(url: str, mosaic: Any, version: str, x: int, y: int, z: int) -> bytes:
+    start, stop = key_range(x, y, z, _quadkey_zoom(mosaic))
+    if stop - start > MVT_MAX_QUADKEYS:
+        return b""
+
+    with timing.stage("lookup"):
+        keys, offsets, asset_ids, assets = mosaic_rows(mosaic, x, y, z)
+    if not len(keys):
+        return b""
+
+    cached = properties_cache.get((url, version))
+    if cached is None:
+        cached = {"quadkeys": {}, "scenes": {}}
+        properties_cache.set((url, version), cached)
+
+    with timing.stage("encode"):
+        # Quadkey squares (left, top, right, bottom) in tile coordinates,
+        # clipped to the tile buffer
+        quadkey_zoom = _quadkey_zoom(mosaic)
+        qx, qy = key_to_xy(keys)
+        scale = MVT_EXTENT * 2.0 ** (z - quadkey_zoom)
+        squares = numpy.stack(
+            [qx * scale - x * MVT_EXTENT, qy * scale - y * MVT_EXTENT], axis=1
+        )
+        squares = numpy.concatenate([squares, squares + scale], axis=1)
+        squares = numpy.clip(
+            numpy.rint(squares), -MVT_BUFFER, MVT_EXTENT + MVT_BUFFER
+        ).astype(numpy.int64)
+
+        quadkeys = cached["quadkeys"]
+        records = []
+        for row, key in enumerate(keys.tolist()):
+            record = quadkeys.get(key)
+            if record is None:
+                ids = asset_ids[offsets[row] : offsets[row + 1]]
+                record = quadkeys[key] = (
+                    int_to_quadkey(key, quadkey_zoom),
+                    len(ids),
+                    ",".join(assets[i] for i in ids),
+                )
+            records.append(record)
+
+        # Squares smaller than a tile coordinate are dropped
+        left, top, right, bottom = squares.T
+        keep = numpy.flatnonzero((right > left) & (bottom > top))
+        geometry, counts = rectangles(*squares[keep].T)
+        content = encode_layer(
+            "quadkeys",
+            dict(zip(["quadkey", "count", "assets"], zip(*[records[i] for i in keep]))),
+            geometry,
+            counts,
+        )
+
+        ids, boxes = _scene_boxes(offsets, asset_ids, squares)
+        scenes = [assets[i] for i in ids]
+        bounds = mercantile.xy_bounds(x, y, z)
+        content += _scenes_layer(url, mosaic, cached["scenes"], scenes, boxes, bounds)
+
+    return content
+
+
+def vector_tile(url: str, x: int, y: int, z: int) -> Optional[bytes]:
+    """Vector tile x/y/z of a mosaic (None if no quadkey is within it)."""
+    with timing.stage("fetch"):
+        mosaic = mosaic_cache.get(url)
+    version = mosaic_cache.version(url) or dict(mosaic.mosaic_def).get("version")
+
+    key = (url, version, z, x, y)
+    content = vector_cache.get(key)
+    if content is None:
+        content = _vector_tile(url, mosaic, version, x, y, z)
+        vector_cache.set(key, content)
+
+    return content or None
@@ -0,0 +1,79 @@
+"""landsat_mosaic_tiler.warmup: opt-in warm-up of the tile handler.
+
+With `WARMUP=TRUE`, importing `landsat_mosaic_tiler.handlers.tiles` also:
+
+    - imports the modules of the read and render path (rasterio, rio-tiler, ...)
+    - loads GDAL and its GTiff driver, with an in-memory GeoTIFF round trip
+    - opens the mosaics listed in `WARMUP_MOSAIC_URLS` (comma separated)
+
+so that this work is done in the Lambda init phase, and not by the first
+request of a cold start.
+"""
+
+import importlib
+import json
+import logging
+import os
+import time
+import warnings
+from typing import Dict, Sequence
+
+import numpy
+
+from landsat_mosaic_tiler.cache import mosaic_cache
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.getenv("WARMUP", "FALSE").upper() == "TRUE"
+WARMUP_MOSAIC_URLS = [
+    url.strip() for url in os.getenv("WARMUP_MOSAIC_URLS", "").split(",") if url.strip()
+]
+
+# Modules of the tile read and render path
+RENDER_MODULES = [
+    "landsat_mosaic_tiler.pixel_methods",
+    "landsat_mosaic_tiler.reader",
+    "landsat_mosaic_tiler.tilers",
+    "rio_tiler.profiles",
+    "rio_tiler.utils",
+]
+
+
+def _load_gdal():
+    import rasterio
+    from rasterio.errors import NotGeoreferencedWarning
+    from rasterio.io import MemoryFile
+
+    profile = dict(driver="GTiff", count=1, dtype="uint8", width=16, height=16)
+    with warnings.catch_warnings(), rasterio.Env(), MemoryFile() as memfile:
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with memfile.open(**profile) as dst:
+            dst.write(numpy.zeros((1, 16, 16), dtype=numpy.uint8))
+        with memfile.open() as src:
+            src.read(1)
+
+
+def warmup(urls: Sequence[str] = WARMUP_MOSAIC_URLS) -> Dict[str, float]:
+    """Preload the render path and the mosaics, return the seconds per step.
+
+    Failures are logged: the warm-up never prevents the handler from loading.
+    """
+
+    def _imports():
+        for module in RENDER_MODULES:
+            importlib.import_module(module)
+
+    steps = [("imports", _imports), ("gdal", _load_gdal)]
+    steps += [(f"mosaic:{url}", lambda url=url: mosaic_cache.get(url)) for url in urls]
+
+    seconds = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as err:
+            logger.warning(f"Warm-up step {name} failed: {err}")
+        seconds[name] = round(time.perf_counter() - start, 4)
+
+    logger.info(json.dumps({"warmup": seconds}))
+    return seconds
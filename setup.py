@@ -12,11 +12,14 @@ inst_reqs = [
     "landsat-cogeo-mosaic==0.1.1",
     "loguru",
     "mercantile",
+    "numexpr",
     "rio-color",
     "rio-tiler==2.0a11",
     "rio-tiler-mosaic==0.0.1dev5",
+    "supermercado",
 ]
 extra_reqs = {
+    "compression": ["lz4", "zstandard"],
     "test": ["pytest", "pytest-cov", "mock"],
     "dev": ["pytest", "pytest-cov", "pre-commit", "mock"],
 }
@@ -44,5 +47,11 @@ setup(
     zip_safe=False,
     install_requires=inst_reqs,
     extras_require=extra_reqs,
-    entry_points={"console_scripts": ["landsat-mosaic = landsat_mosaic_tiler.scripts.cli:run"]},
+    entry_points={
+        "console_scripts": [
+            "landsat-mosaic = landsat_mosaic_tiler.scripts.cli:run",
+            "landsat-mosaic-pyramid = landsat_mosaic_tiler.scripts.pyramid:build",
+            "landsat-mosaic-pack = landsat_mosaic_tiler.scripts.packed:cli",
+        ]
+    },
 )
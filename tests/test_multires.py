@@ -0,0 +1,97 @@
+"""Tests for the tile family rendering."""
+
+import math
+
+import numpy
+import pytest
+
+from landsat_mosaic_tiler.handlers import tiles
+
+# Pixels per zoom 10 tile of the grid the reads average (e.g. 12 for @1x)
+GRID = 256 * 12
+
+
+def _read_tile(assets, x, y, z, tilesize, pixel_selection, **kwargs):
+    """NDVI-like values (-1 to 1): pixel means of a fixed fine grid.
+
+    Reads at any resolution agree, as a block average of a read is the read at
+    the lower resolution.
+    """
+    block = GRID * 2**10 // (tilesize * 2**z)
+    cols = numpy.arange(x * tilesize * block, (x + 1) * tilesize * block)
+    rows = numpy.arange(y * tilesize * block, (y + 1) * tilesize * block)
+    col_means = numpy.sin(cols * 0.004).reshape(tilesize, block).mean(axis=1)
+    row_means = numpy.cos(rows * 0.0025).reshape(tilesize, block).mean(axis=1)
+    data = numpy.outer(row_means, col_means)
+    mask = numpy.full((tilesize, tilesize), 255, dtype=numpy.uint8)
+    return data[numpy.newaxis].astype(numpy.float32), mask
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    """Mosaic of a single asset, read with `_read_tile`."""
+    monkeypatch.setattr(tiles, "_get_assets", lambda *args, **kwargs: ["scene"])
+    monkeypatch.setattr(tiles, "_read_tile", _read_tile)
+
+
+@pytest.mark.parametrize("scale,children", [(1, 1), (2, 1), (1, 2), (3, 1), (3, 2)])
+def test_render_family(reader, scale, children):
+    """The tiles of a family are the tiles rendered alone."""
+    options = dict(ext="bin", expr="(b5-b4)/(b5+b4)", rescale="-1,1")
+    family = tiles.render_family("mosaic", 10, 300, 400, [scale], children, **options)
+
+    read_scale = scale * 2 * children // math.gcd(scale, 2 * children)
+    assert (10, 300, 400, scale) in family
+    assert len(family) == 4 + sum(read_scale % s == 0 for s in range(1, 13))
+    for (z, x, y, tscale), response in family.items():
+        expected = tiles.render_tile("mosaic", z, x, y, scale=tscale, **options)
+        assert response[0] == expected[0] == "OK"
+        data = numpy.frombuffer(bytes(response[2]), dtype=numpy.uint8)
+        assert data.size == (256 * tscale) ** 2
+
+        # Slices of the read are exact, block averages up to rounding
+        expected = numpy.frombuffer(bytes(expected[2]), dtype=numpy.uint8)
+        delta = numpy.abs(data.astype(int) - expected)
+        exact = tscale * 2 ** (z - 10) == read_scale
+        assert delta.max() <= (0 if exact else 1)
+
+
+class MemoryCache(dict):
+    """Tile cache keeping responses in a dict."""
+
+    def set(self, key, response):
+        """Cache response."""
+        self[key] = response
+
+
+@pytest.mark.parametrize("scale,children", [(2, 1), (4, 2), (3, 1), (3, 2)])
+def test_cached_tile(reader, monkeypatch, scale, children):
+    """Tiles are cached under the key of their own size."""
+    cache = MemoryCache()
+    monkeypatch.setattr(tiles, "tile_cache", cache)
+    monkeypatch.setattr(tiles, "pyramid_tile", lambda *args, **kwargs: None)
+    monkeypatch.setattr(tiles.mosaic_cache, "get", lambda url: tiles.mosaic_cache)
+    monkeypatch.setattr(tiles.mosaic_cache, "version", lambda url: "1", raising=False)
+
+    options = dict(ext="bin", expr="(b5-b4)/(b5+b4)", rescale="-1,1")
+    response = tiles.cached_tile(
+        "mosaic", 10, 300, 400, scale=scale, children=children, **options
+    )
+    assert len(bytes(response[2])) == (256 * scale) ** 2
+
+    for (z, tscale), sizes in _cached_sizes(cache, options, scale, children).items():
+        assert sizes == {(256 * tscale) ** 2}
+
+
+def _cached_sizes(cache, options, scale, children):
+    """Sizes of the cached tiles, by zoom and scale."""
+    sizes = {}
+    for z, x, y in [(10, 300, 400), (11, 600, 800), (11, 601, 801)]:
+        for tscale in range(1, 7):
+            key = tiles.tile_key("mosaic", "1", z, x, y, scale=tscale, **options)
+            if key in cache:
+                sizes.setdefault((z, tscale), set()).add(len(bytes(cache[key][2])))
+
+    assert (10, scale) in sizes
+    assert ((11, children) in sizes) == (scale % (2 * children) == 0)
+    return sizes
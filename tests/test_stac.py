@@ -0,0 +1,161 @@
+"""Tests for the streaming STAC search and mosaic builder."""
+
+import importlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mercantile
+import pytest
+
+from landsat_mosaic_tiler import stac
+
+# Boxes spanning a few quadkeys at zoom 8, edges away from tile boundaries
+WEST = mercantile.ul(70, 97, 8)
+EAST = mercantile.ul(73, 99, 8)
+BOX = (WEST.lng + 0.2, EAST.lat + 0.2, EAST.lng + 0.2, WEST.lat - 0.2)
+OTHER_BOX = (BOX[0] + 1.4, BOX[1], BOX[2] + 1.4, BOX[3])
+
+
+def feature(sceneid, cloud, date, box):
+    """STAC item of a Landsat scene with a rectangular footprint."""
+    west, south, east, north = box
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    pathrow = sceneid.split("_")[2]
+    return {
+        "type": "Feature",
+        "id": sceneid,
+        "bbox": list(box),
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+        "properties": {
+            "datetime": f"{date}T15:50:00Z",
+            "eo:cloud_cover": cloud,
+            "landsat:product_id": sceneid,
+            "landsat:wrs_path": int(pathrow[:3]),
+            "landsat:wrs_row": int(pathrow[3:]),
+        },
+    }
+
+
+FEATURES = [
+    feature("LC08_L1TP_015033_20200610_20200625_01_T1", 30, "2020-06-10", BOX),
+    feature("LC08_L1TP_015033_20200626_20200708_01_T1", 10, "2020-06-26", BOX),
+    feature("LC08_L1TP_016033_20200703_20200715_01_T1", 20, "2020-07-03", OTHER_BOX),
+    feature("LC08_L1TP_015033_20200115_20200127_01_T1", 5, "2020-01-15", BOX),
+    feature("LC08_L1TP_016033_20200719_20200731_01_T1", 80, "2020-07-19", OTHER_BOX),
+    feature("LC08_L1TP_016033_20200804_20200816_01_T1", 40, "2020-08-04", OTHER_BOX),
+    feature("LC08_L1TP_015033_20200813_20200825_01_T1", 45, "2020-08-13", BOX),
+]
+
+
+class STACHandler(BaseHTTPRequestHandler):
+    """Serve the pages of `FEATURES` to STAC search queries."""
+
+    def do_POST(self):
+        """Return the requested page."""
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.queries.append(query)
+        end = query["page"] * query["limit"]
+        page = {"features": FEATURES[end - query["limit"] : end]}
+        if self.server.matched:
+            page["context"] = {"matched": len(FEATURES)}
+
+        body = json.dumps(page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/geo+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Silence request logs."""
+
+
+@pytest.fixture(params=[True, False], ids=["matched", "unmatched"])
+def stac_api(request, monkeypatch):
+    """Local STAC API, with or without a `matched` count, as `STAC_API_URL`."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), STACHandler)
+    server.queries = []
+    server.matched = request.param
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs=dict(poll_interval=0.05), daemon=True
+    )
+    thread.start()
+
+    monkeypatch.setenv("STAC_API_URL", f"http://127.0.0.1:{server.server_port}")
+    yield importlib.reload(stac), server
+
+    server.shutdown()
+    server.server_close()
+    monkeypatch.undo()
+    importlib.reload(stac)
+
+
+def test_search_features(stac_api):
+    """All the pages are fetched once, features are yielded in order."""
+    module, server = stac_api
+    features = list(
+        module.search_features(
+            BOX, max_cloud=50, limit=2, threads=2, max_date="2020-12-31"
+        )
+    )
+    assert [f["id"] for f in features] == [f["id"] for f in FEATURES]
+    assert sorted(query["page"] for query in server.queries) == [1, 2, 3, 4]
+
+    query = server.queries[0]
+    assert query["bbox"] == list(BOX)
+    assert query["query"] == {"eo:cloud_cover": {"gte": 0, "lte": 50}}
+    assert query["datetime"] == "2013-01-01T00:00:00Z/2020-12-31T23:59:59Z"
+
+
+def test_to_scene():
+    """Features are reduced to compact scenes."""
+    scene = stac.to_scene(FEATURES[0])
+    assert scene.id == "LC08_L1TP_015033_20200610_20200625_01_T1"
+    assert scene.pathrow == "015033"
+    assert scene.cloud == 30.0
+    assert scene.date == "2020-06-10"
+    assert scene.footprint[0] == (round(BOX[0], 5), round(BOX[1], 5))
+    assert scene.geometry["coordinates"][0][2] == [round(BOX[2], 5), round(BOX[3], 5)]
+
+
+def test_search_scenes_filters(stac_api):
+    """Scenes out of the cloud cover range or seasons are dropped."""
+    module, _ = stac_api
+    scenes = module.search_scenes(
+        BOX, max_cloud=50, seasons=["summer"], max_date="2020-12-31", limit=3
+    )
+    assert [scene.id for scene in scenes] == [
+        "LC08_L1TP_015033_20200610_20200625_01_T1",
+        "LC08_L1TP_015033_20200626_20200708_01_T1",
+        "LC08_L1TP_016033_20200703_20200715_01_T1",
+        "LC08_L1TP_016033_20200804_20200816_01_T1",
+        "LC08_L1TP_015033_20200813_20200825_01_T1",
+    ]
+
+
+def test_mosaic_builder(stac_api):
+    """Quadkeys list the least cloudy scene of each path/row, by cloud cover."""
+    module, _ = stac_api
+    builder = module.MosaicBuilder(quadkey_zoom=8, minzoom=7, maxzoom=12)
+    for scene in module.search_scenes(
+        BOX, max_cloud=50, seasons=["summer"], max_date="2020-12-31", limit=3
+    ):
+        builder.add(scene)
+
+    quadkeys = {mercantile.quadkey(tile) for tile in mercantile.tiles(*BOX, 8)}
+    other = {mercantile.quadkey(tile) for tile in mercantile.tiles(*OTHER_BOX, 8)}
+    first = "LC08_L1TP_015033_20200626_20200708_01_T1"
+    second = "LC08_L1TP_016033_20200703_20200715_01_T1"
+
+    mosaic_def = builder.mosaic_def()
+    assert set(mosaic_def["tiles"]) == quadkeys | other
+    for quadkey, assets in mosaic_def["tiles"].items():
+        expected = [first] * (quadkey in quadkeys) + [second] * (quadkey in other)
+        assert assets == expected
+
+    assert mosaic_def["quadkey_zoom"] == 8
+    assert mosaic_def["bounds"] == pytest.approx(
+        [BOX[0], BOX[1], OTHER_BOX[2], OTHER_BOX[3]], abs=1e-5
+    )
+    assert {scene.id for scene in builder.used_scenes()} == {first, second}